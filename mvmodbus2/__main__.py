@@ -0,0 +1,257 @@
+"""python -m mvmodbus2: poll a device and print the registers of a map.
+
+    python -m mvmodbus2 pwrbl2.loc.ghiaia.net --map ime106 --rate 1 --count 10
+    python -m mvmodbus2 pwrmu --map socomec_a40:REGISTRI_ENERGIE --format json
+    python -m mvmodbus2 gw1 --transport rtu-tcp --port 4001 --unit 3 --map ime106
+
+Diagnostic modes (reports on stderr at the end):
+    --profile [FILE]   cProfile of the poll (FILE: pstats dump) and
+                       time per stage: request (bus), decode, output
+    --tracemalloc [N]  top N allocation sites and growth between the
+                       first and the last cycle
+    --latency-report   latency of each block: min / p50 / p90 / p99 / max
+"""
+
+import argparse
+import json
+import sys
+import time
+
+from mvmodbus2.control_loop import chat_blocking
+from mvmodbus2.functions import EFrame, ETout
+
+# pylint: disable=invalid-name
+
+MAPS = ('ime106', 'socomec_a40')
+TRANSPORTS = ('tcp', 'udp', 'rtu-tcp', 'serial')
+BAUD_RATES = (1200, 2400, 4800, 9600, 19200, 38400, 57600, 115200)  # as planner.BAUD_RATES
+
+
+def build_parser():
+    """Parser of the command line"""
+    parser = argparse.ArgumentParser(
+        prog='python -m mvmodbus2', description='Poll a modbus device with a register map')
+    parser.add_argument('host', help='host name / address, device for --transport serial')
+    parser.add_argument('--transport', choices=TRANSPORTS, default='tcp')
+    parser.add_argument('--port', type=int, default=502)
+    parser.add_argument('--baud', type=int, choices=BAUD_RATES, default=9600, help='serial speed')
+    parser.add_argument('--timeout', type=float, default=2.0)
+    parser.add_argument('--unit', type=int, default=255, help='unit identifier')
+    parser.add_argument('--map', default='ime106',
+                        help='ime106 or socomec_a40[:TABLE] (default REGISTRI_MISURE_PRECISIONE)')
+    parser.add_argument('-n', '--name', action='append', dest='names',
+                        help='register description or field (repeatable), default all')
+    parser.add_argument('--rate', type=float, default=1.0, help='cycles per second, 0: no wait')
+    parser.add_argument('--count', type=int, default=0, help='cycles, 0: until interrupted')
+    parser.add_argument('--format', choices=('text', 'json'), default='text')
+    parser.add_argument('--list', action='store_true', help='list the registers of the map')
+    parser.add_argument('--profile', nargs='?', const='', default=None, metavar='FILE')
+    parser.add_argument('--tracemalloc', nargs='?', type=int, const=10, default=None,
+                        metavar='N')
+    parser.add_argument('--latency-report', action='store_true')
+    return parser
+
+
+def register_entries(map_name, names=None):
+    """stream entries and units of map_name (module[:TABLE])"""
+    import importlib  # pylint: disable=import-outside-toplevel
+    module_name, dummy_sep, table = map_name.partition(':')
+    if module_name not in MAPS:
+        raise ValueError(f'unknown register map {module_name!r}: {", ".join(MAPS)}')
+    module = importlib.import_module(f'mvmodbus2.{module_name}')
+    register_map = getattr(module, table) if table else None
+    entries = module.stream_entries(register_map)
+    record = module.snapshot_type(register_map)
+    if names:
+        indexes = {record.index[name] for name in names}
+        entries = [entry for ndx, entry in enumerate(entries) if ndx in indexes]
+        units = [unit for ndx, unit in enumerate(record.units) if ndx in indexes]
+    else:
+        units = list(record.units)
+    return entries, units
+
+
+def open_transport(args):
+    """Transport of the command line"""
+    # pylint: disable=import-outside-toplevel
+    if args.transport == 'tcp':
+        from mvmodbus2.transports import modbus_tcp
+        return modbus_tcp(args.host, args.port, args.timeout, threadsafe=False)
+    if args.transport == 'udp':
+        from mvmodbus2.transports import modbus_udp
+        return modbus_udp(args.host, args.port, args.timeout, threadsafe=False)
+    if args.transport == 'rtu-tcp':
+        from mvmodbus2.rtu_tcp import modbus_rtu_tcp
+        return modbus_rtu_tcp(args.host, args.port, args.timeout, threadsafe=False)
+    import termios
+    from mvmodbus2.serial_line import modbus_serial
+    slave = modbus_serial(threadsafe=False)
+    slave.start_serial(args.host, getattr(termios, f'B{args.baud}'))
+    return slave
+
+
+class stage_stats:
+    """Time spent in each stage of the poll and block latencies"""
+
+    def __init__(self):
+        self.stages = {}
+        self.latencies = {}
+        self.errors = 0
+
+    def add(self, stage, seconds):
+        """seconds spent in stage"""
+        total, calls = self.stages.get(stage, (0.0, 0))
+        self.stages[stage] = (total + seconds, calls + 1)
+
+    def latency(self, block, seconds):
+        """Latency of the request of block"""
+        self.latencies.setdefault(block[:2], []).append(seconds)
+
+    def stage_report(self, out):
+        """Time per stage"""
+        grand_total = sum(total for total, dummy_calls in self.stages.values()) or 1
+        print('stage        calls    total s    mean ms      %', file=out)
+        for stage, (total, calls) in self.stages.items():
+            print(f'{stage:<10} {calls:7d} {total:10.4f} {total / calls * 1000:10.3f} '
+                  f'{total / grand_total * 100:6.1f}', file=out)
+        print(f'errors: {self.errors}', file=out)
+
+    def latency_report(self, out):
+        """Latency percentiles of each block"""
+        print('block (start, count)   n      min      p50      p90      p99      max  [ms]',
+              file=out)
+        for block, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            print(f'{str(block):<20} {len(values):4d}' + ''.join(
+                f' {value * 1000:8.2f}' for value in (
+                    values[0], percentile(values, 50), percentile(values, 90),
+                    percentile(values, 99), values[-1])), file=out)
+
+
+def percentile(values, pct):
+    """pct percentile of the sorted values (nearest rank)"""
+    return values[min(len(values) - 1, max(0, -(-len(values) * pct // 100) - 1))]
+
+
+def output(records, fmt, out):
+    """Print records ((name, value, timestamp), unit)"""
+    for (name, value, timestamp), unit in records:
+        if fmt == 'json':
+            print(json.dumps({'timestamp': timestamp, 'name': name, 'value': value,
+                              'unit': unit}, default=str), file=out)
+        else:
+            print(f'{timestamp:.3f}\t{name}\t{value}\t{unit}', file=out)
+
+
+def poll(slave, entries, units, unit_identifier, rate, count, fmt, stats, out, on_cycle=None):
+    """Read entries count cycles (0: forever) at rate cycles per second"""
+    # pylint: disable=import-outside-toplevel
+    from mvmodbus2.stream import block_request, decode_entries, entry_blocks
+    chat = chat_blocking(slave)
+    blocks = entry_blocks(entries)
+    period = 1 / rate if rate > 0 else 0
+    cycle = 0
+    next_cycle = time.monotonic()
+    while not count or cycle < count:
+        for block in blocks:
+            start = time.perf_counter()
+            try:
+                words = chat(block_request(block, 3, unit_identifier))
+            except (ETout, EFrame, OSError) as exc:
+                stats.errors += 1
+                print(f'block {block[:2]}: {type(exc).__name__} {exc}', file=sys.stderr)
+                continue
+            received = time.perf_counter()
+            stats.add('request', received - start)
+            stats.latency(block, received - start)
+            timestamp = time.time()
+            records = [(record, units[ndx]) for record, ndx in zip(
+                decode_entries(entries, block, words, timestamp), block[2])]
+            decoded = time.perf_counter()
+            stats.add('decode', decoded - received)
+            output(records, fmt, out)
+            stats.add('output', time.perf_counter() - decoded)
+        cycle += 1
+        if on_cycle is not None:
+            on_cycle(cycle)
+        next_cycle += period
+        delay = next_cycle - time.monotonic()
+        if delay > 0 and (not count or cycle < count):
+            time.sleep(delay)
+        elif delay <= 0:
+            next_cycle = time.monotonic()
+
+
+def main(argv=None, out=None):
+    """Entry point. Return the exit status"""
+    # pylint: disable=import-outside-toplevel
+    args = build_parser().parse_args(argv)
+    out = out or sys.stdout
+    report = sys.stderr
+    try:
+        entries, units = register_entries(args.map, args.names)
+    except (ValueError, AttributeError, KeyError) as exc:
+        print(f'register map: {exc}', file=report)
+        return 2
+    if args.list:
+        for (name, address, count, dummy_decode), unit in zip(entries, units):
+            print(f'{address}\t{count}\t{name}\t{unit}', file=out)
+        return 0
+    try:
+        slave = open_transport(args)
+    except OSError as exc:
+        print(f'{args.host}: {exc}', file=report)
+        return 1
+
+    stats = stage_stats()
+    snapshots = []
+    on_cycle = None
+    if args.tracemalloc is not None:
+        import tracemalloc
+        tracemalloc.start()
+
+        def on_cycle(cycle):
+            if cycle == 1:
+                snapshots.append(tracemalloc.take_snapshot())
+
+    profiler = None
+    if args.profile is not None:
+        import cProfile
+        profiler = cProfile.Profile()
+    try:
+        if profiler is not None:
+            profiler.runcall(poll, slave, entries, units, args.unit, args.rate, args.count,
+                             args.format, stats, out, on_cycle)
+        else:
+            poll(slave, entries, units, args.unit, args.rate, args.count, args.format,
+                 stats, out, on_cycle)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if hasattr(slave, 'close'):
+            slave.close()
+
+    if profiler is not None:
+        import pstats
+        if args.profile:
+            profiler.dump_stats(args.profile)
+        stats.stage_report(report)
+        pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(15)
+    if args.tracemalloc is not None:
+        import tracemalloc
+        snapshots.append(tracemalloc.take_snapshot())
+        print(f'tracemalloc top {args.tracemalloc}:', file=report)
+        for stat in snapshots[-1].statistics('lineno')[:args.tracemalloc]:
+            print(stat, file=report)
+        if len(snapshots) > 1:
+            print('growth after the first cycle:', file=report)
+            for stat in snapshots[-1].compare_to(snapshots[0], 'lineno')[:args.tracemalloc]:
+                print(stat, file=report)
+        tracemalloc.stop()
+    if args.latency_report:
+        stats.latency_report(report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
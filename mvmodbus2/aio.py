@@ -0,0 +1,230 @@
+"""asyncio transports and devices.
+
+async_tcp: Modbus TCP, answers matched to the requests by transaction
+identifier; up to max_inflight requests at the same time if the device
+allows it.
+async_rtu_tcp: RTU frames over TCP to a serial device server, framed by
+expected length and CRC as in rtu_tcp.py.
+poll_gateways drives many gateways concurrently from one event loop.
+async_meter: snapshot of a device (profile and scaling_engine) with the
+read blocks issued concurrently
+"""
+
+import asyncio
+import struct
+
+from mvmodbus2.functions import EFrame, ETout
+from mvmodbus2.rtu_tcp import rtu_bytes_left, rtu_decode, rtu_frame
+
+# pylint: disable=invalid-name
+
+
+class async_tcp:
+    """Modbus TCP connection (asyncio).
+    max_inflight: requests sent without waiting for the previous answers
+    (1 for the devices serving one request at a time)"""
+    RTU = False
+
+    def __init__(self, clie_addr, port=502, timeout=4, max_inflight=1):
+        self.clie_addr = (clie_addr, port)
+        self.timeout = timeout
+        self.max_inflight = max_inflight
+        self.transaction_identifier = 0
+        self.reader = None
+        self.writer = None
+        self.inflight = None
+        self.waiting = {}
+        self.receiver = None
+
+    async def connect(self):
+        """Open the connection, start the receiver"""
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(*self.clie_addr), self.timeout)
+        self.inflight = asyncio.Semaphore(self.max_inflight)
+        self.receiver = asyncio.ensure_future(self.receive())
+        return self
+
+    async def receive(self):
+        """Deliver every answer PDU to the request with its transaction identifier"""
+        try:
+            while True:
+                header = await self.reader.readexactly(7)
+                transaction_identifier, dummy_protocol, length, dummy_unit = struct.unpack(
+                    '> H H H B', header)
+                pdu = await self.reader.readexactly(length - 1)
+                future = self.waiting.pop(transaction_identifier, None)
+                if future is not None and not future.done():
+                    future.set_result(pdu)
+        except (OSError, asyncio.IncompleteReadError) as exc:
+            for future in self.waiting.values():
+                if not future.done():
+                    future.set_exception(ETout(f'Connection closed {exc!r}'))
+            self.waiting.clear()
+
+    async def chat(self, mod_func):
+        """Esegue la sequenza invio, risposta"""
+        async with self.inflight:
+            self.transaction_identifier = (self.transaction_identifier + 1) & 0xFFFF
+            transaction_identifier = self.transaction_identifier
+            pdu = mod_func.pdu()
+            future = asyncio.get_running_loop().create_future()
+            self.waiting[transaction_identifier] = future
+            self.writer.write(struct.pack(
+                '> H H H B', transaction_identifier, 0, len(pdu) + 1,
+                mod_func.unit_identifier) + pdu)
+            try:
+                answ = await asyncio.wait_for(future, self.timeout)
+            except asyncio.TimeoutError as exc:
+                self.waiting.pop(transaction_identifier, None)
+                raise ETout(f'No answer to {transaction_identifier}') from exc
+        return mod_func.answ(answ)
+
+    async def transact(self, mod_func):
+        """chat returning a modbus_response"""
+        return mod_func.result(await self.chat(mod_func))
+
+    async def close(self):
+        """Close the connection"""
+        self.writer.close()
+        await self.writer.wait_closed()
+        if self.receiver is not None:
+            self.receiver.cancel()
+            try:
+                await self.receiver
+            except asyncio.CancelledError:
+                pass
+
+
+class async_rtu_tcp:
+    """RTU over TCP connection to a serial device server (asyncio).
+    The transactions on the same gateway are serialized by a lock,
+    the gateways work concurrently"""
+    RTU = True
+
+    def __init__(self, clie_addr, port=502, timeout=2):
+        self.clie_addr = (clie_addr, port)
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+        self.lock = None
+
+    async def connect(self):
+        """Open the connection"""
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(*self.clie_addr), self.timeout)
+        self.lock = asyncio.Lock()
+        return self
+
+    async def reconnect(self):
+        """New connection in place of one with a late answer still on the way
+        (as modbus_rtu_tcp.drain: the late answer must not be taken
+        as the answer to the next request)"""
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except OSError:
+            pass
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(*self.clie_addr), self.timeout)
+
+    async def recv(self, mod_func):
+        """Receive the answer frame of mod_func and decode it.
+        Timeout: ETout, the connection is opened again"""
+        frame = b''
+        left = rtu_bytes_left(mod_func, frame)
+        while left > 0:
+            try:
+                frame += await asyncio.wait_for(
+                    self.reader.readexactly(left), self.timeout)
+            except asyncio.IncompleteReadError as exc:
+                raise ETout(f'Connection closed {frame + exc.partial!r}') from exc
+            except asyncio.TimeoutError as exc:
+                await self.reconnect()
+                raise ETout(f'No answer {frame!r}') from exc
+            left = rtu_bytes_left(mod_func, frame)
+        return rtu_decode(mod_func, frame)
+
+    async def chat(self, mod_func):
+        """Esegue la sequenza invio, risposta"""
+        async with self.lock:
+            self.writer.write(rtu_frame(mod_func))
+            return await self.recv(mod_func)
+
+    async def pipeline(self, requests, window=4):
+        """Send up to window requests before reading the answers.
+        See rtu_tcp.modbus_rtu_tcp.pipeline"""
+        answers = []
+        sent = 0
+        async with self.lock:
+            while len(answers) < len(requests):
+                while sent < len(requests) and sent - len(answers) < window:
+                    self.writer.write(rtu_frame(requests[sent]))
+                    sent += 1
+                try:
+                    answers.append(await self.recv(requests[len(answers)]))
+                except EFrame as exc:
+                    answers.append(exc)
+        return answers
+
+    async def transact(self, mod_func):
+        """chat returning a modbus_response"""
+        return mod_func.result(await self.chat(mod_func))
+
+    async def close(self):
+        """Close the connection"""
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+async def poll_gateways(gateways, window=4, timeout=2):
+    """Pipelined requests on many gateways at the same time.
+    gateways: {(host, port): [requests]}
+    Return {(host, port): answers or the exception of the gateway}"""
+
+    async def poll(address, requests):
+        gateway = async_rtu_tcp(*address, timeout=timeout)
+        try:
+            await gateway.connect()
+        except (OSError, asyncio.TimeoutError) as exc:
+            return exc
+        try:
+            return await gateway.pipeline(requests, window)
+        except (OSError, asyncio.TimeoutError, ETout) as exc:
+            return exc
+        finally:
+            await gateway.close()
+
+    addresses = list(gateways)
+    answers = await asyncio.gather(*(poll(address, gateways[address]) for address in addresses))
+    return dict(zip(addresses, answers))
+
+
+async def async_read_range(slave, start, count, function=3, unit_identifier=None):
+    """ranges.read_range for the asyncio transports: the chunks are read
+    concurrently, the transport limits the requests in flight"""
+    from mvmodbus2.ranges import join_answers, range_requests  # pylint: disable=import-outside-toplevel
+    return join_answers(await asyncio.gather(*(
+        slave.chat(req) for req in range_requests(start, count, function, unit_identifier))))
+
+
+async def read_blocks(slave, profile, plan, unit_identifier=None):
+    """Words of each block of a read plan (profile.py), read concurrently:
+    the transport limits the requests in flight"""
+    return await asyncio.gather(*(
+        slave.chat(profile.request(block, unit_identifier)) for block in plan))
+
+
+class async_meter:
+    """Device polled by asyncio.
+    slave: async transport (connected), engine: scaling.scaling_engine"""
+
+    def __init__(self, slave, engine, unit_identifier=None):
+        self.slave = slave
+        self.engine = engine
+        self.unit_identifier = unit_identifier
+
+    async def snapshot(self, groups=None, names=None):
+        """Values of groups (all if None) scaled. Return {register name: value}"""
+        plan = self.engine.plan_vectors(groups, names)[0]
+        blocks = await read_blocks(self.slave, self.engine.profile, plan, self.unit_identifier)
+        return self.engine.scale_blocks(blocks, groups, names)
@@ -0,0 +1,347 @@
+"""Capture of the ADU on the wire and replay.
+
+The transports (modbus_tcp, modbus_udp, modbus_serial, rtu_tcp.modbus_rtu_tcp)
+have a capture attribute, None by default: attach() sets a channel of a
+capture_writer and every sent ADU and received chunk is queued with
+its monotonic timestamp. A background thread writes the records.
+
+File format: pcap (nanosecond timestamps), link type USER0 (147),
+readable by Wireshark / tcpdump. Payload of each record:
+    direction  B   0 sent, 1 received
+    framing    B   0 MBAP (TCP / UDP), 1 RTU (unit, PDU, CRC)
+    channel    H   channel of the writer (one for each transport)
+    data           bytes as sent / received
+The timestamps are time.monotonic_ns() moved to the wall clock of the
+writer start: differences are exact.
+
+replay_transport feeds the captured answers back through the parsers
+(chat as a transport), replay() rebuilds every transaction from the
+capture, benchmark() decodes a capture at full speed
+"""
+
+import queue
+import struct
+import threading
+import time
+
+from mvmodbus2.functions import EFrame, ETout
+
+# pylint: disable=invalid-name
+
+PCAP_HEADER = struct.Struct('=IHHiIII')
+PCAP_MAGIC_NS = 0xa1b23c4d
+LINKTYPE_USER0 = 147
+SNAPLEN = 65535
+RECORD_HEADER = struct.Struct('=IIII')
+PAYLOAD_HEADER = struct.Struct('=BBH')
+
+TX = 0
+RX = 1
+MBAP = 0
+RTU = 1
+
+
+class capture_channel:
+    """Capture hook of one transport"""
+    __slots__ = ('writer', 'channel', 'framing')
+
+    def __init__(self, writer, channel, framing):
+        self.writer = writer
+        self.channel = channel
+        self.framing = framing
+
+    def tx(self, data):
+        """ADU sent"""
+        self.writer.queue.put((time.monotonic_ns(), TX, self.framing, self.channel, data))
+
+    def rx(self, data):
+        """Bytes received"""
+        self.writer.queue.put((time.monotonic_ns(), RX, self.framing, self.channel, data))
+
+
+class capture_writer:
+    """pcap file written by a background thread"""
+
+    def __init__(self, path):
+        self.file = open(path, 'wb')  # pylint: disable=consider-using-with
+        self.file.write(PCAP_HEADER.pack(
+            PCAP_MAGIC_NS, 2, 4, 0, 0, SNAPLEN, LINKTYPE_USER0))
+        self.base_ns = time.time_ns() - time.monotonic_ns()
+        self.queue = queue.SimpleQueue()
+        self.channels = 0
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def channel(self, framing=MBAP):
+        """New capture_channel"""
+        with self.lock:
+            self.channels += 1
+            return capture_channel(self, self.channels, framing)
+
+    def run(self):
+        """Write the queued records until close"""
+        write = self.file.write
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            monotonic_ns, direction, framing, channel, data = record
+            timestamp = self.base_ns + monotonic_ns
+            length = PAYLOAD_HEADER.size + len(data)
+            write(RECORD_HEADER.pack(
+                timestamp // 1000000000, timestamp % 1000000000,
+                min(length, SNAPLEN), length))
+            write(PAYLOAD_HEADER.pack(direction, framing, channel))
+            write(data[:SNAPLEN - PAYLOAD_HEADER.size])
+            if self.queue.empty():
+                self.file.flush()
+        self.file.close()
+
+    def close(self):
+        """Write the pending records and close the file"""
+        self.queue.put(None)
+        self.thread.join()
+
+
+def attach(transport, writer):
+    """Capture the traffic of transport in writer. Return the channel.
+    transport can be a wrapper (ratelimit.rate_limited, fastlane.shared_bus):
+    the hook goes to the wrapped transport"""
+    framing = RTU if getattr(transport, 'RTU', False) else MBAP
+    while not hasattr(type(transport), 'capture') and hasattr(transport, 'slave'):
+        transport = transport.slave
+    transport.capture = writer.channel(framing)
+    return transport.capture
+
+
+def read_capture(path):
+    """Records of a capture: (timestamp ns, channel, direction, framing, data).
+    A truncated last record (capture interrupted) ends the records"""
+    with open(path, 'rb') as source:
+        header = source.read(PCAP_HEADER.size)
+        if len(header) < PCAP_HEADER.size or PCAP_HEADER.unpack(header)[0] != PCAP_MAGIC_NS:
+            raise ValueError(f'{path}: not a mvmodbus2 capture')
+        while True:
+            record = source.read(RECORD_HEADER.size)
+            if len(record) < RECORD_HEADER.size:
+                return
+            seconds, nanoseconds, incl_len, dummy_orig_len = RECORD_HEADER.unpack(record)
+            if incl_len < PAYLOAD_HEADER.size:
+                raise ValueError(f'{path}: record of {incl_len} bytes')
+            payload = source.read(incl_len)
+            if len(payload) < incl_len:
+                return  # ultimo record troncato (cattura interrotta)
+            direction, framing, channel = PAYLOAD_HEADER.unpack_from(payload)
+            yield (seconds * 1000000000 + nanoseconds, channel, direction, framing,
+                   payload[PAYLOAD_HEADER.size:])
+
+
+def mbap_size(buffer):
+    """Size of the first MBAP frame in buffer, None if incomplete"""
+    if len(buffer) < 6:
+        return None
+    size = 6 + struct.unpack_from('> H', buffer, 4)[0]
+    return size if len(buffer) >= size else None
+
+
+def rtu_matches(request, buffer):
+    """True if the answer in buffer can be of the RTU request ADU
+    (same unit identifier and function code)"""
+    return buffer[0] == request[0] and (len(buffer) < 2 or buffer[1] & 0x7f == request[1])
+
+
+def rtu_size(request, buffer):
+    """Size of the RTU answer to the request ADU at the start of buffer,
+    None if incomplete. A request not decoded takes all the buffer"""
+    from mvmodbus2.rtu_tcp import rtu_bytes_left  # pylint: disable=import-outside-toplevel
+    try:
+        mod_func = request_of(RTU, request)
+    except (struct.error, IndexError):
+        mod_func = None
+    if mod_func is None:
+        return len(buffer)
+    size = 0
+    while True:
+        left = rtu_bytes_left(mod_func, buffer[:size])
+        if left <= 0:
+            return size
+        size += left
+        if size > len(buffer):
+            return None
+
+
+class _channel_pairing:
+    """Requests of one channel waiting for their answer.
+    MBAP: matched by transaction identifier, RTU: in order (first in, first out)"""
+
+    def __init__(self, framing):
+        self.framing = framing
+        self.waiting = {}  # transaction identifier (MBAP) o numero d'ordine (RTU)
+        self.sequence = 0
+        self.buffer = b''
+        self.buffer_ts = None
+
+    def first(self):
+        """Key of the oldest request waiting"""
+        return next(iter(self.waiting))
+
+    def request(self, timestamp, data):
+        """Request sent. Return the transactions closed"""
+        closed = self.flush()
+        if self.framing == MBAP:
+            key = data[:2]
+            if key in self.waiting:  # stesso identifier: la precedente senza risposta
+                closed.append(self.waiting.pop(key))
+        else:
+            self.sequence += 1
+            key = self.sequence
+        self.waiting[key] = [timestamp, self.framing, data, b'', None]
+        return closed
+
+    def answer(self, timestamp, data):
+        """Bytes received, split in frames. Return the transactions completed"""
+        self.buffer += data
+        self.buffer_ts = timestamp
+        closed = []
+        while self.buffer:
+            if self.framing == MBAP:
+                size = mbap_size(self.buffer)
+                if size is None:
+                    break
+                transaction = self.waiting.pop(self.buffer[:2], None)
+            else:
+                # richieste senza risposta (timeout, broadcast)
+                while self.waiting and not rtu_matches(self.waiting[self.first()][2], self.buffer):
+                    closed.append(self.waiting.pop(self.first()))
+                if not self.waiting:
+                    self.buffer = b''  # risposta di una richiesta non catturata
+                    break
+                size = rtu_size(self.waiting[self.first()][2], self.buffer)
+                if size is None:
+                    break
+                transaction = self.waiting.pop(self.first())
+            if transaction is not None:
+                transaction[3], transaction[4] = self.buffer[:size], timestamp
+                closed.append(transaction)
+            self.buffer = self.buffer[size:]
+        return closed
+
+    def flush(self):
+        """A frame left incomplete (timeout) goes to its request as answer.
+        Return the transaction closed, if any"""
+        closed = []
+        if self.buffer:
+            if self.framing == MBAP:
+                transaction = self.waiting.pop(self.buffer[:2], None)
+            else:
+                transaction = self.waiting.pop(self.first()) if self.waiting else None
+            if transaction is not None:
+                transaction[3], transaction[4] = self.buffer, self.buffer_ts
+                closed.append(transaction)
+            self.buffer = b''
+        return closed
+
+
+def transactions(records, channel=None):
+    """Pair the requests and the answers of each channel
+    (yielded when complete, not in request order):
+    (timestamp ns of the request, framing, request ADU, answer bytes, answer timestamp ns).
+    Pipelined requests: MBAP answers are matched by transaction identifier,
+    RTU answers are split by the expected length and matched in order.
+    A request without answer has answer b'' and answer timestamp None"""
+    channels = {}
+    for timestamp, record_channel, direction, framing, data in records:
+        if channel is not None and record_channel != channel:
+            continue
+        pairing = channels.get(record_channel)
+        if pairing is None:
+            pairing = channels[record_channel] = _channel_pairing(framing)
+        if direction == TX:
+            closed = pairing.request(timestamp, data)
+        else:
+            closed = pairing.answer(timestamp, data)
+        for transaction in closed:
+            yield tuple(transaction)
+    left = []
+    for pairing in channels.values():
+        left.extend(pairing.flush())
+        left.extend(pairing.waiting.values())
+    for transaction in sorted(left):
+        yield tuple(transaction)
+
+
+def decode_answer(mod_func, framing, answer):
+    """Answer bytes through the parser of the framing"""
+    if not answer:
+        raise ETout('No answer in the capture')
+    if framing == RTU:
+        from mvmodbus2.rtu_tcp import rtu_decode  # pylint: disable=import-outside-toplevel
+        return rtu_decode(mod_func, answer)
+    return mod_func.answ(answer[7:])
+
+
+def request_of(framing, adu):
+    """modbus_func of a captured request ADU"""
+    from mvmodbus2.proxy import request_from_pdu  # pylint: disable=import-outside-toplevel
+    if framing == RTU:
+        return request_from_pdu(adu[1:-2], adu[0])
+    return request_from_pdu(adu[7:], adu[6])
+
+
+class replay_transport:
+    """Transport answering chat with the answers of a capture,
+    in the captured order"""
+
+    def __init__(self, path, channel=None):
+        self.transactions = transactions(read_capture(path), channel)
+
+    def chat(self, mod_func):
+        """Next captured answer decoded for mod_func"""
+        try:
+            dummy_timestamp, framing, dummy_request, answer, dummy_answer_ts = next(
+                self.transactions)
+        except StopIteration as exc:
+            raise ETout('End of the capture') from exc
+        return decode_answer(mod_func, framing, answer)
+
+    def transact(self, mod_func):
+        """chat returning a modbus_response"""
+        return mod_func.result(self.chat(mod_func))
+
+
+def replay(path, channel=None):
+    """Transactions of a capture decoded again.
+    Yield (timestamp ns, mod_func, answer or exception, latency ns or None)"""
+    for timestamp, framing, request, answer, answer_ts in transactions(
+            read_capture(path), channel):
+        mod_func = request_of(framing, request)
+        if mod_func is None:
+            continue
+        try:
+            value = decode_answer(mod_func, framing, answer)
+        except (EFrame, ETout) as exc:
+            value = exc
+        except Exception as exc:  # pylint: disable=broad-except
+            value = exc  # frame rotto (struct.error ...): e' il caso da studiare
+        yield timestamp, mod_func, value, (answer_ts - timestamp if answer_ts else None)
+
+
+def benchmark(path, repeat=1):
+    """Decode the captured answers repeat times.
+    Return (decoded answers, seconds)"""
+    decoded = []
+    for dummy_ts, framing, request, answer, dummy_answer_ts in transactions(read_capture(path)):
+        mod_func = request_of(framing, request)
+        if mod_func is not None and answer:
+            decoded.append((mod_func, framing, answer))
+    count = 0
+    start = time.perf_counter()
+    for dummy in range(repeat):
+        for mod_func, framing, answer in decoded:
+            try:
+                decode_answer(mod_func, framing, answer)
+            except EFrame:
+                pass
+            count += 1
+    return count, time.perf_counter() - start
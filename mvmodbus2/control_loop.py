@@ -0,0 +1,68 @@
+"""Control loop helpers.
+Write the setpoints and read the feedback registers in a single
+FC23 (Read/Write Multiple registers) transaction.
+Slaves that reject FC23 are served with FC16 + FC3
+"""
+
+import mvmodbus2
+
+# pylint: disable=invalid-name
+
+ILLEGAL_FUNCTION = 1  # exception code: function code not supported
+
+
+def chat_blocking(slave):
+    """Return the blocking chat of the slave.
+    modbus_serial.chat is non blocking: use chat_blocking"""
+    return getattr(slave, 'chat_blocking', slave.chat)
+
+
+def fc_rejected(mod_func):
+    """True if the slave answered with exception ILLEGAL FUNCTION
+    to the last request of mod_func"""
+    return (mod_func.bus_err == mod_func.MOD_FUNC | 0x80
+            and mod_func.bytecount == ILLEGAL_FUNCTION)
+
+
+class control_loop:
+    """Setpoint write and feedback read on a single drive (slave).
+    The first FC23 rejected by the slave switches the loop
+    to FC16 + FC3 for the following exchanges"""
+
+    def __init__(self, slave, unit_identifier=None, use_fc23=True):
+        self.slave = slave
+        self.chat = chat_blocking(slave)
+        self.unit_identifier = unit_identifier
+        self.use_fc23 = use_fc23
+
+    def exchange(self, wstart_reg, regs_data, rstart_reg, rnum_regs):
+        """Write regs_data from wstart_reg, then read rnum_regs from rstart_reg.
+        Return the read registers (tuple of words).
+        With FC23 the write is performed before the read
+        as per Modbus_Application_Protocol_V1_1b3.pdf"""
+        if self.use_fc23:
+            msg = mvmodbus2.modbusf23(
+                rstart_reg, rnum_regs, wstart_reg, regs_data,
+                unit_identifier=self.unit_identifier)
+            try:
+                return self.chat(msg)
+            except mvmodbus2.EFrame:
+                if not fc_rejected(msg):
+                    raise
+                self.use_fc23 = False
+        self.chat(mvmodbus2.modbusf16(
+            wstart_reg, regs_data, unit_identifier=self.unit_identifier))
+        return self.chat(mvmodbus2.modbusf3(
+            rstart_reg, rnum_regs, unit_identifier=self.unit_identifier))
+
+
+def run_cycle(loops, setpoints):
+    """One cycle of the control loop on many drives.
+    loops: list of control_loop
+    setpoints: list of (wstart_reg, regs_data, rstart_reg, rnum_regs),
+        one for each loop
+    Return the list of the feedback registers"""
+    return [
+        loop.exchange(*setpoint)
+        for loop, setpoint in zip(loops, setpoints)
+    ]
@@ -0,0 +1,30 @@
+"""Register decoders: words read from the device -> value.
+
+One set shared by the profiles (profile.TYPES) and the device modules
+(ime106 U_WORD / S_WORD / UD_WORD, socomec_a40 U16 / S16 / U32 / S32).
+Double words are high word first. No imports: a device module or a
+profile does not load anything else through them
+"""
+
+# pylint: disable=invalid-name
+
+
+def U16(words):
+    """Unsigned word"""
+    return words[0]
+
+
+def S16(words):
+    """Signed word"""
+    return words[0] - 65536 if words[0] >= 32768 else words[0]
+
+
+def U32(words):
+    """Unsigned double word, high word first"""
+    return (words[0] << 16) | words[1]
+
+
+def S32(words):
+    """Signed double word, high word first"""
+    value = (words[0] << 16) | words[1]
+    return value - 0x100000000 if value >= 0x80000000 else value
@@ -0,0 +1,138 @@
+"""Read Device Identification (FC43 / MEI type 14)
+with a persistent cache per endpoint.
+
+The cache is a json file, by default
+$XDG_CACHE_HOME/mvmodbus2/device_id.json (~/.cache/mvmodbus2/device_id.json).
+An entry is valid for max_age seconds, after that the device is read again.
+invalidate() drops the entries of an endpoint (e.g. after a firmware update)
+"""
+
+import json
+import os
+import time
+
+import mvmodbus2
+
+# pylint: disable=invalid-name
+
+OBJECT_NAMES = {
+    0x00: 'VendorName',
+    0x01: 'ProductCode',
+    0x02: 'MajorMinorRevision',
+    0x03: 'VendorUrl',
+    0x04: 'ProductName',
+    0x05: 'ModelName',
+    0x06: 'UserApplicationName',
+}
+
+DEFAULT_MAX_AGE = 7 * 24 * 3600
+
+
+def default_cache_path():
+    """Path of the default cache file"""
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+        os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'mvmodbus2', 'device_id.json')
+
+
+def endpoint_key(slave, unit_identifier):
+    """Key of the endpoint: address of the slave and unit identifier"""
+    address = getattr(slave, 'clie_addr', None) or getattr(slave, 'address', None)
+    if address is None:
+        address = getattr(getattr(slave, 'serial', None), 'name', repr(slave))
+    if isinstance(address, tuple):
+        address = ':'.join(str(part) for part in address)
+    return f'{address}/{unit_identifier}'
+
+
+def object_name(object_id):
+    """Name of the object as in Modbus_Application_Protocol_V1_1b3.pdf"""
+    return OBJECT_NAMES.get(object_id, f'0x{object_id:02x}')
+
+
+def read_device_identification(slave, read_dev_id_code=mvmodbus2.modbusf43.BASIC,
+                               unit_identifier=None):
+    """Read all the objects of the category read_dev_id_code.
+    Follow "more follows" sending a request for each part of the stream.
+    Return (conformity_level, {object name: value str})"""
+    chat = getattr(slave, 'chat_blocking', slave.chat)
+    objects = {}
+    object_id = 0
+    conformity_level = 0
+    for _tentativi in range(0, 256):  # al massimo un oggetto per risposta
+        msg = mvmodbus2.modbusf43(
+            read_dev_id_code, object_id, unit_identifier=unit_identifier)
+        conformity_level, more_follows, object_id, part = chat(msg)
+        objects.update(part)
+        if not more_follows:
+            break
+    return (conformity_level, {
+        object_name(object_id): value.decode('latin-1')
+        for object_id, value in sorted(objects.items())
+    })
+
+
+class device_id_cache:
+    """Persistent cache of device identifications"""
+
+    def __init__(self, path=None, max_age=DEFAULT_MAX_AGE):
+        self.path = path or default_cache_path()
+        self.max_age = max_age
+        self.entries = None
+
+    def load(self):
+        """Load the cache file (once)"""
+        if self.entries is None:
+            try:
+                with open(self.path, encoding='utf-8') as cache_file:
+                    self.entries = json.load(cache_file)
+            except (OSError, ValueError):
+                self.entries = {}
+        return self.entries
+
+    def save(self):
+        """Write the cache file. Atomic replace of the previous file"""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as cache_file:
+            json.dump(self.load(), cache_file, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def get(self, key, read_dev_id_code):
+        """Cached objects or None if missing or expired"""
+        entry = self.load().get(key, {}).get(str(read_dev_id_code))
+        if entry is None or time.time() - entry['time'] > self.max_age:
+            return None
+        return entry['objects']
+
+    def put(self, key, read_dev_id_code, objects):
+        """Store the objects and save the file"""
+        self.load().setdefault(key, {})[str(read_dev_id_code)] = {
+            'time': time.time(),
+            'objects': objects,
+        }
+        self.save()
+
+    def invalidate(self, key=None):
+        """Drop the entries of key, or all entries if key is None"""
+        if key is None:
+            self.entries = {}
+        else:
+            self.load().pop(key, None)
+        self.save()
+
+
+def get_device_id(slave, read_dev_id_code=mvmodbus2.modbusf43.BASIC,
+                  unit_identifier=None, cache=None, refresh=False):
+    """Device identification of the slave, from cache if still valid.
+    cache: device_id_cache, None for the default one.
+    refresh: True to ignore the cached value"""
+    if cache is None:
+        cache = device_id_cache()
+    key = endpoint_key(slave, unit_identifier)
+    objects = None if refresh else cache.get(key, read_dev_id_code)
+    if objects is None:
+        dummy_conformity, objects = read_device_identification(
+            slave, read_dev_id_code, unit_identifier=unit_identifier)
+        cache.put(key, read_dev_id_code, objects)
+    return objects
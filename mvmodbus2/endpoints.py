@@ -0,0 +1,182 @@
+"""Endpoints: name resolution cache, socket options, bulk connect.
+
+resolver caches getaddrinfo for ttl seconds (failures for negative_ttl):
+modbus_tcp and modbus_udp resolve through default_resolver, so a
+hostname is looked up once and not at every sendto.
+socket_options: TCP_NODELAY and keepalive of an endpoint.
+connect_all opens many modbus_tcp at the same time: names resolved in
+parallel, non-blocking connects; a slow DNS or a dead host does not
+delay the others. As socket.create_connection, each resolved address
+(IPv6, IPv4) is tried in turn until one connects
+"""
+
+import errno
+import selectors
+import socket
+import threading
+import time
+
+# pylint: disable=invalid-name
+
+
+class resolver:
+    """getaddrinfo cache"""
+
+    def __init__(self, ttl=300, negative_ttl=10):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.cache = {}
+        self.lock = threading.Lock()
+
+    def resolve(self, host, port, socktype=socket.SOCK_STREAM):
+        """[(family, sockaddr)] of host, port"""
+        key = (host, port, socktype)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.cache.get(key)
+        if entry is not None and entry[0] > now:
+            if isinstance(entry[1], BaseException):
+                raise entry[1]
+            return entry[1]
+        try:
+            addresses = [
+                (family, sockaddr)
+                for family, dummy_type, dummy_proto, dummy_name, sockaddr
+                in socket.getaddrinfo(host, port, socket.AF_UNSPEC, socktype)
+            ]
+        except socket.gaierror as exc:
+            with self.lock:
+                self.cache[key] = (now + self.negative_ttl, exc)
+            raise
+        with self.lock:
+            self.cache[key] = (now + self.ttl, addresses)
+        return addresses
+
+    def address(self, host, port, socktype=socket.SOCK_STREAM):
+        """(family, sockaddr) first address of host, port"""
+        return self.resolve(host, port, socktype)[0]
+
+    def invalidate(self, host=None):
+        """Forget host (all if None)"""
+        with self.lock:
+            if host is None:
+                self.cache.clear()
+            else:
+                for key in [key for key in self.cache if key[0] == host]:
+                    del self.cache[key]
+
+
+default_resolver = resolver()
+
+
+class socket_options:
+    """Low latency options of a TCP endpoint.
+    nodelay: TCP_NODELAY (no Nagle delay on pipelined requests)
+    keepalive: SO_KEEPALIVE, with keepidle, keepintvl (s) and keepcnt if not None"""
+    __slots__ = ('nodelay', 'keepalive', 'keepidle', 'keepintvl', 'keepcnt')
+
+    def __init__(self, nodelay=True, keepalive=False, keepidle=None, keepintvl=None,
+                 keepcnt=None):
+        self.nodelay = nodelay
+        self.keepalive = keepalive
+        self.keepidle = keepidle
+        self.keepintvl = keepintvl
+        self.keepcnt = keepcnt
+
+    def apply(self, sock):
+        """Set the options on sock"""
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(self.nodelay))
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, int(self.keepalive))
+        if self.keepalive:
+            for name, value in (('TCP_KEEPIDLE', self.keepidle),
+                                ('TCP_KEEPINTVL', self.keepintvl),
+                                ('TCP_KEEPCNT', self.keepcnt)):
+                if value is not None and hasattr(socket, name):
+                    sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, name), value)
+
+
+DEFAULT_OPTIONS = socket_options()
+
+
+def endpoint_tuple(endpoint, port=502):
+    """(host, port, options) of host, (host, port) or (host, port, options)"""
+    if isinstance(endpoint, str):
+        return (endpoint, port, None)
+    if len(endpoint) == 2:
+        return (endpoint[0], endpoint[1], None)
+    return tuple(endpoint)
+
+
+def connect_all(endpoints, timeout=4, threadsafe=True, cache=None, max_outstanding=256,
+                max_resolvers=32):
+    """Open a modbus_tcp to each endpoint (host, (host, port) or
+    (host, port, socket_options)) concurrently.
+    Return {endpoint: modbus_tcp or the exception of the endpoint}"""
+    from concurrent.futures import ThreadPoolExecutor  # pylint: disable=import-outside-toplevel
+    from mvmodbus2.transports import modbus_tcp  # pylint: disable=import-outside-toplevel
+    cache = cache or default_resolver
+    endpoints = list(endpoints)
+    results = {}
+
+    def lookup(endpoint):
+        host, port, dummy_options = endpoint_tuple(endpoint)
+        try:
+            return cache.resolve(host, port)
+        except OSError as exc:
+            return exc
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_resolvers, len(endpoints)))) as pool:
+        addresses = list(pool.map(lookup, endpoints))
+
+    pending = []
+    for endpoint, address in reversed(list(zip(endpoints, addresses))):
+        if isinstance(address, BaseException):
+            results[endpoint] = address
+        else:
+            pending.append((endpoint, address))
+
+    def failed(endpoint, rest, exc):
+        """Next address of endpoint, or exc if none is left"""
+        if rest:
+            pending.append((endpoint, rest))
+        else:
+            results[endpoint] = exc
+
+    sel = selectors.DefaultSelector()
+    deadline = {}
+    while pending or sel.get_map():
+        while pending and len(sel.get_map()) < max_outstanding:
+            endpoint, ((family, sockaddr), *rest) = pending.pop()
+            try:
+                sock = socket.socket(family, socket.SOCK_STREAM)
+            except OSError as exc:
+                failed(endpoint, rest, exc)
+                continue
+            sock.setblocking(False)
+            err = sock.connect_ex(sockaddr)
+            if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                sock.close()
+                failed(endpoint, rest, OSError(err, errno.errorcode.get(err, 'connect')))
+                continue
+            sel.register(sock, selectors.EVENT_WRITE, (endpoint, rest))
+            deadline[endpoint] = time.monotonic() + timeout
+        for key, dummy_events in sel.select(timeout=0.05):
+            endpoint, rest = key.data
+            sel.unregister(key.fileobj)
+            err = key.fileobj.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if err:
+                key.fileobj.close()
+                failed(endpoint, rest, OSError(err, errno.errorcode.get(err, 'connect')))
+                continue
+            host, port, options = endpoint_tuple(endpoint)
+            results[endpoint] = modbus_tcp(host, port, timeout, threadsafe,
+                                           sock=key.fileobj, options=options)
+        now = time.monotonic()
+        for key in list(sel.get_map().values()):
+            endpoint, rest = key.data
+            if deadline[endpoint] < now:
+                sel.unregister(key.fileobj)
+                key.fileobj.close()
+                failed(endpoint, rest, socket.timeout(f'connect {endpoint}'))
+    sel.close()
+    return results
@@ -0,0 +1,295 @@
+"""Fast lane: status and alarm words polled at high frequency.
+
+A few status registers (SOCOMEC alarms 872-878, IME output relay status
+0x106f, coil images of a PLC) are read every period (20-50 ms) on the
+same transport used by the slow polling of the measures:
+
+shared_bus   wraps the transport. The fast lane has priority: its
+             requests go before the waiting bulk requests, and a bulk
+             request that would still be on the bus at the next fast
+             deadline waits (bus time reserved for the fast lane)
+fast_lane    reads the status words in coalesced blocks, keeps the
+             image of all their bits in one int and compares it with
+             XOR / masks: the callbacks are called only for the bits
+             that changed (rising / falling edges)
+
+Bit b of a status word is bit b of its value, registers big endian
+(as U32 of socomec_a40: first register high word)
+"""
+
+import struct
+import threading
+import time
+
+from mvmodbus2.control_loop import chat_blocking
+from mvmodbus2.functions import EFrame, ETout, modbusf3, modbusf4
+from mvmodbus2.profile import MAX_REGS, plan_blocks
+
+# pylint: disable=invalid-name
+
+RISING = 1
+FALLING = 2
+BOTH = RISING | FALLING
+
+
+class priority_lock:
+    """Lock with two classes of waiters: high priority waiters
+    acquire before the low priority ones"""
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.locked = False
+        self.high_waiting = 0
+
+    def acquire(self, high=False):
+        """Wait for the lock"""
+        with self.cond:
+            if high:
+                self.high_waiting += 1
+                while self.locked:
+                    self.cond.wait()
+                self.high_waiting -= 1
+            else:
+                while self.locked or self.high_waiting:
+                    self.cond.wait()
+            self.locked = True
+
+    def release(self):
+        """Release the lock"""
+        with self.cond:
+            self.locked = False
+            self.cond.notify_all()
+
+
+class shared_bus:
+    """Transport shared by the fast lane (fast_chat) and the bulk
+    polling (chat). guard: estimated duration of a bulk transaction,
+    updated with the measured ones (EWMA)"""
+
+    def __init__(self, slave, guard=0.0):
+        self.slave = slave
+        self._chat = chat_blocking(slave)
+        self.lock = priority_lock()
+        self.guard = guard
+        self.next_fast = None
+        self.fast_started = None
+        self.fast_transactions = 0
+        self.bulk_transactions = 0
+        self.bulk_deferred = 0
+
+    def reserve(self, due):
+        """Next fast lane deadline (monotonic), None: no reservation"""
+        self.next_fast = due
+
+    def fast_chat(self, mod_func):
+        """Transaction of the fast lane.
+        fast_started: when the bus was acquired by the first fast
+        transaction after fast_started was reset to None"""
+        self.lock.acquire(high=True)
+        if self.fast_started is None:
+            self.fast_started = time.monotonic()
+        try:
+            answ = self._chat(mod_func)
+        finally:
+            self.lock.release()
+        self.fast_transactions += 1
+        return answ
+
+    def chat(self, mod_func):
+        """Bulk transaction: does not start if it would overlap the next
+        fast lane deadline"""
+        while True:
+            next_fast = self.next_fast
+            if next_fast is not None:
+                delay = next_fast - time.monotonic()
+                if 0 < delay < self.guard:
+                    self.bulk_deferred += 1
+                    time.sleep(delay)
+                    continue
+            self.lock.acquire()
+            if self.next_fast is not None and 0 < self.next_fast - time.monotonic() < self.guard:
+                self.lock.release()
+                continue
+            break
+        start = time.monotonic()
+        try:
+            answ = self._chat(mod_func)
+        finally:
+            self.lock.release()
+            self.guard = 0.8 * self.guard + 0.2 * (time.monotonic() - start) * 1.5
+        self.bulk_transactions += 1
+        return answ
+
+    def transact(self, mod_func):
+        """chat returning a modbus_response"""
+        return mod_func.result(self.chat(mod_func))
+
+    def __getattr__(self, name):
+        return getattr(self.slave, name)
+
+
+class fast_lane:
+    """Status words of a device polled every period seconds.
+    words: [(name, address, count)]; function 3 or 4"""
+
+    def __init__(self, bus, words, period=0.02, unit_identifier=None, function=3,
+                 max_regs=MAX_REGS, max_gap=4, on_error=None):
+        if not isinstance(bus, shared_bus):
+            bus = shared_bus(bus)
+        self.bus = bus
+        self.words = list(words)
+        self.period = period
+        self.unit_identifier = unit_identifier
+        self.mod_func = modbusf4 if function == 4 else modbusf3
+        self.on_error = on_error
+        self.blocks = plan_blocks(
+            [(name, address, count) for name, address, count in self.words],
+            range(len(self.words)), max_regs, max_gap)
+        # posizione nell'immagine: blocchi in sequenza, ultimo registro
+        # del blocco nei bit bassi
+        self.shifts = []
+        self.offsets = {}
+        self.word_masks = {}
+        offset = 0
+        for start, count, members in self.blocks:
+            self.shifts.append((offset, struct.Struct(f'>{count}H')))
+            for ndx in members:
+                name, address, word_count = self.words[ndx]
+                bit0 = offset + 16 * (start + count - address - word_count)
+                self.offsets[name] = bit0
+                self.word_masks[name] = ((1 << (16 * word_count)) - 1) << bit0
+            offset += 16 * count
+        self.valid = 0
+        for mask in self.word_masks.values():
+            self.valid |= mask
+        self.rise_mask = 0
+        self.fall_mask = 0
+        self.handlers = {}
+        self.image = None
+        self.timestamp = None
+        self.cycles = 0
+        self.errors = 0
+        self.overruns = 0
+        self.max_lateness = 0.0
+        self.thread = None
+        self.running = False
+
+    def on_edge(self, callback, name=None, bit=None, edge=BOTH):
+        """callback(name, bit, value, timestamp) on the edges of bit of the
+        status word name (all bits if None, all words if name is None)"""
+        names = self.offsets if name is None else [name]
+        for word_name in names:
+            width = self.word_masks[word_name] >> self.offsets[word_name]
+            bits = range(width.bit_length()) if bit is None else [bit]
+            for word_bit in bits:
+                image_bit = self.offsets[word_name] + word_bit
+                self.handlers.setdefault(image_bit, []).append(
+                    (word_name, word_bit, edge, callback))
+                if edge & RISING:
+                    self.rise_mask |= 1 << image_bit
+                if edge & FALLING:
+                    self.fall_mask |= 1 << image_bit
+
+    def read_image(self):
+        """Bits of all the status words in one int"""
+        image = 0
+        for (start, count, dummy_members), (offset, words_struct) in zip(
+                self.blocks, self.shifts):
+            words = self.bus.fast_chat(
+                self.mod_func(start, count, unit_identifier=self.unit_identifier))
+            image |= int.from_bytes(words_struct.pack(*words), 'big') << offset
+        return image & self.valid
+
+    def word(self, name, image=None):
+        """Value of the status word name"""
+        image = self.image if image is None else image
+        return (image & self.word_masks[name]) >> self.offsets[name]
+
+    def values(self):
+        """{name: value} of the last image"""
+        return {name: self.word(name) for name in self.offsets}
+
+    def poll_once(self):
+        """Read the status words and fire the callbacks of the edges.
+        Return the number of edges (the first read sets the image: no edges)"""
+        image = self.read_image()
+        timestamp = time.time()
+        previous, self.image, self.timestamp = self.image, image, timestamp
+        self.cycles += 1
+        if previous is None:
+            return 0
+        changed = previous ^ image
+        events = (changed & image & self.rise_mask) | (changed & previous & self.fall_mask)
+        count = 0
+        while events:
+            low = events & -events
+            events ^= low
+            image_bit = low.bit_length() - 1
+            value = 1 if image & low else 0
+            edge = RISING if value else FALLING
+            for name, bit, handler_edge, callback in self.handlers[image_bit]:
+                if handler_edge & edge:
+                    callback(name, bit, value, timestamp)
+                    count += 1
+        return count
+
+    def run(self):
+        """Poll every period until close. Deadlines on the monotonic clock:
+        a late cycle is counted in overruns, the next ones are not anticipated.
+        max_lateness: worst delay of the bus acquisition after the deadline
+        (wait for a bulk transaction included)"""
+        due = time.monotonic()
+        while self.running:
+            self.bus.reserve(due)
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self.bus.fast_started = None
+            try:
+                self.poll_once()
+            except (ETout, EFrame, OSError) as exc:
+                self.errors += 1
+                if self.on_error is not None:
+                    self.on_error(exc)
+            if self.bus.fast_started is not None:
+                self.max_lateness = max(self.max_lateness, self.bus.fast_started - due)
+            due += self.period
+            now = time.monotonic()
+            if now > due:
+                self.overruns += 1
+                due = now
+        self.bus.reserve(None)
+
+    def start(self):
+        """Poll in a daemon thread"""
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def close(self):
+        """Stop the polling thread"""
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def socomec_alarms(bus, period=0.02, unit_identifier=255):
+    """fast_lane of the SOCOMEC A40 alarm and I/O status words (872-878)"""
+    return fast_lane(bus, [
+        ('alarm_in_progress', 872, 2),
+        ('alarm_detected', 874, 2),
+        ('status_inputs_outputs', 878, 2),
+    ], period, unit_identifier)
+
+
+def ime106_relays(bus, period=0.02, unit_identifier=255):
+    """fast_lane of the IME output relay status (0x106f)"""
+    return fast_lane(bus, [('output_relay_status', 0x106f, 1)], period, unit_identifier)
@@ -0,0 +1,105 @@
+"""Fleet-wide writes.
+
+fan_out sends the request of each target (transport, unit identifier)
+in parallel and aggregates the per-device results. Targets on a serial
+line (modbus_serial, rtu_tcp.modbus_rtu_tcp) with broadcast=True (opt-in)
+get a single frame to the broadcast address for the whole line instead of one
+transaction per unit: their result is BROADCAST, not confirmed.
+
+    results = fleet.write_registers(targets, 57600, socomec_a40.clock_values(),
+                                    broadcast=True)
+    results.failed()  ->  {target: exception}
+"""
+
+from mvmodbus2.control_loop import chat_blocking
+from mvmodbus2.functions import EFrame, ETout, modbusf16
+
+# pylint: disable=invalid-name
+
+BROADCAST = 'broadcast'  # risultato di un target raggiunto in broadcast
+
+
+class fleet_result(dict):
+    """{target: answer, exception or BROADCAST}.
+    sent: frames sent (one for each broadcast line, one for each other target)"""
+    sent = 0
+
+    def ok(self):
+        """Targets answered or reached by broadcast"""
+        return {target: value for target, value in self.items()
+                if not isinstance(value, BaseException)}
+
+    def failed(self):
+        """{target: exception}"""
+        return {target: value for target, value in self.items()
+                if isinstance(value, BaseException)}
+
+
+def is_serial_line(slave):
+    """True if slave is a RTU line that accepts broadcast"""
+    return hasattr(slave, 'broadcast')
+
+
+def fan_out(targets, request, broadcast=False, max_workers=32):
+    """Send request(unit) to every target (transport, unit) in parallel.
+    broadcast: one broadcast frame for each serial line (all its slaves,
+    also the ones not in targets, execute it).
+    Return fleet_result"""
+    from concurrent.futures import ThreadPoolExecutor  # pylint: disable=import-outside-toplevel
+    targets = list(targets)
+    results = fleet_result()
+    jobs = []
+    lines = {}
+    for target in targets:
+        slave, dummy_unit = target
+        if broadcast and is_serial_line(slave):
+            lines.setdefault(id(slave), (slave, []))[1].append(target)
+        else:
+            jobs.append(target)
+
+    def unicast(target):
+        slave, unit = target
+        try:
+            return chat_blocking(slave)(request(unit))
+        except (EFrame, ETout, OSError) as exc:
+            return exc
+
+    def line_broadcast(line):
+        slave, dummy_line_targets = line
+        try:
+            slave.broadcast(request(None))
+            return BROADCAST
+        except (ETout, OSError) as exc:
+            return exc
+
+    workers = max(1, min(max_workers, len(jobs) + len(lines)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        unicasts = pool.map(unicast, jobs)
+        broadcasts = pool.map(line_broadcast, lines.values())
+        for target, value in zip(jobs, unicasts):
+            results[target] = value
+        for (dummy_slave, line_targets), value in zip(lines.values(), broadcasts):
+            for target in line_targets:
+                results[target] = value
+    results.sent = len(jobs) + len(lines)
+    return results
+
+
+def write_registers(targets, start_reg, values, broadcast=False, max_workers=32):
+    """FC16 of values from start_reg on every target, see fan_out"""
+    values = list(values)
+    return fan_out(
+        targets, lambda unit: modbusf16(start_reg, values, unit_identifier=unit),
+        broadcast, max_workers)
+
+
+async def async_fan_out(targets, request):
+    """fan_out for the asyncio transports (aio.py): all the requests
+    at the same time. Return fleet_result"""
+    import asyncio  # pylint: disable=import-outside-toplevel
+    targets = list(targets)
+    answers = await asyncio.gather(
+        *(slave.chat(request(unit)) for slave, unit in targets), return_exceptions=True)
+    results = fleet_result(zip(targets, answers))
+    results.sent = len(targets)
+    return results
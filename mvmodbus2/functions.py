@@ -0,0 +1,459 @@
+"""Modbus functions: Request PDU and parsing of the Response PDU
+as per Modbus_Application_Protocol_V1_1b3.pdf"""
+
+import struct
+import threading
+
+# pylint: disable=invalid-name
+
+MAX_PDU = 253  # Modbus_Application_Protocol_V1_1b3.pdf 4.1: max size of a PDU
+MBAP_LEN = 7  # MBAP header of Modbus TCP / UDP
+
+
+class EFrame(BaseException):
+    """Exception.
+    For an exception response of the slave:
+    bus_err (function code | 0x80) and exception_code"""
+    bus_err = None
+    exception_code = None
+
+
+class EAgain(BaseException):
+    """Exception"""
+
+
+class ETout(BaseException):
+    """Exception"""
+
+
+def exception_response(function_code, exception_code):
+    """EFrame for the exception response of the slave"""
+    exc = EFrame(
+        f'Slave returned cod error {function_code:x} {exception_code:x}')
+    exc.bus_err = function_code
+    exc.exception_code = exception_code
+    return exc
+
+
+class modbus_response(object):
+    """Result of a transaction.
+    Separate object for each answer: a request (modbus_func)
+    can be shared by many threads"""
+    __slots__ = ('function_code', 'value', 'unit_identifier', 'transaction_identifier')
+
+    def __init__(self, function_code, value, unit_identifier, transaction_identifier):
+        self.function_code = function_code
+        self.value = value
+        self.unit_identifier = unit_identifier
+        self.transaction_identifier = transaction_identifier
+
+    def __repr__(self):
+        return (f'modbus_response(function_code={self.function_code}, '
+                f'value={self.value!r}, unit_identifier={self.unit_identifier}, '
+                f'transaction_identifier={self.transaction_identifier})')
+
+
+class modbus_func(object):
+    """Gli oggetti modbus_func preparano la stringa Request PDU
+    da inviare al client modbus
+    Ricevono la parte Response PDU dal client modbus
+    e ne eseguono il parsing
+
+    The request is immutable: the PDU is built once (pdu()) and
+    can be sent by many threads at the same time.
+    Assigning a field of the request (REQUEST_FIELDS) builds the PDU
+    again; the data (regs_data, bit_values) are kept as tuples, they
+    cannot be changed in place after the first send.
+    The state of the last answer (bus_err, bytecount) is kept
+    for each thread"""
+
+    MOD_FUNC = "subclass implementation dependent"
+    REQUEST_FIELDS = frozenset((
+        'start_reg', 'num_regs', 'bit_index', 'bit_value', 'bit_values', 'regs_data',
+        'rstart_reg', 'rnum_regs', 'wstart_reg', 'read_dev_id_code', 'object_id'))
+    SEQUENCE_FIELDS = frozenset(('bit_values', 'regs_data'))
+
+    def __setattr__(self, name, value):
+        if name in self.REQUEST_FIELDS:
+            if name in self.SEQUENCE_FIELDS and not isinstance(value, tuple):
+                value = tuple(value)
+            object.__setattr__(self, '_pdu', None)
+        object.__setattr__(self, name, value)
+
+    def __init__(self, transaction_identifier, unit_identifier):
+        """Init.
+        """
+        self._local = threading.local()
+        self._pdu = None
+        self.msg = b''
+        self.transaction_identifier = transaction_identifier or 0
+        self.unit_identifier = unit_identifier or 1
+
+    @property
+    def bus_err(self):
+        """Function code of the last answer of this thread,
+        0 ok, None no answer"""
+        return getattr(self._local, 'bus_err', None)
+
+    @bus_err.setter
+    def bus_err(self, value):
+        self._local.bus_err = value
+
+    @property
+    def bytecount(self):
+        """Byte count (or exception code) of the last answer of this thread"""
+        return getattr(self._local, 'bytecount', 0)
+
+    @bytecount.setter
+    def bytecount(self, value):
+        self._local.bytecount = value
+
+    def pdu(self):
+        """Request PDU. Built once"""
+        pdu = self._pdu
+        if pdu is None:
+            self.mkmsg()
+            pdu = self._pdu = self.msg
+        return pdu
+
+    def result(self, value):
+        """modbus_response of the decoded answer value"""
+        return modbus_response(
+            self.MOD_FUNC, value, self.unit_identifier, self.transaction_identifier)
+
+    def response(self, s):
+        """Decode the Response PDU in a modbus_response"""
+        return self.result(self.answ(s))
+
+    def chkansw_echo(self, response):
+        """Analizza la parte di segnalazione errore del messaggio ricevuto
+        per le funzioni che fanno solo echo (func5 e simili)
+        Se la risposta non segnala errore restituisce il
+        stringa seguente (s[1:])
+        Se segnala errore emette eccezione
+        Il chiamante garantisce che la stringa contenda almeno
+        due byte (func num, primo byte o error code)
+        """
+        func_code, err_code = struct.unpack('> B B', response[:2])
+        if func_code == self.MOD_FUNC:
+            self.bus_err = 0
+            self.bytecount = 0
+            return (func_code, 0, response[1:])
+        self.bus_err = func_code
+        self.bytecount = err_code
+        raise exception_response(func_code, err_code)
+
+    def chkansw(self, response):
+        """Analizza la parte di segnalazione errore del messaggio ricevuto
+        per le funzioni che restituiscono byte_count
+        Se la risposta non segnala errore restituisce il
+        byte byte_count (s[1]) e la stringa seguente (s[2:])
+        Se segnala errore emette eccezione
+        Il chiamante garantisce che la stringa contenga almeno
+        due byte (func num, byte count)
+        """
+        function_code, bytecount = struct.unpack(
+            '> B B', response[:2])
+        self.bytecount = bytecount
+        if function_code == self.MOD_FUNC:
+            self.bus_err = 0
+            return (function_code, bytecount, response[2:])
+        self.bus_err = function_code
+        raise exception_response(function_code, bytecount)
+
+    def bytes_left_with_bytecount(self, bytestring):
+        """How many bytes are still needed to get the answer.
+        Function code with second byte as bytecount
+        """
+        if len(bytestring) < 2:
+            return 2 - len(bytestring)
+        _func_code, bytecount, _rest = self.chkansw(bytestring)
+        return bytecount + 2 - len(bytestring) # 2 == i byte fc e bytecount
+
+    def bytes_left_5byte_header(self, bytestring):
+        """How many bytes are still needed to get the answer.
+        Function code followed by "! H H"
+        """
+        if len(bytestring) < 2:
+            return 2 - len(bytestring)
+        _func_code, _varius_meaning, _rest = self.chkansw(bytestring)
+        return 5 - len(bytestring)
+
+
+class modbusf3(modbus_func):
+    """Chiede il valore di registri"""
+    MOD_FUNC = 3
+    ANSW_LEN = MAX_PDU
+    MAX_REGS = 125  # quantity of registers of a single request
+
+    def __init__(self, start_reg, num_regs, unit_identifier=None, transaction_identifier=None):
+        """Riceve il numero di registro iniziale
+        e il numero di registri da leggere"""
+        super().__init__(
+            unit_identifier=unit_identifier,
+            transaction_identifier=transaction_identifier)
+        self.start_reg = start_reg
+        self.num_regs = num_regs
+
+    def mkmsg(self):
+        """build message"""
+        self.msg = struct.pack(
+            '> B H H', self.MOD_FUNC, self.start_reg, self.num_regs)
+        return 0
+
+    def answ(self, s):
+        """decode answer"""
+        dummy_fc, bc, s = self.chkansw(s)
+        return struct.unpack(f'> {bc//2}H', s)
+
+    def bytes_left(self, bytestring):
+        """How many bytes are still needed to get the answer.
+        """
+        return self.bytes_left_with_bytecount(bytestring)
+
+
+class modbusf4(modbus_func):
+    """Chiede il valore di registri di input"""
+    MOD_FUNC = 4
+    ANSW_LEN = MAX_PDU
+    MAX_REGS = 125  # quantity of registers of a single request
+
+    def __init__(self, start_reg, num_regs, unit_identifier=None, transaction_identifier=None):
+        """Riceve il numero di registro iniziale
+        e il numero di registri da leggere"""
+        super().__init__(
+            unit_identifier=unit_identifier,
+            transaction_identifier=transaction_identifier)
+        self.start_reg = start_reg
+        self.num_regs = num_regs
+
+    def mkmsg(self):
+        """build message"""
+        self.msg = struct.pack(
+            '> B H H', self.MOD_FUNC, self.start_reg, self.num_regs)
+        return 0
+
+    def answ(self, s):
+        """decode answer"""
+        dummy_fc, bc, s = self.chkansw(s)
+        return struct.unpack(f'> {bc//2}H', s)
+
+    def bytes_left(self, bytestring):
+        """How many bytes are still needed to get the answer.
+        """
+        return self.bytes_left_with_bytecount(bytestring)
+
+
+class modbusf5(modbus_func):
+    """Imposta un bit bit_index nel registro start_reg"""
+    MOD_FUNC = 5
+    ANSW_LEN = 1024
+
+    def __init__(self, start_reg, bit_index, bit_value,
+                unit_identifier=None, transaction_identifier=None):
+        super().__init__(
+            unit_identifier=unit_identifier,
+            transaction_identifier=transaction_identifier)
+        self.start_reg = start_reg
+        self.bit_index = bit_index
+        self.bit_value = 0xFF00 if bit_value else 0x0000
+
+    def mkmsg(self):
+        """build message"""
+        pack_str = '! B H H'
+        coil_number = self.start_reg * 16 + self.bit_index
+        self.msg = struct.pack(
+            pack_str, self.MOD_FUNC, coil_number, self.bit_value)
+        return 0
+
+    def answ(self, answ_buffer):
+        """decode answer
+        return coil index and modbus F5 encoded bit value"""
+        (dummy_func_code, dummy_byte_count, data_string
+        ) = self.chkansw_echo(answ_buffer)
+        return struct.unpack("! H H", data_string)
+
+    def bytes_left(self, bytestring):
+        """How many bytes are still needed to get the answer.
+        """
+        return self.bytes_left_5byte_header(bytestring)
+
+
+class modbusf15(modbus_func):
+    """Imposta bit_values a partire dal bit bit_index del registro start_reg
+    (coil numerati come in modbusf5)"""
+    MOD_FUNC = 15
+    ANSW_LEN = 1024
+
+    def __init__(self, start_reg, bit_index, bit_values,
+                unit_identifier=None, transaction_identifier=None):
+        super().__init__(
+            unit_identifier=unit_identifier,
+            transaction_identifier=transaction_identifier)
+        self.start_reg = start_reg
+        self.bit_index = bit_index
+        self.bit_values = bit_values
+
+    def mkmsg(self):
+        """build message"""
+        coil_number = self.start_reg * 16 + self.bit_index
+        num_coils = len(self.bit_values)
+        packed = bytearray((num_coils + 7) // 8)
+        for ndx, value in enumerate(self.bit_values):
+            if value:
+                packed[ndx // 8] |= 1 << (ndx % 8)
+        self.msg = struct.pack(
+            '! B H H B', self.MOD_FUNC, coil_number, num_coils, len(packed)) + bytes(packed)
+        return 0
+
+    def answ(self, s):
+        """decode answer
+        return first coil index and number of coils written"""
+        dummy_fc, dummy_bc, data_string = self.chkansw_echo(s)
+        return struct.unpack('! H H', data_string)
+
+    def bytes_left(self, bytestring):
+        """How many bytes are still needed to get the answer.
+        """
+        return self.bytes_left_5byte_header(bytestring)
+
+
+class modbusf16(modbus_func):
+    """Scrive regs_data a partire dal registro start_reg"""
+    MOD_FUNC = 16
+    ANSW_LEN = 1024
+
+    def __init__(self, start_reg, regs_data, unit_identifier=None, transaction_identifier=None):
+        super().__init__(
+            unit_identifier=unit_identifier,
+            transaction_identifier=transaction_identifier)
+        self.start_reg = start_reg
+        self.regs_data = regs_data
+
+    def mkmsg(self):
+        """build message"""
+        num_regs = len(self.regs_data)
+        byte_count = num_regs * 2
+
+        pack_str = '! B H H B'
+        self.msg = struct.pack(
+            pack_str, self.MOD_FUNC, self.start_reg, num_regs, byte_count)
+        for i in self.regs_data:
+            self.msg = self.msg + struct.pack('! H', i)
+        return 0
+
+    def answ(self, s):
+        """decode answer"""
+        dummy_fc, dummy_bc, dummy_s_rest = self.chkansw(s)
+        return struct.unpack('! H H', s[1:])
+
+    def bytes_left(self, bytestring):
+        """How many bytes are still needed to get the answer.
+        """
+        return self.bytes_left_5byte_header(bytestring)
+
+
+class modbusf23(modbus_func):
+    """Scrive regs_data a partire dal registro wstart_reg.
+    Legge num_regs a partire da rstart_reg"""
+    MOD_FUNC = 23
+    ANSW_LEN = 1024
+
+    def __init__(self, rstart_reg, rnum_regs, wstart_reg, regs_data,
+                unit_identifier=None, transaction_identifier=None):
+        super().__init__(
+            unit_identifier=unit_identifier,
+            transaction_identifier=transaction_identifier)
+        self.rstart_reg = rstart_reg
+        self.rnum_regs = rnum_regs
+        self.wstart_reg = wstart_reg
+        self.regs_data = regs_data
+
+    def mkmsg(self):
+        """build message"""
+        wnum_regs = len(self.regs_data)
+        byte_count = wnum_regs * 2
+
+        # MOD_FUNC B, rstart H, read num_regs H, wstart_reg H,
+        # write word-count H, write word-count * 2 B, write regs_data
+        self.msg = struct.pack(
+            '! B H H H H B',
+            self.MOD_FUNC, self.rstart_reg,
+            self.rnum_regs, self.wstart_reg,
+            wnum_regs, byte_count)
+        for ndx in self.regs_data:
+            self.msg = self.msg + struct.pack('! H', ndx)
+
+        return 0
+
+    def answ(self, s):
+        """decode answer
+        return the read registers as words (like func 3)"""
+        dummy_fc, bc, s = self.chkansw(s)
+        return struct.unpack(f'! {bc//2}H', s)
+
+    def bytes_left(self, bytestring):
+        """How many bytes are still needed to get the answer.
+        """
+        return self.bytes_left_with_bytecount(bytestring)
+
+
+class modbusf43(modbus_func):
+    """Encapsulated Interface Transport, MEI type 14:
+    Read Device Identification.
+    read_dev_id_code: 1 basic, 2 regular, 3 extended, 4 one specific object
+    object_id: first object to read"""
+    MOD_FUNC = 43
+    MEI_TYPE = 14
+    ANSW_LEN = 253
+
+    BASIC = 1
+    REGULAR = 2
+    EXTENDED = 3
+    SPECIFIC = 4
+
+    def __init__(self, read_dev_id_code=1, object_id=0,
+                unit_identifier=None, transaction_identifier=None):
+        super().__init__(
+            unit_identifier=unit_identifier,
+            transaction_identifier=transaction_identifier)
+        self.read_dev_id_code = read_dev_id_code
+        self.object_id = object_id
+
+    def mkmsg(self):
+        """build message"""
+        self.msg = struct.pack(
+            '! B B B B', self.MOD_FUNC, self.MEI_TYPE,
+            self.read_dev_id_code, self.object_id)
+        return 0
+
+    def answ(self, s):
+        """decode answer
+        return (conformity_level, more_follows, next_object_id, objects)
+        objects: dict {object id: bytes}"""
+        dummy_fc, dummy_bc, s = self.chkansw_echo(s)
+        (dummy_mei, dummy_code, conformity_level, more_follows, next_object_id,
+         num_objects) = struct.unpack('! B B B B B B', s[:6])
+        objects = {}
+        pos = 6
+        for dummy_i in range(num_objects):
+            object_id, object_len = struct.unpack('! B B', s[pos:pos + 2])
+            objects[object_id] = s[pos + 2:pos + 2 + object_len]
+            pos += 2 + object_len
+        return (conformity_level, more_follows == 0xFF, next_object_id, objects)
+
+    def bytes_left(self, bytestring):
+        """How many bytes are still needed to get the answer.
+        Header of 7 bytes, then (object id, length, value) for each object
+        """
+        if len(bytestring) < 2:
+            return 2 - len(bytestring)
+        self.chkansw_echo(bytestring)
+        if len(bytestring) < 7:
+            return 7 - len(bytestring)
+        pos = 7
+        for dummy_i in range(bytestring[6]):
+            if len(bytestring) < pos + 2:
+                return pos + 2 - len(bytestring)
+            pos += 2 + bytestring[pos + 1]
+        return pos - len(bytestring)
@@ -0,0 +1,400 @@
+"""Meter history: memory mapped ring buffer of compressed samples.
+
+One fixed size file for each device, divided in blocks; when the last
+block is full the oldest one is overwritten.
+Inside a block every column (timestamps and each register) is a bit
+stream of its own (columnar), compressed as in Gorilla
+(Pelkonen et al., VLDB 2015):
+    timestamps (ms) and integer columns: delta of delta
+        0 -> 1 bit; small changes 9..16 bits
+        a counter growing at constant rate costs 1 bit per sample
+    float columns: XOR with the previous value
+        same value -> 1 bit; only the meaningful bits otherwise
+The block header keeps samples count, first and last timestamp and the
+length of every bit stream: a time range query decodes only the blocks
+overlapping the range. Append is O(number of columns).
+
+File layout:
+    header   magic (8s), block size (I), blocks (I), schema length (I)
+             schema json {"columns": [[name, "i" | "f"], ...]}
+    blocks   sequence (Q), count (I), first ms (q), last ms (q),
+             bits of each stream (I * (columns + 1)), streams
+One writer for each file; readers can open the same file
+"""
+
+import json
+import mmap
+import os
+import struct
+import time
+
+# pylint: disable=invalid-name
+
+MAGIC = b'MVHIST01'
+HEADER = struct.Struct('=8sIII')
+BLOCK_HEADER = struct.Struct('=QIqq')
+MAX_SAMPLE_BITS = 80  # worst case bits of one value in a stream
+
+INT = 'i'
+FLOAT = 'f'
+
+
+def columns_from_map(register_map, kind=INT):
+    """Columns of a register map (socomec_a40.REGISTRI_MISURE,
+    REGISTRI_ENERGIE, ime106.REGISTRI_MISURE106 ...)"""
+    return {reg[2]: kind for reg in register_map}
+
+
+def _signed(value, bits):
+    """Two's complement value of bits bits"""
+    return value - (1 << bits) if value >> (bits - 1) else value
+
+
+# delta of delta buckets: (prefix, prefix bits, value bits)
+DOD_BUCKETS = ((0b10, 2, 7), (0b110, 3, 9), (0b1110, 4, 12))
+
+
+class bit_writer:
+    """Bit stream written in place in buf[offset:offset + size]"""
+
+    def __init__(self, buf, offset, size):
+        self.buf = buf
+        self.offset = offset
+        self.size = size
+        self.bits = 0
+        self.acc = 0
+        self.acc_bits = 0
+
+    def write(self, value, bits):
+        """Append the low bits of value"""
+        self.acc = (self.acc << bits) | (value & ((1 << bits) - 1))
+        self.acc_bits += bits
+        self.bits += bits
+        while self.acc_bits >= 8:
+            self.acc_bits -= 8
+            self.buf[self.offset + (self.bits - self.acc_bits) // 8 - 1] = self.acc >> self.acc_bits
+            self.acc &= (1 << self.acc_bits) - 1
+        if self.acc_bits:
+            self.buf[self.offset + self.bits // 8] = (self.acc << (8 - self.acc_bits)) & 0xFF
+
+    def room(self):
+        """True if one more value surely fits"""
+        return self.bits + MAX_SAMPLE_BITS <= self.size * 8
+
+
+class bit_reader:
+    """Bit stream reader"""
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def read(self, bits):
+        """Next bits bits as unsigned int"""
+        first = self.pos >> 3
+        last = (self.pos + bits + 7) >> 3
+        chunk = int.from_bytes(self.data[first:last], 'big')
+        value = (chunk >> ((last << 3) - self.pos - bits)) & ((1 << bits) - 1)
+        self.pos += bits
+        return value
+
+    def ones(self, limit):
+        """Count of 1 bits before a 0 (at most limit)"""
+        count = 0
+        while count < limit and self.read(1):
+            count += 1
+        return count
+
+
+class dod_encoder:
+    """Delta of delta encoder of an integer stream"""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.count = 0
+        self.prev = 0
+        self.delta = 0
+
+    def add(self, value):
+        """Encode value"""
+        writer = self.writer
+        if self.count == 0:
+            writer.write(value, 64)
+        else:
+            delta = value - self.prev
+            dod = delta - self.delta
+            self.delta = delta
+            if dod == 0:
+                writer.write(0, 1)
+            else:
+                for prefix, prefix_bits, bits in DOD_BUCKETS:
+                    if -(1 << (bits - 1)) <= dod < (1 << (bits - 1)):
+                        writer.write(prefix, prefix_bits)
+                        writer.write(dod, bits)
+                        break
+                else:
+                    writer.write(0b1111, 4)
+                    writer.write(dod, 64)
+        self.prev = value
+        self.count += 1
+
+
+def dod_decode(reader, count):
+    """count integers of a delta of delta stream"""
+    values = []
+    prev = delta = 0
+    for ndx in range(count):
+        if ndx == 0:
+            prev = _signed(reader.read(64), 64)
+            values.append(prev)
+            continue
+        ones = reader.ones(4)
+        if ones == 0:
+            dod = 0
+        elif ones < 4:
+            bits = DOD_BUCKETS[ones - 1][2]
+            dod = _signed(reader.read(bits), bits)
+        else:
+            dod = _signed(reader.read(64), 64)
+        delta += dod
+        prev += delta
+        values.append(prev)
+    return values
+
+
+class xor_encoder:
+    """XOR encoder of a float stream"""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.count = 0
+        self.prev = 0
+        self.leading = -1
+        self.trailing = 0
+
+    def add(self, value):
+        """Encode value"""
+        writer = self.writer
+        bits = struct.unpack('=Q', struct.pack('=d', value))[0]
+        if self.count == 0:
+            writer.write(bits, 64)
+        else:
+            xor = bits ^ self.prev
+            if xor == 0:
+                writer.write(0, 1)
+            else:
+                leading = min(64 - xor.bit_length(), 31)
+                trailing = (xor & -xor).bit_length() - 1
+                if self.leading >= 0 and leading >= self.leading and trailing >= self.trailing:
+                    writer.write(0b10, 2)
+                    writer.write(xor >> self.trailing, 64 - self.leading - self.trailing)
+                else:
+                    meaningful = 64 - leading - trailing
+                    writer.write(0b11, 2)
+                    writer.write(leading, 5)
+                    writer.write(meaningful & 63, 6)  # 64 -> 0
+                    writer.write(xor >> trailing, meaningful)
+                    self.leading, self.trailing = leading, trailing
+        self.prev = bits
+        self.count += 1
+
+
+def xor_decode(reader, count):
+    """count floats of a XOR stream"""
+    values = []
+    prev = 0
+    leading = trailing = 0
+    for ndx in range(count):
+        if ndx == 0:
+            prev = reader.read(64)
+        elif reader.read(1):
+            if reader.read(1):
+                leading = reader.read(5)
+                meaningful = reader.read(6) or 64
+                trailing = 64 - leading - meaningful
+            prev ^= reader.read(64 - leading - trailing) << trailing
+        values.append(struct.unpack('=d', struct.pack('=Q', prev))[0])
+    return values
+
+
+class history_store:
+    """Ring buffer history of one device.
+    columns: {name: 'i' | 'f'} (or list of names, all float) used when
+    the file is created; an existing file keeps its own columns.
+    size: file size in bytes, block_size: bytes of a block"""
+
+    def __init__(self, path, columns=None, size=16 * 1024 * 1024, block_size=65536):
+        self.path = path
+        if os.path.exists(path):
+            fd = os.open(path, os.O_RDWR)
+            try:
+                self.buf = mmap.mmap(fd, 0)
+            finally:
+                os.close(fd)
+            if self.buf[:len(MAGIC)] != MAGIC or len(self.buf) < HEADER.size:
+                self.buf.close()
+                raise ValueError(f'{path} is not a history file')
+            dummy_magic, self.block_size, self.blocks, schema_len = HEADER.unpack_from(
+                self.buf, 0)
+            schema = json.loads(bytes(self.buf[HEADER.size:HEADER.size + schema_len]))
+            self.columns = [tuple(column) for column in schema['columns']]
+        else:
+            if columns is None:
+                raise ValueError(f'{path}: columns needed to create the history')
+            if not isinstance(columns, dict):
+                columns = dict.fromkeys(columns, FLOAT)
+            self.columns = list(columns.items())
+            schema = json.dumps({'columns': self.columns}, separators=(',', ':')).encode()
+            self.block_size = block_size
+            header_size = self.header_size(len(schema))
+            self.blocks = max(2, (size - header_size) // block_size)
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                os.ftruncate(fd, header_size + self.blocks * block_size)
+                self.buf = mmap.mmap(fd, 0)
+            finally:
+                os.close(fd)
+            self.buf[HEADER.size:HEADER.size + len(schema)] = schema
+            HEADER.pack_into(self.buf, 0, MAGIC, block_size, self.blocks, len(schema))
+        self.data_offset = self.header_size(HEADER.unpack_from(self.buf, 0)[3])
+        self.names = [name for name, dummy_kind in self.columns]
+        self.lengths = struct.Struct(f'={len(self.columns) + 1}I')
+        streams_offset = BLOCK_HEADER.size + self.lengths.size
+        self.stream_size = (self.block_size - streams_offset) // (len(self.columns) + 1)
+        if self.stream_size * 8 < 2 * 64 + MAX_SAMPLE_BITS:
+            raise ValueError(f'{path}: block_size too small for {len(self.columns)} columns')
+        self.head = None
+        self._resume()
+
+    @staticmethod
+    def header_size(schema_len):
+        """File header size, aligned to 8 bytes"""
+        return (HEADER.size + schema_len + 7) // 8 * 8
+
+    def block_offset(self, block):
+        """Offset of block in the file"""
+        return self.data_offset + block * self.block_size
+
+    def block_header(self, block):
+        """(sequence, count, first ms, last ms)"""
+        return BLOCK_HEADER.unpack_from(self.buf, self.block_offset(block))
+
+    def _resume(self):
+        """Continue the block with the highest sequence:
+        its samples are encoded again to restore the encoders"""
+        headers = [self.block_header(block) for block in range(self.blocks)]
+        head = max(range(self.blocks), key=lambda block: headers[block][0])
+        sequence = headers[head][0]
+        samples = self.decode_block(head) if headers[head][1] else []
+        self._open_block(head, max(sequence, 1))
+        for timestamp_ms, values in samples:
+            self._append(timestamp_ms, values)
+
+    def _open_block(self, block, sequence):
+        """Start to write block (overwriting it)"""
+        offset = self.block_offset(block)
+        self.buf[offset:offset + BLOCK_HEADER.size + self.lengths.size] = bytes(
+            BLOCK_HEADER.size + self.lengths.size)
+        BLOCK_HEADER.pack_into(self.buf, offset, sequence, 0, 0, 0)
+        self.head = block
+        self.sequence = sequence
+        self.count = 0
+        self.first_ms = 0
+        streams = offset + BLOCK_HEADER.size + self.lengths.size
+        self.writers = [
+            bit_writer(self.buf, streams + ndx * self.stream_size, self.stream_size)
+            for ndx in range(len(self.columns) + 1)
+        ]
+        self.encoders = [dod_encoder(self.writers[0])] + [
+            dod_encoder(writer) if kind == INT else xor_encoder(writer)
+            for writer, (dummy_name, kind) in zip(self.writers[1:], self.columns)
+        ]
+
+    def append(self, values, timestamp=None):
+        """Add a sample: values {name: value} (missing names: 0 / NaN),
+        timestamp in seconds (time.time() if None)"""
+        timestamp_ms = round((time.time() if timestamp is None else timestamp) * 1000)
+        row = []
+        for name, kind in self.columns:
+            value = values.get(name)
+            if kind == INT:
+                row.append(int(round(value)) if value is not None else 0)
+            else:
+                row.append(float(value) if value is not None else float('nan'))
+        if not all(writer.room() for writer in self.writers):
+            self._open_block((self.head + 1) % self.blocks, self.sequence + 1)
+        self._append(timestamp_ms, row)
+
+    def _append(self, timestamp_ms, row):
+        """Encode a sample in the head block, update its header"""
+        self.encoders[0].add(timestamp_ms)
+        for encoder, value in zip(self.encoders[1:], row):
+            encoder.add(value)
+        if self.count == 0:
+            self.first_ms = timestamp_ms
+        self.count += 1
+        offset = self.block_offset(self.head)
+        self.lengths.pack_into(self.buf, offset + BLOCK_HEADER.size,
+                               *(writer.bits for writer in self.writers))
+        BLOCK_HEADER.pack_into(self.buf, offset, self.sequence, self.count,
+                               self.first_ms, timestamp_ms)
+
+    def decode_block(self, block):
+        """[(timestamp ms, [values])] of block"""
+        offset = self.block_offset(block)
+        count = BLOCK_HEADER.unpack_from(self.buf, offset)[1]
+        lengths = self.lengths.unpack_from(self.buf, offset + BLOCK_HEADER.size)
+        streams = offset + BLOCK_HEADER.size + self.lengths.size
+        decoded = []
+        for ndx, bits in enumerate(lengths):
+            start = streams + ndx * self.stream_size
+            reader = bit_reader(bytes(self.buf[start:start + (bits + 7) // 8]))
+            kind = INT if ndx == 0 else self.columns[ndx - 1][1]
+            decoded.append(dod_decode(reader, count) if kind == INT else xor_decode(reader, count))
+        return [(decoded[0][ndx], [column[ndx] for column in decoded[1:]])
+                for ndx in range(count)]
+
+    def query(self, start=None, end=None, names=None):
+        """Samples with start <= timestamp <= end (seconds, None: no limit).
+        Return (timestamps, {name: [values]}) in time order"""
+        start_ms = None if start is None else round(start * 1000)
+        end_ms = None if end is None else round(end * 1000)
+        names = self.names if names is None else list(names)
+        positions = [self.names.index(name) for name in names]
+        blocks = sorted(
+            (header[0], block)
+            for block, header in ((block, self.block_header(block))
+                                  for block in range(self.blocks))
+            if header[1]
+            and (start_ms is None or header[3] >= start_ms)
+            and (end_ms is None or header[2] <= end_ms))
+        timestamps = []
+        columns = {name: [] for name in names}
+        for dummy_sequence, block in blocks:
+            for timestamp_ms, values in self.decode_block(block):
+                if ((start_ms is None or timestamp_ms >= start_ms)
+                        and (end_ms is None or timestamp_ms <= end_ms)):
+                    timestamps.append(timestamp_ms / 1000)
+                    for name, pos in zip(names, positions):
+                        columns[name].append(values[pos])
+        return timestamps, columns
+
+    def bytes_used(self):
+        """Compressed bytes of all the samples"""
+        used = 0
+        for block in range(self.blocks):
+            offset = self.block_offset(block)
+            if BLOCK_HEADER.unpack_from(self.buf, offset)[1]:
+                used += sum((bits + 7) // 8 for bits in self.lengths.unpack_from(
+                    self.buf, offset + BLOCK_HEADER.size))
+        return used
+
+    def flush(self):
+        """Write the mapped pages to disk"""
+        self.buf.flush()
+
+    def close(self):
+        """Flush and unmap"""
+        self.buf.flush()
+        self.writers = self.encoders = []
+        self.buf.close()
@@ -5,19 +5,7 @@ Interfaccia ETHERNET IF96015
 """
 
 import mvmodbus2
-import json
-
-def UD_WORD(val):
-    """Unsigned double word"""
-    return val[0] * 65536 + val[1]
-
-def U_WORD(val):
-    """Unsigned word"""
-    return val[0]
-
-def S_WORD(val):
-    """Signed word"""
-    return val[0] if val[0] < 32768 else val[0] - 65536
+from mvmodbus2.decoders import U32 as UD_WORD, U16 as U_WORD, S16 as S_WORD
 
 
 CONST_SCALA_NOTA3 = 1
@@ -126,10 +114,23 @@ REGISTRI_MISURE106 = [
 ]
 
 
-REGISTRI_MISURE106_map = {
-    reg[2]: dict(zip(('address', 'convert', 'name', 'unit', 'rescale'), reg))
-        for reg in REGISTRI_MISURE106
-}
+def registri_misure106_map():
+    """REGISTRI_MISURE106 indicizzati per denominazione.
+    Costruita al primo uso, non all'import"""
+    registri_map = globals().get('REGISTRI_MISURE106_map')
+    if registri_map is None:
+        registri_map = globals()['REGISTRI_MISURE106_map'] = {
+            reg[2]: dict(zip(('address', 'convert', 'name', 'unit', 'rescale'), reg))
+                for reg in REGISTRI_MISURE106
+        }
+    return registri_map
+
+
+def __getattr__(name):
+    """REGISTRI_MISURE106_map come attributo del modulo"""
+    if name == 'REGISTRI_MISURE106_map':
+        return registri_misure106_map()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 def get_regs(slave, regs_list):
@@ -151,6 +152,41 @@ def get_regs(slave, regs_list):
     return regs
 
 
+def stream_entries(register_map=None, names=None):
+    """Voci di register_map (default REGISTRI_MISURE106) per mvmodbus2.stream"""
+    return [
+        (reg[2], reg[0], 1 if reg[1] in (U_WORD, S_WORD) else 2,
+         lambda words, reg=reg: reg[4](reg[1](words)))
+        for reg in (REGISTRI_MISURE106 if register_map is None else register_map)
+        if names is None or reg[2] in names
+    ]
+
+
+def iter_regs(slave, register_map=None, names=None):
+    """Come get_regs, ma genera (denominazione, valore, timestamp)
+    man mano che arriva ciascun blocco di registri consecutivi"""
+    from mvmodbus2 import stream  # pylint: disable=import-outside-toplevel
+    return stream.iter_blocks(slave, stream_entries(register_map, names), unit_identifier=255)
+
+
+_snapshot_types = {}  # id di REGISTRI_MISURE106: tipo di record, vedi snapshot_type
+
+
+def snapshot_type(register_map=None):
+    """Tipo di record compatto (mvmodbus2.snapshot) di register_map.
+    Per REGISTRI_MISURE106 costruito al primo uso e poi riusato"""
+    from mvmodbus2 import snapshot as mb_snapshot  # pylint: disable=import-outside-toplevel
+    if register_map is None or register_map is REGISTRI_MISURE106:
+        return mb_snapshot.module_record_type(
+            _snapshot_types, REGISTRI_MISURE106, stream_entries, 'ime106_snapshot')
+    return mb_snapshot.table_record_type(register_map, stream_entries, 'ime106_snapshot')
+
+
+def snapshot(slave, names=None, register_map=None):
+    """Come get_regs, ma in un record compatto: rec.frequency, rec.to_dict()"""
+    return snapshot_type(register_map).read(slave, names, unit_identifier=255)
+
+
 def get_k(slave):
     """Restituisce {KTV, KTA}"""
     tvta = get_regs(slave, ['Current transformer ratio (KTA)', 'Voltage transformer ratio (KTV)'])
@@ -159,15 +195,11 @@ def get_k(slave):
     return tvta
 
 
-def set_scala_nota3_4(slave):
-    """Determina la scalatura delle misure"""
-    global CONST_SCALA_NOTA3
-    global CONST_SCALA_NOTA4
-    tvta = get_k(slave)
-    k = tvta['k']
-    if k < 5000:
-        CONST_SCALA_NOTA3 = 0.01
-    
+def costanti_scala(k):
+    """Costanti (nota3, nota4) per k = KTV * KTA"""
+    # Nota 3
+    nota3 = 0.01 if k < 5000 else 1
+
     # Nota 4
     # Esprimo tutto in kilo
     # Nella nota yy sono i decimali a display
@@ -186,11 +218,100 @@ def set_scala_nota3_4(slave):
             mult = 100
         else:  # migliaia di kW
             mult = 1000
-    CONST_SCALA_NOTA4 = mult
+    return nota3, mult
+
+
+def set_scala_nota3_4(slave):
+    """Determina la scalatura delle misure.
+    Imposta le costanti globali: per piu' strumenti usare scaling()"""
+    global CONST_SCALA_NOTA3
+    global CONST_SCALA_NOTA4
+    tvta = get_k(slave)
+    CONST_SCALA_NOTA3, CONST_SCALA_NOTA4 = costanti_scala(tvta['k'])
     return tvta
 
+
+def segni():
+    """{potenza: registro del segno della potenza}"""
+    names = {reg[2] for reg in REGISTRI_MISURE106}
+    return {
+        name: name.replace(' :', ' : sign of ')
+        for name in names
+        if ' :' in name and name.replace(' :', ' : sign of ') in names
+    }
+
+
+def scaling_for_k(k, normalise=True, signed=True):
+    """scaling_engine di uno strumento con k = KTV * KTA.
+    Le costanti delle note 3 e 4 sono dello strumento, non globali.
+    signed: le potenze assumono il segno dei registri "sign of" """
+    from mvmodbus2 import profile as device_profile  # pylint: disable=import-outside-toplevel
+    from mvmodbus2 import scaling as device_scaling  # pylint: disable=import-outside-toplevel
+    nota3, nota4 = costanti_scala(k)
+    return device_scaling.scaling_engine(
+        device_profile.load_profile('ime106'),
+        params={'nota3': nota3, 'nota4': nota4},
+        signs=segni() if signed else None,
+        normalise=normalise)
+
+
+def scaling(slave, normalise=True, signed=True):
+    """scaling_engine dello strumento slave (legge KTA e KTV)"""
+    return scaling_for_k(get_k(slave)['k'], normalise, signed)
+
+
+async def async_get_regs(slave, regs_list):
+    """get_regs con un trasporto asyncio (aio.py): letture a blocchi
+    (profilo ime106) inviate insieme. Scalatura delle costanti globali"""
+    from mvmodbus2 import aio  # pylint: disable=import-outside-toplevel
+    from mvmodbus2 import profile as device_profile  # pylint: disable=import-outside-toplevel
+    profile = device_profile.load_profile('ime106')
+    plan = profile.read_plan(names=regs_list)
+    params = {'nota3': CONST_SCALA_NOTA3, 'nota4': CONST_SCALA_NOTA4}
+    regs = {}
+    for block, words in zip(plan, await aio.read_blocks(slave, profile, plan, 255)):
+        regs.update(profile.decode_block(block, words, params))
+    return regs
+
+
+def aiter_regs(slave, register_map=None, names=None):
+    """iter_regs con un trasporto asyncio: async for name, value, ts in ..."""
+    from mvmodbus2 import stream  # pylint: disable=import-outside-toplevel
+    return stream.aiter_blocks(slave, stream_entries(register_map, names), unit_identifier=255)
+
+
+async def async_get_k(slave):
+    """get_k con un trasporto asyncio"""
+    tvta = await async_get_regs(
+        slave, ['Current transformer ratio (KTA)', 'Voltage transformer ratio (KTV)'])
+    tvta['k'] = tvta['Voltage transformer ratio (KTV)'] * tvta['Current transformer ratio (KTA)']
+    return tvta
+
+
+async def async_scaling(slave, normalise=True, signed=True):
+    """scaling con un trasporto asyncio.
+    Al posto di set_scala_nota3_4: le costanti sono dello strumento"""
+    return scaling_for_k((await async_get_k(slave))['k'], normalise, signed)
+
+
+def meter(slave, engine=None, normalise=True, signed=True):
+    """Strumento: meter(slave).snapshot(['misure']).
+    engine: scaling_engine, None: da KTA e KTV dello strumento"""
+    from mvmodbus2 import scaling as device_scaling  # pylint: disable=import-outside-toplevel
+    return device_scaling.meter(
+        slave, engine or scaling(slave, normalise, signed), unit_identifier=255)
+
+
+async def async_meter(slave, engine=None, normalise=True, signed=True):
+    """meter per asyncio: await (await async_meter(slave)).snapshot(['misure'])"""
+    from mvmodbus2 import aio  # pylint: disable=import-outside-toplevel
+    return aio.async_meter(
+        slave, engine or await async_scaling(slave, normalise, signed), unit_identifier=255)
+
+
 def main_test():
     """Test"""
+    import json  # pylint: disable=import-outside-toplevel
     slave_addr = 'pwrbl2.loc.ghiaia.net'
     slave = mvmodbus2.modbus_tcp(slave_addr)
     tvta = set_scala_nota3_4(slave)
@@ -201,7 +322,8 @@ def main_test():
         {reg: regs[reg] for reg in regs if 'energ' in reg},
         indent=2))
     print(json.dumps(
-        {reg + REGISTRI_MISURE106_map[reg]['unit'] : regs[reg] for reg in regs if 'power' in reg},
+        {reg + registri_misure106_map()[reg]['unit'] : regs[reg]
+            for reg in regs if 'power' in reg},
         indent=2))
     return regs
 
@@ -0,0 +1,189 @@
+"""Capacity planner of a serial line (RS-485, modbus_serial).
+
+Wire time model (Modbus_over_serial_line_V1_02.pdf):
+    character      11 bit (start, 8 data, parity or second stop, stop)
+    t3.5           silence between frames: 3.5 characters,
+                   1.75 ms fixed above 19200 baud
+    transaction    request frame + t3.5 + turnaround of the slave
+                   + response frame + t3.5
+turnaround: time from the end of the request silence to the first
+character of the response, measured on the field (measure_turnaround)
+
+plan_line(baud, devices) reports utilisation and feasibility of the
+desired intervals and recommends the fastest feasible intervals, the
+lowest sufficient baud rate, or the split of the devices on more lines
+"""
+
+import math
+import time
+
+from mvmodbus2.control_loop import chat_blocking
+from mvmodbus2.profile import MAX_REGS
+
+# pylint: disable=invalid-name
+
+BITS_PER_CHAR = 11
+BAUD_RATES = (1200, 2400, 4800, 9600, 19200, 38400, 57600, 115200)
+MAX_UTILISATION = 0.7  # margine per ritentativi e timeout
+
+
+def char_time(baud, bits_per_char=BITS_PER_CHAR):
+    """Seconds of a character"""
+    return bits_per_char / baud
+
+
+def t35(baud, bits_per_char=BITS_PER_CHAR):
+    """Inter-frame silence"""
+    if baud > 19200:
+        return 0.00175
+    return 3.5 * char_time(baud, bits_per_char)
+
+
+def frame_bytes(function, count):
+    """(request, response) RTU frame bytes (address and CRC included)
+    of function on count registers"""
+    if function in (3, 4):
+        return 8, 5 + 2 * count
+    if function == 16:
+        return 9 + 2 * count, 8
+    if function == 6:
+        return 8, 8
+    if function == 23:
+        return 13 + 2 * count, 5 + 2 * count
+    raise ValueError(f'function {function}: frame size unknown')
+
+
+def transaction_time(function, count, baud, turnaround=0.0, bits_per_char=BITS_PER_CHAR):
+    """Wire time of a transaction: frames, silences and turnaround"""
+    request, response = frame_bytes(function, count)
+    return ((request + response) * char_time(baud, bits_per_char)
+            + 2 * t35(baud, bits_per_char) + turnaround)
+
+
+class device:
+    """Slave of the line.
+    blocks: [(start, count)] or read plan [(start, count, members)],
+    or stream entries [(name, address, count, decode)] to coalesce
+    interval: desired seconds between two reads of all the blocks
+    turnaround: measured response delay of the slave"""
+
+    def __init__(self, name, blocks, interval, turnaround=0.01, function=3,
+                 max_regs=MAX_REGS):
+        self.name = name
+        blocks = list(blocks)
+        if blocks and len(blocks[0]) == 4:
+            from mvmodbus2.stream import entry_blocks  # pylint: disable=import-outside-toplevel
+            blocks = entry_blocks(blocks, max_regs)
+        self.blocks = [(block[0], block[1]) for block in blocks]
+        self.interval = interval
+        self.turnaround = turnaround
+        self.function = function
+
+    def cycle_time(self, baud, bits_per_char=BITS_PER_CHAR):
+        """Wire time of one read of all the blocks"""
+        return sum(transaction_time(self.function, count, baud, self.turnaround, bits_per_char)
+                   for dummy_start, count in self.blocks)
+
+    def utilisation(self, baud, bits_per_char=BITS_PER_CHAR):
+        """Fraction of the line used at the desired interval"""
+        return self.cycle_time(baud, bits_per_char) / self.interval
+
+
+class line_report:
+    """Result of plan_line"""
+
+    def __init__(self, baud, devices, bits_per_char, max_utilisation):
+        self.baud = baud
+        self.devices = devices
+        self.bits_per_char = bits_per_char
+        self.max_utilisation = max_utilisation
+        self.cycle_times = {dev.name: dev.cycle_time(baud, bits_per_char) for dev in devices}
+        self.utilisation = sum(
+            self.cycle_times[dev.name] / dev.interval for dev in devices)
+        self.feasible = self.utilisation <= max_utilisation
+        # intervalli piu' brevi fattibili: tutti scalati dello stesso fattore,
+        # mai sotto il tempo di ciclo del dispositivo
+        scale = self.utilisation / max_utilisation
+        self.recommended = {
+            dev.name: max(dev.interval * scale, self.cycle_times[dev.name] / max_utilisation)
+            for dev in devices
+        }
+        self.min_baud = None
+        for rate in BAUD_RATES:
+            if sum(dev.utilisation(rate, bits_per_char) for dev in devices) <= max_utilisation:
+                self.min_baud = rate
+                break
+        self.split = None
+        if self.min_baud is None:
+            self.split = split_line(devices, BAUD_RATES[-1], bits_per_char, max_utilisation)
+
+    def advice(self):
+        """Recommendations in words"""
+        lines = []
+        if self.feasible:
+            lines.append(f'feasible at {self.baud} baud: utilisation {self.utilisation:.1%}')
+        else:
+            lines.append(f'NOT feasible at {self.baud} baud: utilisation '
+                         f'{self.utilisation:.1%} > {self.max_utilisation:.0%}')
+        if self.min_baud is not None and self.min_baud > self.baud:
+            lines.append(f'raise the line to {self.min_baud} baud')
+        elif self.min_baud is None:
+            lines.append(f'infeasible even at {BAUD_RATES[-1]} baud: split in '
+                         f'{len(self.split)} lines: ' + ' | '.join(
+                             ', '.join(dev.name for dev in line) for line in self.split))
+        for dev in self.devices:
+            lines.append(f'{dev.name}: cycle {self.cycle_times[dev.name] * 1000:.1f} ms, '
+                         f'interval {dev.interval:g} s, fastest feasible '
+                         f'{self.recommended[dev.name]:.3f} s')
+            if dev.utilisation(BAUD_RATES[-1], self.bits_per_char) > self.max_utilisation:
+                lines.append(f'{dev.name}: interval too short even alone at '
+                             f'{BAUD_RATES[-1]} baud')
+        return lines
+
+    def __str__(self):
+        return '\n'.join(self.advice())
+
+
+def plan_line(baud, devices, bits_per_char=BITS_PER_CHAR, max_utilisation=MAX_UTILISATION):
+    """line_report of devices on a line at baud"""
+    return line_report(baud, list(devices), bits_per_char, max_utilisation)
+
+
+def split_line(devices, baud, bits_per_char=BITS_PER_CHAR, max_utilisation=MAX_UTILISATION):
+    """Devices shared on the fewest lines at baud (first fit decreasing).
+    A device alone over max_utilisation gets a line of its own"""
+    lines = []
+    loads = []
+    for dev in sorted(devices, key=lambda dev: -dev.utilisation(baud, bits_per_char)):
+        load = dev.utilisation(baud, bits_per_char)
+        for ndx, line_load in enumerate(loads):
+            if line_load + load <= max_utilisation:
+                lines[ndx].append(dev)
+                loads[ndx] += load
+                break
+        else:
+            lines.append([dev])
+            loads.append(load)
+    return lines
+
+
+def lines_needed(devices, baud, bits_per_char=BITS_PER_CHAR, max_utilisation=MAX_UTILISATION):
+    """Lower bound of the lines for devices at baud"""
+    return math.ceil(sum(dev.utilisation(baud, bits_per_char) for dev in devices)
+                     / max_utilisation)
+
+
+def measure_turnaround(slave, mod_func, baud, count, function=3, repeat=10,
+                       bits_per_char=BITS_PER_CHAR):
+    """Turnaround of slave: best measured transaction time less the wire time.
+    Measured from slave.start_chat if the transport sets it (modbus_serial:
+    end of the send, the flush_in of the receive buffer is not counted)"""
+    chat = chat_blocking(slave)
+    best = None
+    for dummy in range(repeat):
+        start = time.time()
+        chat(mod_func)
+        start = max(start, getattr(slave, 'start_chat', start))
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return max(0.0, best - transaction_time(function, count, baud, 0.0, bits_per_char))
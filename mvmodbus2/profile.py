@@ -0,0 +1,352 @@
+"""Declarative device profiles.
+
+A profile describes the registers of a device: address, words count,
+data type, unit, scaling and group.
+Formats: json, toml (python >= 3.11 or tomli installed), csv.
+
+json / toml:
+    {
+      "name": "ime106",
+      "unit_identifier": 255,
+      "function": 3,            # 3 holding registers, 4 input registers
+      "max_regs": 125,          # max registers in a single read
+      "max_gap": 0,             # unused registers read to join two blocks
+      "groups": {
+        "misure": [
+          {"address": 4096, "count": 2, "name": "Phase 1 : phase voltage",
+           "unit": "mV", "type": "U32", "scale": 1},
+          ...
+        ]
+      }
+    }
+
+csv: one register for each row, columns
+    group, address, count, name, unit, type, scale, map
+the other fields take the default values.
+
+type: a name of TYPES or "module:function" with function(words) -> value
+scale: number, or name of a runtime parameter (e.g. "nota3" for ime106)
+map: list, the decoded value is used as index (e.g. [1, -1] for a sign)
+
+The profile is compiled at load time: registers sorted and coalesced in
+read blocks (read plan) for each group, decoders prepared for each block.
+The compiled profile is cached on disk (marshal) in
+$XDG_CACHE_HOME/mvmodbus2/profiles and recompiled only when the source
+file changes
+"""
+
+import csv
+import hashlib
+import importlib
+import json
+import marshal
+import os
+
+import mvmodbus2
+from mvmodbus2.decoders import S16, S32, U16, U32
+
+# pylint: disable=invalid-name
+
+COMPILER_VERSION = 1
+
+PROFILES_DIR = os.path.join(os.path.dirname(__file__), 'profiles')
+
+MAX_REGS = 125  # Modbus_Application_Protocol_V1_1b3.pdf: FC3/FC4 quantity of registers
+
+
+TYPES = {
+    'U16': U16,
+    'S16': S16,
+    'U32': U32,
+    'S32': S32,
+    # nomi usati nelle tabelle dei costruttori
+    'U_WORD': U16,
+    'S_WORD': S16,
+    'UD_WORD': U32,
+    'U8': U16,
+}
+
+
+class EProfile(Exception):
+    """Invalid profile"""
+
+
+def default_cache_dir():
+    """Directory of the compiled profiles"""
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+        os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'mvmodbus2', 'profiles')
+
+
+def resolve_type(type_name):
+    """Decoder function of type_name"""
+    decoder = TYPES.get(type_name)
+    if decoder is not None:
+        return decoder
+    module_name, sep, function_name = type_name.partition(':')
+    if not sep:
+        raise EProfile(f'Unknown type {type_name}')
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def read_source(path):
+    """Profile source as dict"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.json':
+        with open(path, encoding='utf-8') as source:
+            return json.load(source)
+    if ext == '.toml':
+        try:
+            import tomllib  # pylint: disable=import-outside-toplevel
+        except ImportError:
+            import tomli as tomllib  # pylint: disable=import-outside-toplevel
+        with open(path, 'rb') as source:
+            return tomllib.load(source)
+    if ext == '.csv':
+        groups = {}
+        with open(path, encoding='utf-8', newline='') as source:
+            for row in csv.DictReader(source):
+                reg = {
+                    'address': int(row['address'], 0),
+                    'count': int(row.get('count') or 1),
+                    'name': row['name'],
+                    'unit': row.get('unit', ''),
+                    'type': row.get('type') or 'U16',
+                }
+                if row.get('scale'):
+                    try:
+                        reg['scale'] = float(row['scale'])
+                    except ValueError:
+                        reg['scale'] = row['scale']
+                if row.get('map'):
+                    reg['map'] = json.loads(row['map'])
+                groups.setdefault(row.get('group') or 'default', []).append(reg)
+        return {
+            'name': os.path.splitext(os.path.basename(path))[0],
+            'groups': groups,
+        }
+    raise EProfile(f'Unknown profile format {path}')
+
+
+def scale_divisor(scale):
+    """Divisor equivalent to scale (10.0 for 0.1), 0 if none"""
+    if 0 < scale < 1:
+        divisor = round(1 / scale)
+        if abs(divisor * scale - 1) < 1e-9:
+            return float(divisor)
+    return 0
+
+
+def plan_blocks(registers, indexes, max_regs, max_gap):
+    """Read plan: registers (indexes) coalesced in blocks of consecutive
+    addresses. Return [(start, count, (register indexes))]"""
+    blocks = []
+    start = end = None
+    members = []
+    for ndx in sorted(indexes, key=lambda ndx: registers[ndx][1]):
+        address, count = registers[ndx][1], registers[ndx][2]
+        if members and address - end <= max_gap and address + count - start <= max_regs:
+            end = max(end, address + count)
+            members.append(ndx)
+            continue
+        if members:
+            blocks.append((start, end - start, tuple(members)))
+        start, end, members = address, address + count, [ndx]
+    if members:
+        blocks.append((start, end - start, tuple(members)))
+    return blocks
+
+
+def compile_source(source):
+    """Compile the profile source in a marshal friendly structure"""
+    max_regs = source.get('max_regs', MAX_REGS)
+    max_gap = source.get('max_gap', 0)
+    registers = []
+    groups = {}
+    for group, regs in source['groups'].items():
+        groups[group] = []
+        for reg in regs:
+            scale = reg.get('scale', 1)
+            if isinstance(scale, str):
+                scale, param = 1, scale
+            else:
+                param = None
+            mapping = reg.get('map')
+            registers.append((
+                reg['name'], int(reg['address']), int(reg.get('count', 1)),
+                reg.get('type', 'U16'), reg.get('unit', ''),
+                scale, param, tuple(mapping) if mapping else None, group))
+            groups[group].append(len(registers) - 1)
+    for reg in registers:
+        if reg[3] in TYPES:
+            continue
+        if ':' not in reg[3]:
+            raise EProfile(f'{source.get("name")}: unknown type {reg[3]} ({reg[0]})')
+    return {
+        'version': COMPILER_VERSION,
+        'name': source['name'],
+        'description': source.get('description', ''),
+        'unit_identifier': source.get('unit_identifier', 1),
+        'function': source.get('function', 3),
+        'max_regs': max_regs,
+        'max_gap': max_gap,
+        'registers': registers,
+        'groups': groups,
+        'plans': {
+            group: plan_blocks(registers, indexes, max_regs, max_gap)
+            for group, indexes in groups.items()
+        },
+    }
+
+
+def profile_path(name):
+    """Path of a profile: file path or name of a profile shipped with mvmodbus2"""
+    if os.path.exists(name):
+        return name
+    for ext in ('.json', '.toml', '.csv'):
+        path = os.path.join(PROFILES_DIR, name + ext)
+        if os.path.exists(path):
+            return path
+    raise EProfile(f'Profile {name} not found')
+
+
+def compile_profile(path, cache_dir=None):
+    """Compiled profile, from the cache if the source did not change"""
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    key = hashlib.sha1(
+        f'{COMPILER_VERSION} {path} {stat.st_mtime_ns} {stat.st_size}'.encode()
+    ).hexdigest()[:16]
+    cache_dir = cache_dir or default_cache_dir()
+    cache_path = os.path.join(
+        cache_dir, f'{os.path.splitext(os.path.basename(path))[0]}-{key}.marshal')
+    try:
+        with open(cache_path, 'rb') as cache_file:
+            return marshal.load(cache_file)
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+    compiled = compile_source(read_source(path))
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as cache_file:
+            marshal.dump(compiled, cache_file)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass  # cache non scrivibile: si ricompila la prossima volta
+    return compiled
+
+
+class device_profile:
+    """Compiled device profile: read plans and decoders"""
+
+    def __init__(self, compiled):
+        self.name = compiled['name']
+        self.description = compiled['description']
+        self.unit_identifier = compiled['unit_identifier']
+        self.function = compiled['function']
+        self.max_regs = compiled['max_regs']
+        self.max_gap = compiled['max_gap']
+        self.registers = compiled['registers']
+        self.groups = compiled['groups']
+        self.plans = compiled['plans']
+        self.decoders = {}
+
+    def register(self, name, group=None):
+        """(name, address, count, type, unit, scale, param, map, group)
+        of the register name"""
+        for reg in self.registers:
+            if reg[0] == name and (group is None or reg[8] == group):
+                return reg
+        raise KeyError(name)
+
+    def read_plan(self, groups=None, names=None):
+        """Read blocks for groups (all if None),
+        restricted to the registers names if not None"""
+        groups = list(self.groups) if groups is None else groups
+        if names is None and len(groups) == 1:
+            return self.plans[groups[0]]
+        indexes = [ndx for group in groups for ndx in self.groups[group]]
+        if names is not None:
+            names = set(names)
+            indexes = [ndx for ndx in indexes if self.registers[ndx][0] in names]
+        return plan_blocks(self.registers, indexes, self.max_regs, self.max_gap)
+
+    def block_decoder(self, block):
+        """Decoder pipeline of a block:
+        [(name, first word, last word, decoder, scale, divisor, param, map)]
+        scale 0.1, 0.01 ... is applied as a division (x / 10.0 as in ime106)"""
+        decoder = self.decoders.get(block)
+        if decoder is None:
+            start = block[0]
+            decoder = [
+                (reg[0], reg[1] - start, reg[1] - start + reg[2],
+                 resolve_type(reg[3]), reg[5], scale_divisor(reg[5]), reg[6], reg[7])
+                for reg in (self.registers[ndx] for ndx in block[2])
+            ]
+            self.decoders[block] = decoder
+        return decoder
+
+    def decode_block(self, block, words, params=None):
+        """Decode the words read for block. Return [(name, value)]"""
+        values = []
+        for (name, first, last, decoder, scale, divisor, param, mapping
+             ) in self.block_decoder(block):
+            value = decoder(words[first:last])
+            if mapping is not None:
+                value = mapping[value]
+            if param is not None:
+                value = value * (params or {}).get(param, 1)
+            if divisor:
+                value = value / divisor
+            elif scale != 1:
+                value = value * scale
+            values.append((name, value))
+        return values
+
+    def decode_raw(self, block, words):
+        """Values of block decoded by type and map, without scaling"""
+        return [
+            decoder(words[first:last]) if mapping is None
+            else mapping[decoder(words[first:last])]
+            for (dummy_name, first, last, decoder, dummy_scale, dummy_divisor,
+                 dummy_param, mapping) in self.block_decoder(block)
+        ]
+
+    def request(self, block, unit_identifier=None):
+        """Modbus request of block"""
+        mod_func = mvmodbus2.modbusf4 if self.function == 4 else mvmodbus2.modbusf3
+        return mod_func(
+            block[0], block[1],
+            unit_identifier=unit_identifier or self.unit_identifier)
+
+    def read(self, slave, groups=None, names=None, params=None, unit_identifier=None):
+        """Read and decode. Return {register name: value}"""
+        chat = getattr(slave, 'chat_blocking', slave.chat)
+        regs = {}
+        for block in self.read_plan(groups, names):
+            regs.update(self.decode_block(
+                block, chat(self.request(block, unit_identifier)), params))
+        return regs
+
+
+_loaded = {}
+
+
+def load_profile(name, cache_dir=None):
+    """Load a profile by name (shipped with mvmodbus2) or path"""
+    path = profile_path(name)
+    profile = _loaded.get(path)
+    if profile is None:
+        profile = _loaded[path] = device_profile(compile_profile(path, cache_dir))
+    return profile
+
+
+def load_profiles(directory, cache_dir=None):
+    """Load all the profiles of directory. Return {name: device_profile}"""
+    profiles = {}
+    for file_name in sorted(os.listdir(directory)):
+        if os.path.splitext(file_name)[1].lower() in ('.json', '.toml', '.csv'):
+            profile = load_profile(os.path.join(directory, file_name), cache_dir)
+            profiles[profile.name] = profile
+    return profiles
@@ -0,0 +1,327 @@
+"""Modbus TCP gateway / proxy.
+
+Many SCADA clients connect to the proxy; the proxy forwards the requests
+to the devices through modbus_tcp, modbus_udp or modbus_serial,
+keeping one persistent connection for each device.
+
+FC3 / FC4 reads of the same unit arriving within window seconds are
+merged in one downstream read for each span of consecutive (or
+overlapping) registers, then split back to the clients.
+The registers read are kept for cache_ttl seconds: a read covered by
+fresh registers is answered without going to the device.
+Writes (FC5, FC15, FC16, FC23) are forwarded as they are and invalidate the
+cache of the unit.
+"""
+
+import socketserver
+import struct
+import threading
+import time
+
+from mvmodbus2.control_loop import chat_blocking
+from mvmodbus2.functions import (
+    EFrame, ETout, modbusf3, modbusf4, modbusf5, modbusf15, modbusf16, modbusf23, modbusf43)
+from mvmodbus2.profile import MAX_REGS
+from mvmodbus2.scan import GATEWAY_PATH_UNAVAILABLE, GATEWAY_TARGET_FAILED
+
+# pylint: disable=invalid-name
+
+ILLEGAL_FUNCTION = 1
+ILLEGAL_DATA_VALUE = 3
+
+READ_FUNCTIONS = (3, 4)
+
+
+def request_from_pdu(pdu, unit_identifier):
+    """modbus_func of the request pdu, None if the function is not supported.
+    struct.error / IndexError on a short or malformed pdu"""
+    func_code = pdu[0]
+    if func_code in READ_FUNCTIONS:
+        start, count = struct.unpack('> H H', pdu[1:5])
+        mod_func = modbusf3 if func_code == 3 else modbusf4
+        return mod_func(start, count, unit_identifier=unit_identifier)
+    if func_code == 5:
+        coil, value = struct.unpack('> H H', pdu[1:5])
+        return modbusf5(coil // 16, coil % 16, value == 0xFF00, unit_identifier=unit_identifier)
+    if func_code == 15:
+        coil, count = struct.unpack('> H H', pdu[1:5])
+        return modbusf15(coil // 16, coil % 16,
+                         [pdu[6 + ndx // 8] >> (ndx % 8) & 1 for ndx in range(count)],
+                         unit_identifier=unit_identifier)
+    if func_code == 16:
+        start, count = struct.unpack('> H H', pdu[1:5])
+        return modbusf16(start, struct.unpack(f'> {count}H', pdu[6:6 + count * 2]),
+                         unit_identifier=unit_identifier)
+    if func_code == 23:
+        rstart, rcount, wstart, wcount = struct.unpack('> H H H H', pdu[1:9])
+        return modbusf23(rstart, rcount, wstart,
+                         struct.unpack(f'> {wcount}H', pdu[10:10 + wcount * 2]),
+                         unit_identifier=unit_identifier)
+    if func_code == 43 and len(pdu) >= 4 and pdu[1] == modbusf43.MEI_TYPE:
+        return modbusf43(pdu[2], pdu[3], unit_identifier=unit_identifier)
+    return None
+
+
+def response_pdu(mod_func, value):
+    """Response PDU of mod_func with the decoded answer value"""
+    func_code = mod_func.MOD_FUNC
+    if func_code in (3, 4, 23):
+        return struct.pack(f'> B B {len(value)}H', func_code, len(value) * 2, *value)
+    if func_code in (5, 15, 16):
+        return struct.pack('> B H H', func_code, *value)
+    conformity_level, more_follows, next_object_id, objects = value
+    pdu = struct.pack(
+        '> B B B B B B B', func_code, modbusf43.MEI_TYPE, mod_func.read_dev_id_code,
+        conformity_level, 0xFF if more_follows else 0, next_object_id, len(objects))
+    for object_id, object_value in objects.items():
+        pdu += struct.pack('> B B', object_id, len(object_value)) + object_value
+    return pdu
+
+
+def exception_pdu(func_code, exception_code):
+    """Exception response PDU"""
+    return struct.pack('> B B', func_code | 0x80, exception_code)
+
+
+def merge_ranges(ranges, max_regs=MAX_REGS):
+    """Spans (start, count) covering the ranges (start, count):
+    overlapping or adjacent ranges are merged up to max_regs registers"""
+    spans = []
+    for start, count in sorted(ranges):
+        if spans:
+            span_start, span_count = spans[-1]
+            end = max(span_start + span_count, start + count)
+            if start <= span_start + span_count and end - span_start <= max_regs:
+                spans[-1] = (span_start, end - span_start)
+                continue
+        spans.append((start, count))
+    return spans
+
+
+class _batch:
+    """Reads of one unit and function collected in a window"""
+
+    def __init__(self):
+        self.ranges = []
+        self.done = threading.Event()
+        self.words = {}
+        self.errors = []  # (start, count, exception) of the failed spans
+
+
+class coalescer:
+    """Downstream device of the proxy.
+    slave: transport, or function() -> transport (reconnected after
+    a transport error)"""
+
+    def __init__(self, slave, window=0.005, cache_ttl=0.1, max_regs=MAX_REGS):
+        if hasattr(slave, 'chat'):
+            self.factory = None
+            self.slave = slave
+        else:
+            self.factory = slave
+            self.slave = None
+        self.window = window
+        self.cache_ttl = cache_ttl
+        self.max_regs = max_regs
+        self.lock = threading.Lock()
+        self.bus_lock = threading.Lock()
+        self.pending = {}
+        self.cache = {}
+        self.downstream_reads = 0
+
+    def chat(self, mod_func):
+        """Forward mod_func to the device"""
+        with self.bus_lock:
+            if self.slave is None:
+                self.slave = self.factory()
+            try:
+                return chat_blocking(self.slave)(mod_func)
+            except (ETout, OSError):
+                if self.factory is not None:
+                    close = getattr(getattr(self.slave, 'sock', None), 'close', None)
+                    if close is not None:
+                        close()
+                    self.slave = None
+                raise
+
+    def cached(self, key, start, count):
+        """Words of the range if all fresh in cache, else None"""
+        regs = self.cache.get(key)
+        if not regs:
+            return None
+        oldest = time.monotonic() - self.cache_ttl
+        words = []
+        for addr in range(start, start + count):
+            entry = regs.get(addr)
+            if entry is None or entry[1] < oldest:
+                return None
+            words.append(entry[0])
+        return tuple(words)
+
+    def read(self, func_code, unit_identifier, start, count):
+        """Words of the FC3 / FC4 read start, count"""
+        key = (func_code, unit_identifier)
+        with self.lock:
+            words = self.cached(key, start, count)
+            if words is not None:
+                return words
+            batch = self.pending.get(key)
+            leader = batch is None
+            if leader:
+                batch = self.pending[key] = _batch()
+            batch.ranges.append((start, count))
+        if leader:
+            time.sleep(self.window)
+            with self.lock:
+                del self.pending[key]
+            self.run(key, batch)
+        else:
+            batch.done.wait()
+        words = batch.words
+        if all(addr in words for addr in range(start, start + count)):
+            return tuple(words[addr] for addr in range(start, start + count))
+        for span_start, span_count, exc in batch.errors:
+            if span_start < start + count and start < span_start + span_count:
+                break
+        else:
+            # nessun errore sul range: risposta corta del device, si rilegge
+            words = self.read_range(key, start, count)
+            if len(words) != count:
+                raise EFrame(f'Short answer: {len(words)} registers instead of {count}')
+            return words
+        if isinstance(exc, EFrame) and (span_start, span_count) != (start, count):
+            # the merged span failed (e.g. a range of another client):
+            # this range may be valid on its own
+            return self.read_range(key, start, count)
+        raise exc
+
+    def read_range(self, key, start, count):
+        """Downstream read of one range, cached"""
+        func_code, unit_identifier = key
+        mod_func = modbusf3 if func_code == 3 else modbusf4
+        words = self.chat(mod_func(start, count, unit_identifier=unit_identifier))
+        now = time.monotonic()
+        with self.lock:
+            self.downstream_reads += 1
+            regs = self.cache.setdefault(key, {})
+            for offset, word in enumerate(words):
+                regs[start + offset] = (word, now)
+        return tuple(words)
+
+    def run(self, key, batch):
+        """Downstream reads of the batch. A failed span is recorded and
+        the next spans are read all the same"""
+        try:
+            for start, count in merge_ranges(batch.ranges, self.max_regs):
+                try:
+                    words = self.read_range(key, start, count)
+                except (EFrame, ETout, OSError) as exc:
+                    batch.errors.append((start, count, exc))
+                    continue
+                for offset, word in enumerate(words):
+                    batch.words[start + offset] = word
+        finally:
+            batch.done.set()
+
+    def invalidate(self, unit_identifier):
+        """Drop the cache of unit_identifier"""
+        with self.lock:
+            for func_code in READ_FUNCTIONS:
+                self.cache.pop((func_code, unit_identifier), None)
+
+    def request(self, unit_identifier, pdu):
+        """Response PDU to the request pdu"""
+        try:
+            mod_func = request_from_pdu(pdu, unit_identifier)
+        except (struct.error, IndexError):  # PDU troncata o malformata
+            return exception_pdu(pdu[0], ILLEGAL_DATA_VALUE)
+        if mod_func is None:
+            return exception_pdu(pdu[0], ILLEGAL_FUNCTION)
+        try:
+            if pdu[0] in READ_FUNCTIONS:
+                if not 0 < mod_func.num_regs <= MAX_REGS:
+                    return exception_pdu(pdu[0], ILLEGAL_DATA_VALUE)
+                return response_pdu(mod_func, self.read(
+                    pdu[0], unit_identifier, mod_func.start_reg, mod_func.num_regs))
+            if pdu[0] != 43:
+                self.invalidate(unit_identifier)
+            return response_pdu(mod_func, self.chat(mod_func))
+        except EFrame as exc:
+            if exc.exception_code is None:
+                return exception_pdu(pdu[0], GATEWAY_TARGET_FAILED)
+            return exception_pdu(pdu[0], exc.exception_code)
+        except (ETout, OSError):
+            return exception_pdu(pdu[0], GATEWAY_TARGET_FAILED)
+
+
+class proxy_server:
+    """Modbus TCP server forwarding to the devices.
+    routes: {unit_identifier: transport or function() -> transport};
+    key None: device of the units not in routes"""
+
+    def __init__(self, routes, host='0.0.0.0', port=502, window=0.005, cache_ttl=0.1):
+        self.devices = {
+            unit: coalescer(slave, window, cache_ttl) for unit, slave in routes.items()
+        }
+        proxy = self
+
+        class handler(socketserver.BaseRequestHandler):
+            """One SCADA client connection"""
+
+            def handle(self):
+                while True:
+                    header = self.recv_exactly(7)
+                    if header is None:
+                        return
+                    transaction_identifier, dummy_protocol, length, unit_identifier = (
+                        struct.unpack('> H H H B', header))
+                    pdu = self.recv_exactly(length - 1)
+                    if not pdu:
+                        return
+                    answ = proxy.request(unit_identifier, pdu)
+                    self.request.sendall(struct.pack(
+                        '> H H H B', transaction_identifier, 0, len(answ) + 1,
+                        unit_identifier) + answ)
+
+            def recv_exactly(self, size):
+                """size bytes, None if the connection is closed"""
+                data = b''
+                while len(data) < size:
+                    part = self.request.recv(size - len(data))
+                    if not part:
+                        return None
+                    data += part
+                return data
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self.server = socketserver.ThreadingTCPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread = None
+        self.serving = False
+
+    def request(self, unit_identifier, pdu):
+        """Response PDU of the device of unit_identifier"""
+        device = self.devices.get(unit_identifier) or self.devices.get(None)
+        if device is None:
+            return exception_pdu(pdu[0], GATEWAY_PATH_UNAVAILABLE)
+        return device.request(unit_identifier, pdu)
+
+    def serve_forever(self):
+        """Serve in this thread (close() from another thread stops it)"""
+        self.serving = True
+        self.server.serve_forever()
+
+    def start(self):
+        """Serve in a background thread"""
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,),
+                                       daemon=True)
+        self.serving = True
+        self.thread.start()
+        return self
+
+    def close(self):
+        """Stop the server"""
+        if self.serving:
+            self.server.shutdown()
+        self.server.server_close()
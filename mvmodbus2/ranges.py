@@ -0,0 +1,54 @@
+"""Reads of any register span.
+
+A span longer than the protocol limit (modbusf3.MAX_REGS, 125 registers)
+is split in compliant chunks; the chunks are pipelined on the transports
+with pipeline() (modbus_tcp, modbus_udp, rtu_tcp.modbus_rtu_tcp), sent
+one after the other on the others (modbus_serial). The answers are
+reassembled in one contiguous array('H').
+See aio.async_read_range for the asyncio transports
+"""
+
+from array import array
+
+from mvmodbus2.control_loop import chat_blocking
+from mvmodbus2.functions import modbusf3, modbusf4
+
+# pylint: disable=invalid-name
+
+
+def split_range(start, count, max_regs=modbusf3.MAX_REGS):
+    """Chunks (start, count) of at most max_regs registers"""
+    return [
+        (chunk_start, min(max_regs, start + count - chunk_start))
+        for chunk_start in range(start, start + count, max_regs)
+    ]
+
+
+def range_requests(start, count, function=3, unit_identifier=None, max_regs=modbusf3.MAX_REGS):
+    """FC3 (or FC4) requests of the chunks of the span"""
+    mod_func = modbusf4 if function == 4 else modbusf3
+    return [
+        mod_func(chunk_start, chunk_count, unit_identifier=unit_identifier)
+        for chunk_start, chunk_count in split_range(start, count, max_regs)
+    ]
+
+
+def join_answers(answers):
+    """Words of the chunks in one array('H').
+    The first exception response (EFrame) in answers is raised"""
+    words = array('H')
+    for answ in answers:
+        if isinstance(answ, BaseException):
+            raise answ
+        words.extend(answ)
+    return words
+
+
+def read_range(slave, start, count, function=3, unit_identifier=None, window=4,
+               max_regs=modbusf3.MAX_REGS):
+    """count registers from start as array('H')"""
+    requests = range_requests(start, count, function, unit_identifier, max_regs)
+    if hasattr(slave, 'pipeline'):
+        return join_answers(slave.pipeline(requests, window))
+    chat = chat_blocking(slave)
+    return join_answers(chat(req) for req in requests)
@@ -0,0 +1,201 @@
+"""Per-device rate limiter with AIMD control.
+
+Every endpoint has a device_limiter:
+    token bucket: at most rate requests per second (burst in a row)
+    in-flight limit: at most limit requests sent and not answered
+Both grow additively while the device answers in time and are cut
+multiplicatively (decrease) when it is overloaded:
+    ETout, socket.timeout
+    exception response SLAVE DEVICE BUSY (6) or ACKNOWLEDGE (5)
+    latency above latency_target (default: 3 times the fastest answer seen)
+At most one cut for each round trip time: a burst of timeouts from the
+same overload counts once.
+
+rate_limited / async_rate_limited wrap a transport: chat goes through
+the limiter of the endpoint
+"""
+
+import asyncio
+import socket
+import threading
+import time
+
+from mvmodbus2.control_loop import chat_blocking
+from mvmodbus2.functions import EFrame, ETout
+
+# pylint: disable=invalid-name
+
+ACKNOWLEDGE = 5
+SLAVE_DEVICE_BUSY = 6
+BUSY_CODES = (ACKNOWLEDGE, SLAVE_DEVICE_BUSY)
+
+
+class device_limiter:
+    """Token bucket and in-flight limit of a device, AIMD controlled"""
+
+    def __init__(self, rate=10.0, min_rate=0.5, max_rate=500.0, burst=2.0,
+                 limit=1.0, min_limit=1.0, max_limit=8.0,
+                 increase=1.0, rate_increase=1.0, decrease=0.5, latency_target=None):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.tokens = burst
+        self.limit = limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.rate_increase = rate_increase
+        self.decrease = decrease
+        self.latency_target = latency_target
+        self.inflight = 0
+        self.srtt = None
+        self.min_rtt = None
+        self.last_cut = 0.0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def try_acquire(self):
+        """Take a token and an in-flight slot.
+        Return 0 if taken, else the seconds to wait before trying again"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.inflight >= int(self.limit):
+                return min(0.01, self.srtt or 0.01)
+            if self.tokens < 1:
+                return (1 - self.tokens) / self.rate
+            self.tokens -= 1
+            self.inflight += 1
+            return 0
+
+    def target(self):
+        """Latency above which the device is overloaded"""
+        if self.latency_target is not None:
+            return self.latency_target
+        return None if self.min_rtt is None else 3 * self.min_rtt
+
+    def success(self, latency):
+        """Answer in latency seconds"""
+        with self.lock:
+            self.inflight -= 1
+            self.srtt = latency if self.srtt is None else 0.875 * self.srtt + 0.125 * latency
+            self.min_rtt = latency if self.min_rtt is None else min(self.min_rtt, latency)
+            target = self.target()
+            if target is not None and latency > target:
+                self._cut()
+                return
+            # additive increase: limit +increase each round trip,
+            # rate +rate_increase req/s each second at full rate
+            self.limit = min(self.max_limit, self.limit + self.increase / self.limit)
+            self.rate = min(self.max_rate, self.rate + self.rate_increase / self.rate)
+
+    def congestion(self):
+        """Timeout or busy answer"""
+        with self.lock:
+            self.inflight -= 1
+            self._cut()
+
+    def done(self):
+        """Answer that says nothing about the load (other exception responses)"""
+        with self.lock:
+            self.inflight -= 1
+
+    def _cut(self):
+        """Multiplicative decrease, once for each round trip"""
+        now = time.monotonic()
+        if now - self.last_cut < (self.srtt or 0):
+            return
+        self.last_cut = now
+        self.limit = max(self.min_limit, self.limit * self.decrease)
+        self.rate = max(self.min_rate, self.rate * self.decrease)
+
+    def outcome(self, exc, latency):
+        """Feedback of one transaction: exc None or the exception raised"""
+        if exc is None:
+            self.success(latency)
+        elif isinstance(exc, (ETout, socket.timeout, TimeoutError, asyncio.TimeoutError)):
+            self.congestion()
+        elif isinstance(exc, EFrame) and exc.exception_code in BUSY_CODES:
+            self.congestion()
+        else:
+            self.done()
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def limiter_for(endpoint, **kwargs):
+    """device_limiter of endpoint (e.g. transport.clie_addr), created on first use"""
+    with _limiters_lock:
+        limiter = _limiters.get(endpoint)
+        if limiter is None:
+            limiter = _limiters[endpoint] = device_limiter(**kwargs)
+        return limiter
+
+
+class rate_limited:
+    """Transport with chat through a device_limiter.
+    limiter: None for the limiter of slave.clie_addr"""
+
+    def __init__(self, slave, limiter=None):
+        self.slave = slave
+        self.limiter = limiter or limiter_for(
+            getattr(slave, 'clie_addr', None) or getattr(slave, 'address', None) or id(slave))
+        self._chat = chat_blocking(slave)
+
+    def chat(self, mod_func):
+        """Esegue la sequenza invio, risposta"""
+        while True:
+            delay = self.limiter.try_acquire()
+            if not delay:
+                break
+            time.sleep(delay)
+        start = time.monotonic()
+        try:
+            answ = self._chat(mod_func)
+        except BaseException as exc:
+            self.limiter.outcome(exc, time.monotonic() - start)
+            raise
+        self.limiter.outcome(None, time.monotonic() - start)
+        return answ
+
+    def transact(self, mod_func):
+        """chat returning a modbus_response"""
+        return mod_func.result(self.chat(mod_func))
+
+    def __getattr__(self, name):
+        return getattr(self.slave, name)
+
+
+class async_rate_limited:
+    """asyncio transport (aio.py) with chat through a device_limiter"""
+
+    def __init__(self, slave, limiter=None):
+        self.slave = slave
+        self.limiter = limiter or limiter_for(getattr(slave, 'clie_addr', None) or id(slave))
+
+    async def chat(self, mod_func):
+        """Esegue la sequenza invio, risposta"""
+        while True:
+            delay = self.limiter.try_acquire()
+            if not delay:
+                break
+            await asyncio.sleep(delay)
+        start = time.monotonic()
+        try:
+            answ = await self.slave.chat(mod_func)
+        except BaseException as exc:
+            self.limiter.outcome(exc, time.monotonic() - start)
+            raise
+        self.limiter.outcome(None, time.monotonic() - start)
+        return answ
+
+    async def transact(self, mod_func):
+        """chat returning a modbus_response"""
+        return mod_func.result(await self.chat(mod_func))
+
+    def __getattr__(self, name):
+        return getattr(self.slave, name)
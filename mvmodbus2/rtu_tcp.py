@@ -0,0 +1,163 @@
+"""Modbus RTU frames over TCP (serial device servers).
+
+Unlike modbus_serial.tcp_start_serial the frames are delimited by the
+expected length (from the function code and the byte count) and checked
+by CRC: no fixed waits, no flush delay before each request.
+Requests can be pipelined: the device server queues them on the serial
+line and the answers come back in the same order.
+See aio.py for many gateways driven by one asyncio event loop
+"""
+
+import socket
+import time
+
+from mvmodbus2.endpoints import DEFAULT_OPTIONS
+from mvmodbus2.functions import EFrame, ETout
+from mvmodbus2.transports import (
+    TURNAROUND_DELAY, crc16, init_lock, modbus_build_RTU_broadcast, modbus_build_RTU_message,
+    prepared_request, tcp_connect)
+
+# pylint: disable=invalid-name
+
+
+def rtu_frame(mod_func):
+    """RTU ADU of mod_func (prepared_request with rtu=True or modbus_func).
+    ValueError for a prepared_request with TCP framing"""
+    if isinstance(mod_func, prepared_request):
+        if not mod_func.rtu:
+            raise ValueError('prepared_request(rtu=False) on a RTU transport')
+        return mod_func.adu
+    return modbus_build_RTU_message(mod_func)
+
+
+def rtu_bytes_left(mod_func, frame):
+    """How many bytes are still needed to complete the answer frame
+    (unit identifier, PDU, CRC)"""
+    if len(frame) < 3:
+        return 3 - len(frame)
+    try:
+        return mod_func.bytes_left(frame[1:]) + 2
+    except EFrame:
+        return 5 - len(frame)  # exception response: unit, fc, code, CRC
+
+
+def rtu_decode(mod_func, frame):
+    """Check CRC and unit identifier, decode the answer"""
+    if crc16(frame[:-2]) != frame[-2:]:
+        raise EFrame(f'CRC error {frame!r}')
+    if frame[0] != mod_func.unit_identifier:
+        raise EFrame(f'Answer from unit {frame[0]} instead of {mod_func.unit_identifier}')
+    return mod_func.answ(frame[1:-2])
+
+
+class modbus_rtu_tcp:
+    """RTU over TCP connection to a serial device server.
+    threadsafe, capture, options: see modbus_tcp. RTU: see modbus_serial"""
+    capture = None
+    RTU = True
+
+    def __init__(self, clie_addr, port=502, timeout=2, threadsafe=True, options=None):
+        self.clie_addr = (clie_addr, port)
+        self.timeout = timeout
+        self.options = options or DEFAULT_OPTIONS
+        self.sock = tcp_connect(self.clie_addr, timeout, self.options)
+        init_lock(self, threadsafe)
+
+    def reconnect(self):
+        """New connection in place of one with late answers still on the way
+        (RTU has no transaction identifier, see modbus_tcp.reconnect)"""
+        self.sock.close()
+        self.sock = tcp_connect(self.clie_addr, self.timeout, self.options)
+
+    def drain(self):
+        """Drop late answers of previous requests, without waiting"""
+        self.sock.setblocking(False)
+        try:
+            while self.sock.recv(1024):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        finally:
+            self.sock.settimeout(self.timeout)
+
+    def send(self, mod_func):
+        """Send the RTU frame of mod_func"""
+        msg = rtu_frame(mod_func)
+        self.sock.sendall(msg)
+        if self.capture is not None:
+            self.capture.tx(msg)
+
+    def recv(self, mod_func):
+        """Receive the answer frame of mod_func and decode it.
+        Timeout: ETout, the connection is opened again (the late answers
+        still in flight would be taken for the next ones)"""
+        frame = b''
+        left = rtu_bytes_left(mod_func, frame)
+        while left > 0:
+            try:
+                part = self.sock.recv(left)
+            except socket.timeout as exc:
+                self.reconnect()
+                raise ETout(f'No answer {frame!r}') from exc
+            if not part:
+                raise ETout(f'Connection closed {frame!r}')
+            if self.capture is not None:
+                self.capture.rx(part)
+            frame += part
+            left = rtu_bytes_left(mod_func, frame)
+        return rtu_decode(mod_func, frame)
+
+    def chat(self, mod_func):
+        """Esegue la sequenza invio, risposta"""
+        with self.lock:
+            self.drain()
+            self.send(mod_func)
+            return self.recv(mod_func)
+
+    def chat_unlocked(self, mod_func):
+        """chat for a single thread"""
+        self.drain()
+        self.send(mod_func)
+        return self.recv(mod_func)
+
+    def transact(self, mod_func):
+        """chat returning a modbus_response"""
+        return mod_func.result(self.chat(mod_func))
+
+    def pipeline(self, requests, window=4):
+        """Send up to window requests before reading the answers.
+        Return the answers in the order of requests; an exception response
+        or a CRC error takes the place of the answer as EFrame.
+        On timeout the connection is opened again and ETout raised"""
+        with self.lock:
+            return self.pipeline_unlocked(requests, window)
+
+    def pipeline_unlocked(self, requests, window=4):
+        """pipeline for a single thread"""
+        self.drain()
+        answers = []
+        sent = 0
+        while len(answers) < len(requests):
+            while sent < len(requests) and sent - len(answers) < window:
+                self.send(requests[sent])
+                sent += 1
+            try:
+                answers.append(self.recv(requests[len(answers)]))
+            except EFrame as exc:
+                answers.append(exc)
+        return answers
+
+    def broadcast(self, mod_func, turnaround_delay=TURNAROUND_DELAY):
+        """Write mod_func to every slave behind the device server
+        (address 0, no answer), see modbus_serial.broadcast"""
+        msg = modbus_build_RTU_broadcast(mod_func)
+        with self.lock:
+            self.drain()
+            self.sock.sendall(msg)
+            if self.capture is not None:
+                self.capture.tx(msg)
+            time.sleep(turnaround_delay)
+
+    def close(self):
+        """Close the connection"""
+        self.sock.close()
@@ -0,0 +1,141 @@
+"""Scaling engine: scale, offset and sign vectors of a device.
+
+The vectors are computed once for each read plan of a profile
+(see profile.py) from:
+    the static scale of each register (profile "scale")
+    the parameters of the device (e.g. nota3 and nota4 of ime106 from KTA, KTV)
+    the unit column, converted to the company standard units (COMPANY_UNITS)
+and applied to all the values read in a poll cycle.
+The parameters belong to the scaling_engine: every device has its own
+"""
+
+import re
+
+# pylint: disable=invalid-name
+
+# unita' di misura standard aziendali (come ime106): base unit -> (unit, factor)
+COMPANY_UNITS = {
+    'V': ('mV', 1000),
+    'A': ('mA', 1000),
+    'W': ('W', 1),
+    'var': ('var', 1),
+    'VA': ('VA', 1),
+    'Wh': ('kWh', 0.001),
+    'varh': ('kvarh', 0.001),
+    'VAh': ('kVAh', 0.001),
+    'Hz': ('Hz', 1),
+    'h': ('h', 1),
+    '-': ('-', 1),
+}
+
+UNIT_RE = re.compile(r'^\s*([A-Za-z-]+)\s*/\s*([0-9.]+(?:[eE][-+]?[0-9]+)?)\s*$')
+
+
+def company_unit(unit):
+    """(company unit, factor) for a unit as "V / 100" (value in V / 100).
+    (unit, 1) if the unit is not in this form"""
+    match = UNIT_RE.match(unit)
+    if match is None or match.group(1) not in COMPANY_UNITS:
+        return (unit, 1)
+    std_unit, std_factor = COMPANY_UNITS[match.group(1)]
+    return (std_unit, std_factor / float(match.group(2)))
+
+
+class scaling_engine:
+    """Scaling of the values of one device.
+    profile: device_profile
+    params: values of the profile parameters (e.g. {'nota3': 0.01})
+    signs: {register name: name of its sign register (value 1 or -1)}
+    normalise: convert to COMPANY_UNITS"""
+
+    def __init__(self, profile, params=None, signs=None, normalise=True):
+        self.profile = profile
+        self.params = dict(params or {})
+        self.signs = dict(signs or {})
+        self.normalise = normalise
+        self.vectors = {}
+
+    def set_params(self, **params):
+        """New parameters (e.g. after a KTA change): the vectors are recomputed"""
+        self.params.update(params)
+        self.vectors = {}
+
+    def register_scale(self, reg):
+        """(factor, offset, unit) of a profile register"""
+        factor = reg[5] * (self.params.get(reg[6], 1) if reg[6] is not None else 1)
+        unit = reg[4]
+        if self.normalise:
+            unit, unit_factor = company_unit(unit)
+            factor = factor * unit_factor
+        return (factor, 0, unit)
+
+    def plan_vectors(self, groups=None, names=None):
+        """Read plan and vectors (names, scales, offsets, sign pairs, units)"""
+        key = (tuple(groups) if groups is not None else None,
+               frozenset(names) if names is not None else None)
+        vectors = self.vectors.get(key)
+        if vectors is None:
+            plan = self.profile.read_plan(groups, names)
+            regs = [self.profile.registers[ndx] for block in plan for ndx in block[2]]
+            scales = [self.register_scale(reg) for reg in regs]
+            reg_names = [reg[0] for reg in regs]
+            position = {name: ndx for ndx, name in enumerate(reg_names)}
+            sign_pairs = [
+                (position[name], position[sign])
+                for name, sign in self.signs.items()
+                if name in position and sign in position
+            ]
+            vectors = self.vectors[key] = (
+                plan, reg_names,
+                [scale[0] for scale in scales],
+                [scale[1] for scale in scales],
+                sign_pairs,
+                [scale[2] for scale in scales])
+        return vectors
+
+    def apply(self, raw, scales, offsets, sign_pairs):
+        """Scale all the raw values of a cycle"""
+        values = [
+            value * scale + offset if scale != 1 or offset else value
+            for value, scale, offset in zip(raw, scales, offsets)
+        ]
+        for ndx, sign_ndx in sign_pairs:
+            values[ndx] = values[ndx] * values[sign_ndx]
+        return values
+
+    def scale_blocks(self, blocks, groups=None, names=None):
+        """Values from the words read for each block of the plan.
+        Return {register name: value}"""
+        plan, reg_names, scales, offsets, sign_pairs, dummy_units = self.plan_vectors(
+            groups, names)
+        raw = []
+        for block, words in zip(plan, blocks):
+            raw.extend(self.profile.decode_raw(block, words))
+        return dict(zip(reg_names, self.apply(raw, scales, offsets, sign_pairs)))
+
+    def read(self, slave, groups=None, names=None, unit_identifier=None):
+        """Read and scale. Return {register name: value}"""
+        chat = getattr(slave, 'chat_blocking', slave.chat)
+        plan = self.plan_vectors(groups, names)[0]
+        return self.scale_blocks(
+            [chat(self.profile.request(block, unit_identifier)) for block in plan],
+            groups, names)
+
+    def units(self, groups=None, names=None):
+        """{register name: unit of the scaled value}"""
+        vectors = self.plan_vectors(groups, names)
+        return dict(zip(vectors[1], vectors[5]))
+
+
+class meter:
+    """Device polled by a blocking transport (aio.async_meter for asyncio).
+    engine: scaling_engine"""
+
+    def __init__(self, slave, engine, unit_identifier=None):
+        self.slave = slave
+        self.engine = engine
+        self.unit_identifier = unit_identifier
+
+    def snapshot(self, groups=None, names=None):
+        """Values of groups (all if None) scaled. Return {register name: value}"""
+        return self.engine.read(self.slave, groups, names, self.unit_identifier)
@@ -0,0 +1,419 @@
+"""Network discovery and unit identifier scan.
+
+scan_tcp / scan_udp sweep an IP range (e.g. '10.36.20.0/24') and the unit
+identifiers behind each host, scan_serial sweeps the unit identifiers
+of a serial line.
+The hosts are probed concurrently with at most max_outstanding probes in
+flight. The unit identifiers of a TCP / UDP host are probed pipelined on
+one connection, PROBE_WINDOW requests in flight with their own transaction
+identifier. The probe timeout adapts to the response time of each host.
+The units found are recognized through their identification registers
+(see FINGERPRINTS)
+"""
+
+import collections
+import concurrent.futures
+import errno
+import ipaddress
+import selectors
+import socket
+import struct
+import time
+
+import mvmodbus2
+from mvmodbus2.endpoints import default_resolver
+from mvmodbus2.functions import MBAP_LEN
+from mvmodbus2.transports import prepared_request
+
+# pylint: disable=invalid-name
+
+UNIT_IDS = range(1, 248)
+PROBE_WINDOW = 8  # probe in volo per host (transaction identifier diversi)
+
+# Exception codes di un gateway: lo slave dietro al gateway non esiste
+GATEWAY_PATH_UNAVAILABLE = 0x0A
+GATEWAY_TARGET_FAILED = 0x0B
+
+scan_result = collections.namedtuple(
+    'scan_result', ('host', 'port', 'transport', 'unit_identifier', 'device', 'rtt'))
+
+
+class adaptive_timeout:
+    """Timeout from the smoothed response time (as TCP RTO, RFC 6298):
+    srtt + 4 * rttvar, limited to [min_timeout, max_timeout]"""
+
+    def __init__(self, initial=0.5, min_timeout=0.05, max_timeout=2.0):
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.srtt = None
+        self.rttvar = None
+        self.timeout = initial
+
+    def update(self, rtt):
+        """A response arrived in rtt seconds"""
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.timeout = min(
+            max(self.srtt + 4 * self.rttvar, self.min_timeout), self.max_timeout)
+        return self.timeout
+
+
+def fingerprint_socomec(chat, unit_identifier):
+    """SOCOMEC: "SOCO" in the first registers of REGISTRI_PRODUCTID"""
+    from mvmodbus2 import socomec_a40  # pylint: disable=import-outside-toplevel
+    reg = socomec_a40.REGISTRI_PRODUCTID[0]
+    answ = chat(mvmodbus2.modbusf3(reg[0], reg[1], unit_identifier=unit_identifier))
+    return reg[4](answ) == 'SOCO'
+
+
+IME_DEVICE_IDENTIFIERS = (0x10,)
+
+
+def fingerprint_ime(chat, unit_identifier):
+    """IME: device identifier register (0x1204 in REGISTRI_MISURE106)"""
+    from mvmodbus2 import ime106  # pylint: disable=import-outside-toplevel
+    reg = ime106.REGISTRI_MISURE106_map['Device identifier']
+    answ = chat(mvmodbus2.modbusf3(reg['address'], 1, unit_identifier=unit_identifier))
+    return answ[0] in IME_DEVICE_IDENTIFIERS
+
+
+FINGERPRINTS = [
+    ('socomec_a40', fingerprint_socomec),
+    ('ime106', fingerprint_ime),
+]
+
+
+def fingerprint(chat, unit_identifier):
+    """Name of the device answering at unit_identifier.
+    Known devices first, then FC43 Read Device Identification.
+    None if not recognized"""
+    for name, probe in FINGERPRINTS:
+        try:
+            if probe(chat, unit_identifier):
+                return name
+        except (mvmodbus2.EFrame, mvmodbus2.ETout, OSError, struct.error):
+            pass
+    try:
+        from mvmodbus2 import device_id  # pylint: disable=import-outside-toplevel
+        dummy_conformity, objects = device_id.read_device_identification(
+            _chat_object(chat), unit_identifier=unit_identifier)
+        return ' '.join(objects.get(name, '') for name in ('VendorName', 'ProductCode'))
+    except (mvmodbus2.EFrame, mvmodbus2.ETout, OSError, struct.error):
+        return None
+
+
+class _chat_object:
+    """Adapt a chat function to the slave interface"""
+    def __init__(self, chat):
+        self.chat = chat
+
+
+def expand_hosts(hosts):
+    """List of addresses from a network ('10.0.0.0/24'), an address
+    or a list of them"""
+    if isinstance(hosts, str):
+        hosts = [hosts]
+    addresses = []
+    for host in hosts:
+        try:
+            network = ipaddress.ip_network(host, strict=False)
+        except ValueError:
+            addresses.append(host)  # hostname
+            continue
+        if network.num_addresses == 1:
+            addresses.append(str(network.network_address))
+        else:
+            addresses.extend(str(address) for address in network.hosts())
+    return addresses
+
+
+def host_address(host, port):
+    """(family, sockaddr) of an IPv4 / IPv6 address or of a hostname"""
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return default_resolver.address(host, port)
+    if address.version == 6:
+        return socket.AF_INET6, (host, port, 0, 0)
+    return socket.AF_INET, (host, port)
+
+
+def discover_tcp(hosts, port=502, timeout=0.5, max_outstanding=256):
+    """Hosts accepting a TCP connection on port.
+    Non-blocking connect, at most max_outstanding at the same time.
+    Return [(host, connect time)]"""
+    pending = iter(expand_hosts(hosts))
+    sel = selectors.DefaultSelector()
+    found = []
+    inflight = 0
+    exhausted = False
+    while True:
+        while not exhausted and inflight < max_outstanding:
+            host = next(pending, None)
+            if host is None:
+                exhausted = True
+                break
+            try:
+                family, sockaddr = host_address(host, port)
+                sock = socket.socket(family, socket.SOCK_STREAM)
+            except OSError:
+                continue
+            sock.setblocking(False)
+            err = sock.connect_ex(sockaddr)
+            if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                sock.close()
+                continue
+            sel.register(sock, selectors.EVENT_WRITE, (host, time.monotonic()))
+            inflight += 1
+        if inflight == 0:
+            break
+        now = time.monotonic()
+        for key, dummy_events in sel.select(timeout=0.05):
+            host, started = key.data
+            sel.unregister(key.fileobj)
+            inflight -= 1
+            if key.fileobj.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0:
+                found.append((host, time.monotonic() - started))
+            key.fileobj.close()
+        for key in list(sel.get_map().values()):
+            if now - key.data[1] > timeout:
+                sel.unregister(key.fileobj)
+                key.fileobj.close()
+                inflight -= 1
+    sel.close()
+    return found
+
+
+class _unit_prober:
+    """Probe the unit identifiers behind one endpoint.
+    The transport is reopened after a timeout: a late response
+    must not be taken as the answer to the next request"""
+
+    def __init__(self, open_slave, timer):
+        self.open_slave = open_slave
+        self.timer = timer
+        self.slave = open_slave(timer.timeout)
+
+    def chat(self, mod_func):
+        """chat with the current adaptive timeout"""
+        self.slave.timeout = self.timer.timeout
+        sock = getattr(self.slave, 'sock', None)
+        if sock is not None:
+            sock.settimeout(self.timer.timeout)
+        started = time.monotonic()
+        try:
+            answ = self.slave.chat(mod_func)
+        except (socket.timeout, mvmodbus2.ETout):
+            self.close()
+            self.slave = self.open_slave(self.timer.timeout)
+            raise
+        except mvmodbus2.EFrame:
+            self.timer.update(time.monotonic() - started)
+            raise
+        self.timer.update(time.monotonic() - started)
+        return answ
+
+    def probe(self, unit_identifier):
+        """True if unit_identifier answers.
+        An exception response is an answer, except the gateway ones"""
+        msg = mvmodbus2.modbusf3(0, 1, unit_identifier=unit_identifier)
+        try:
+            self.chat(msg)
+        except mvmodbus2.EFrame:
+            return msg.bytecount not in (GATEWAY_PATH_UNAVAILABLE, GATEWAY_TARGET_FAILED)
+        except (socket.timeout, mvmodbus2.ETout, OSError, struct.error):
+            return False
+        return True
+
+    def probe_units(self, units, window=PROBE_WINDOW):
+        """[(unit_identifier, rtt)] of the units that answer.
+        TCP / UDP (transports with recv_adu): window probes in flight,
+        answers matched by transaction identifier. A timeout does not
+        reopen the transport during the sweep: the late answers are discarded
+        by identifier. After the sweep the transport is reopened if a probe
+        timed out: chat (fingerprint) does not check the identifier.
+        Other transports: one probe at a time"""
+        if not hasattr(self.slave, 'recv_adu'):
+            found = []
+            for unit_identifier in units:
+                started = time.monotonic()
+                if self.probe(unit_identifier):
+                    found.append((unit_identifier, time.monotonic() - started))
+            return found
+        units = iter(units)
+        found = []
+        waiting = {}
+        exhausted = False
+        timed_out = False
+        while True:
+            while not exhausted and len(waiting) < window:
+                unit_identifier = next(units, None)
+                if unit_identifier is None:
+                    exhausted = True
+                    break
+                msg = prepared_request(
+                    mvmodbus2.modbusf3(0, 1, unit_identifier=unit_identifier))
+                self.slave.send(msg)
+                waiting[self.slave.transaction_identifier] = (
+                    unit_identifier, msg, time.monotonic())
+            if not waiting:
+                break
+            oldest = min(started for dummy_unit, dummy_msg, started in waiting.values())
+            self.slave.timeout = max(0.001, oldest + self.timer.timeout - time.monotonic())
+            try:
+                data = self.slave.recv_adu()
+            except socket.timeout:
+                now = time.monotonic()
+                for tid, (dummy_unit, dummy_msg, started) in list(waiting.items()):
+                    if now - started >= self.timer.timeout:
+                        del waiting[tid]
+                        timed_out = True
+                continue
+            except (mvmodbus2.ETout, OSError):
+                # frame incompleto o connessione persa: le probe in volo sono perse
+                waiting.clear()
+                self.close()
+                self.slave = self.open_slave(self.timer.timeout)
+                continue
+            entry = waiting.pop(struct.unpack('> H', data[:2])[0], None)
+            if entry is None:
+                continue  # risposta tardiva
+            unit_identifier, msg, started = entry
+            rtt = time.monotonic() - started
+            self.timer.update(rtt)
+            try:
+                msg.answ(data[MBAP_LEN:])
+            except mvmodbus2.EFrame:
+                if msg.bytecount in (GATEWAY_PATH_UNAVAILABLE, GATEWAY_TARGET_FAILED):
+                    continue
+            except struct.error:
+                continue
+            found.append((unit_identifier, rtt))
+        if timed_out:
+            self.close()
+            self.slave = self.open_slave(self.timer.timeout)
+        return found
+
+    def close(self):
+        """Close the transport"""
+        sock = getattr(self.slave, 'sock', None)
+        if sock is not None:
+            sock.close()
+
+
+def scan_units(open_slave, units=UNIT_IDS, timer=None, identify=True, window=PROBE_WINDOW):
+    """Sweep units on the endpoint opened by open_slave(timeout),
+    window probes in flight on TCP / UDP (see _unit_prober.probe_units).
+    Return [(unit_identifier, device name, rtt)] in the order of units"""
+    timer = timer or adaptive_timeout()
+    units = list(units)
+    prober = _unit_prober(open_slave, timer)
+    found = []
+    try:
+        answered = dict(prober.probe_units(units, window))
+        for unit_identifier in units:
+            if unit_identifier in answered:
+                device = fingerprint(prober.chat, unit_identifier) if identify else None
+                found.append((unit_identifier, device, answered[unit_identifier]))
+    finally:
+        prober.close()
+    return found
+
+
+def _scan_host(host, port, transport, units, timeout, identify):
+    """Unit sweep of a single host"""
+    if transport == 'tcp':
+        def open_slave(probe_timeout):
+            return mvmodbus2.modbus_tcp(host, port=port, timeout=probe_timeout)
+    else:
+        def open_slave(probe_timeout):
+            return mvmodbus2.modbus_udp(host, port=port, timeout=probe_timeout)
+    try:
+        found = scan_units(
+            open_slave, units, adaptive_timeout(initial=timeout), identify=identify)
+    except OSError:
+        return []
+    return [
+        scan_result(host, port, transport, unit_identifier, device, rtt)
+        for unit_identifier, device, rtt in found
+    ]
+
+
+def scan_tcp(hosts, port=502, units=UNIT_IDS, timeout=0.5,
+             max_outstanding=64, identify=True):
+    """Scan of Modbus TCP hosts: connect sweep, then unit sweep
+    of the hosts found, max_outstanding hosts at the same time"""
+    open_hosts = discover_tcp(hosts, port, timeout, max_outstanding=max(max_outstanding, 256))
+    return _scan_hosts(
+        [(host, max(timeout, 4 * rtt)) for host, rtt in open_hosts],
+        port, 'tcp', units, max_outstanding, identify)
+
+
+def scan_udp(hosts, port=502, units=UNIT_IDS, timeout=0.5,
+             max_outstanding=64, identify=True, discovery_units=(255, 1)):
+    """Scan of Modbus UDP hosts.
+    UDP has no connection: a host is swept only if it answers
+    one of discovery_units"""
+    addresses = expand_hosts(hosts)
+
+    def alive(host):
+        found = scan_units(
+            lambda probe_timeout: mvmodbus2.modbus_udp(host, port=port, timeout=probe_timeout),
+            discovery_units, adaptive_timeout(initial=timeout, max_timeout=timeout),
+            identify=False)
+        return (host, max(rtt for dummy_unit, dummy_device, rtt in found)) if found else None
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_outstanding) as pool:
+        open_hosts = [answ for answ in pool.map(alive, addresses) if answ]
+    return _scan_hosts(
+        [(host, max(timeout, 4 * rtt)) for host, rtt in open_hosts],
+        port, 'udp', units, max_outstanding, identify)
+
+
+def _scan_hosts(hosts, port, transport, units, max_outstanding, identify):
+    """Unit sweep of the hosts, concurrently"""
+    results = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_outstanding) as pool:
+        futures = [
+            pool.submit(_scan_host, host, port, transport, units, timeout, identify)
+            for host, timeout in hosts
+        ]
+        for future in futures:
+            results.extend(future.result())
+    return results
+
+
+class _serial_chat:
+    """Blocking chat on a modbus_serial with adaptive timeout"""
+
+    def __init__(self, slave):
+        self.slave = slave
+        self.timeout = 0.2
+
+    def chat(self, mod_func):
+        """chat_blocking without retries"""
+        try:
+            return self.slave.chat_blocking(mod_func, timeout=self.timeout, retry_max=0)
+        except mvmodbus2.ETout:
+            # la prossima richiesta deve essere inviata
+            self.slave.wait_answ = 0
+            self.slave.send_count = 0
+            raise
+
+
+def scan_serial(slave, units=UNIT_IDS, timeout=0.2, identify=True):
+    """Scan of the unit identifiers of a serial line (modbus_serial already started).
+    The line is half duplex: the units are probed one at a time"""
+    chat = _serial_chat(slave)
+    name = getattr(slave, 'address', None) or getattr(slave.serial, 'name', '')
+    found = scan_units(
+        lambda probe_timeout: chat, units,
+        adaptive_timeout(initial=timeout), identify=identify)
+    return [
+        scan_result(name, None, 'rtu', unit_identifier, device, rtt)
+        for unit_identifier, device, rtt in found
+    ]
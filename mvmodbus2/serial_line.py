@@ -0,0 +1,224 @@
+"""Modbus RTU on serial line as per Modbus_over_serial_line_V1_02.pdf,
+directly on a tty or tunneled in a TCP connection"""
+
+import select
+import socket
+import threading
+import time
+import termios
+
+from mvmodbus2.functions import EAgain, EFrame, ETout
+from mvmodbus2.rtu_tcp import rtu_bytes_left, rtu_decode, rtu_frame
+from mvmodbus2.transports import TURNAROUND_DELAY, modbus_build_RTU_broadcast
+
+# pylint: disable=invalid-name
+
+
+class modbus_serial(object):
+    """Serial connection
+
+    threadsafe: a transaction belongs to the thread that sends the request
+    until the answer (or an error) is received. The other threads
+    wait in chat. threadsafe=False for a line used by a single thread.
+    A thread that stops calling chat (EAgain) for abandon_timeout
+    seconds abandons its transaction: the line goes to a waiting thread
+    (chat_blocking never abandons: it ends with the answer or ETout)
+
+    capture: capture hook (see capture.py), None: no capture
+    RTU: RTU framing (capture, fidelity of socomec_a40)
+    """
+    capture = None
+    RTU = True
+    abandon_timeout = 5
+
+    def __init__(self, threadsafe=True):
+        # wait_answ vale:
+        #    0: non si attende risposta
+        #    1: avviare ricezione risposta
+        #    2: ricevuto intestazione (byte count). In attesa del rimanente
+        #    3: ricevuto
+        self.wait_answ = 0
+        self.fase = 0
+        self.rcv_buf = b''
+        self.start_chat = 0
+        self.send_count = 0
+        self.serial = None
+        self.use_socket = None
+        self.address = None
+        self.threadsafe = threadsafe
+        self.lock = threading.Lock()
+        self.owner_lock = threading.Lock()
+        self.owner = None
+        self.last_poll = 0
+
+    def start_serial(self, name, speed=termios.B9600):
+        """start serial con name device"""
+        self.serial = open(name, 'rb+', 0)
+        try:
+            ts = termios.tcgetattr(self.serial)
+            ts[0] = termios.IGNBRK | termios.IGNPAR
+            ts[1] = 0
+            ts[2] = (termios.CS8 | termios.CREAD | termios.HUPCL |
+                     termios.CLOCAL)
+            ts[3] = 0
+            ts[4] = termios.B0
+            ts[5] = termios.B0
+            ts[6][termios.VMIN] = 0
+            ts[6][termios.VTIME] = 0
+            termios.tcsetattr(self.serial, termios.TCSANOW, ts)
+            ts[4] = speed
+            ts[5] = speed
+            termios.tcsetattr(self.serial, termios.TCSANOW, ts)
+        except termios.error:
+            pass
+        self.use_socket = False
+
+    def tcp_start_serial(self, name, timeout=5):
+        """Start e remote serial via TCP"""
+        self.address = name
+        self.serial = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.serial.settimeout(timeout)
+        self.serial.connect(self.address)
+        self.use_socket = True
+
+    ###### Operazioni di invio e ricezione dal canale
+    def flush_in(self, wait_for=0.1):
+        """ Vuota il buffer di ricezione"""
+        if self.serial in select.select([self.serial], [], [], wait_for)[0]:
+            self.recv()
+        self.rcv_buf = b''
+        self.wait_answ = 0
+
+    def send(self, msg):
+        """Invia una richiesta e prepara per la risposta"""
+        self.flush_in()
+        if self.use_socket:
+            self.serial.send(msg)
+        else:
+            self.serial.write(msg)
+        if self.capture is not None:
+            self.capture.tx(msg)
+        self.wait_answ = 1
+
+    def recv_ready(self):
+        """something to receive"""
+        return ([], [], []) != select.select([self.serial], [], [], 0.5)
+
+    def recv(self, size=254):
+        """receive wrapper"""
+        if self.use_socket:
+            data = self.serial.recv(size)
+        else:
+            data = self.serial.read()
+        if self.capture is not None and data:
+            self.capture.rx(data)
+        return data
+
+    def sendmsg(self, mod_func):
+        """Chiede all'oggetto mod_func, gia inizializzato,
+        il messaggio e lo invia.
+        mod_func puo' essere un prepared_request(rtu=True)"""
+        msg = rtu_frame(mod_func)
+        self.send(msg)
+        self.start_chat = time.time()
+        return msg
+
+    def recvansw(self, mod_func):
+        """Riceve i dati nella quantita massima prevista dall'oggetto MOD_FUNC
+        e risponde la risposta decodificata.
+        Frame delimited by mod_func.bytes_left, as modbus_tcp.recv:
+        also the answers without byte count (FC5, FC15, FC16, FC43)"""
+        if self.recv_ready():
+            self.rcv_buf += self.recv()
+            # expected (slave addr, func_num, byte count) in rcv_buf
+            if len(self.rcv_buf) < 3:
+                raise EAgain
+            self.wait_answ = 2
+            left = rtu_bytes_left(mod_func, self.rcv_buf)
+            if left > 0:
+                raise EAgain
+            frame = self.rcv_buf[:len(self.rcv_buf) + left]
+            self.send_count = 0
+            try:
+                answ = rtu_decode(mod_func, frame)
+            except EFrame:
+                # exception response o CRC errato: la transazione e' conclusa
+                self.wait_answ = 0
+                raise
+            self.wait_answ = 3
+            return answ
+        raise EAgain()
+
+    def chat(self, mod_func):
+        """Esegue la sequenza invio, risposta"""
+        if self.threadsafe:
+            if self.owner != threading.get_ident():
+                self.take_line()
+            self.last_poll = time.monotonic()
+        try:
+            if self.wait_answ == 3:
+                self.wait_answ = 0
+            if self.wait_answ == 0:
+                self.sendmsg(mod_func)
+                self.wait_answ = 1
+            answ = self.recvansw(mod_func)
+        except EAgain:
+            raise
+        except BaseException:
+            self.release()
+            raise
+        self.release()
+        return answ
+
+    def broadcast(self, mod_func, turnaround_delay=TURNAROUND_DELAY):
+        """Write mod_func (FC 5, 6, 15, 16) to every slave of the line
+        with one frame to address 0. No answer: the line is kept for
+        turnaround_delay seconds while the slaves execute it"""
+        msg = modbus_build_RTU_broadcast(mod_func)
+        if self.threadsafe and self.owner != threading.get_ident():
+            self.take_line()
+        try:
+            self.send(msg)
+            self.start_chat = time.time()
+            self.wait_answ = 0
+            time.sleep(turnaround_delay)
+        finally:
+            self.release()
+
+    def take_line(self):
+        """Wait for the transaction of another thread, take over the
+        line if that transaction has been abandoned"""
+        while not self.lock.acquire(timeout=0.1):
+            with self.owner_lock:
+                if (self.owner is not None
+                        and time.monotonic() - self.last_poll > self.abandon_timeout):
+                    self.owner = None
+                    self.lock.release()
+        with self.owner_lock:
+            self.owner = threading.get_ident()
+            self.last_poll = time.monotonic()
+        self.wait_answ = 0
+
+    def release(self):
+        """End of the transaction of the owner thread"""
+        with self.owner_lock:
+            if self.owner is not None and self.owner == threading.get_ident():
+                self.owner = None
+                self.lock.release()
+
+    def transact(self, mod_func):
+        """chat_blocking returning a modbus_response"""
+        return mod_func.result(self.chat_blocking(mod_func))
+
+    def chat_blocking(self, mod_func, timeout=1, retry_max=10):
+        """blocking sincronous chat"""
+        while True:
+            try:
+                return self.chat(mod_func)
+            except EAgain as exc:
+                if (time.time() - self.start_chat) > timeout:
+                    self.wait_answ = 1
+                    self.send_count += 1
+                    if self.send_count > retry_max:
+                        self.release()
+                        raise ETout('modbus_serial.chat_blocking timeout') from exc
@@ -0,0 +1,214 @@
+"""Live register image in shared memory.
+
+One collector process polls the devices and publishes the decoded values
+in a shared memory segment (multiprocessing.shared_memory, or a mmap file
+with path=); the local consumers (HMI, historian, alarms...) read the
+latest values from the segment without a connection of their own.
+
+Layout (native byte order, 8 byte aligned):
+    header   magic (8s), schema length (Q), schema json (padded)
+    for each device, in schema order:
+        seq        Q   even: stable, odd: write in progress
+        timestamp  d   time.time() of the values
+        values     d * number of registers of the device
+The schema is {"devices": [[device, [register names]], ...]}, from the
+profiles (schema_from_profile) or the register maps (schema_from_map).
+Values are stored as float; not numeric values (strings) as NaN.
+
+Every device has its own seqlock: one writer, readers without locks
+retry while the sequence is odd or changed during the copy
+"""
+
+import json
+import mmap
+import os
+import struct
+import time
+
+from mvmodbus2.functions import EFrame, ETout
+
+# pylint: disable=invalid-name
+
+MAGIC = b'MVMBIMG1'
+HEADER = struct.Struct('=8sQ')
+SLOT_HEADER = struct.Struct('=Qd')
+NAN = float('nan')
+
+
+def schema_from_profile(profile, groups=None):
+    """Register names of a device_profile in read plan order"""
+    return [profile.registers[ndx][0]
+            for block in profile.read_plan(groups) for ndx in block[2]]
+
+
+def schema_from_map(register_map):
+    """Register names of a register map (ime106.REGISTRI_MISURE106,
+    socomec_a40.REGISTRI_MISURE ...)"""
+    return [reg[2] for reg in register_map]
+
+
+def layout(devices):
+    """Schema json and {device: (slot offset, register names)}.
+    devices: {device: [register names]}"""
+    schema = json.dumps({'devices': [[dev, list(names)] for dev, names in devices.items()]},
+                        separators=(',', ':')).encode()
+    offset = HEADER.size + (len(schema) + 7) // 8 * 8
+    slots = {}
+    for dev, names in devices.items():
+        slots[dev] = (offset, list(names))
+        offset += SLOT_HEADER.size + 8 * len(names)
+    return schema, slots, offset
+
+
+def _open_segment(name, size=0, path=None):
+    """(buffer, close function, unlink function) of the segment.
+    size 0: attach to an existing segment"""
+    if path is not None:
+        fd = os.open(path, os.O_RDWR | (os.O_CREAT if size else 0), 0o644)
+        try:
+            if size:
+                os.ftruncate(fd, size)
+            buf = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        return buf, buf.close, lambda: os.unlink(path)
+    from multiprocessing import shared_memory  # pylint: disable=import-outside-toplevel
+    if size:
+        shm = shared_memory.SharedMemory(name, create=True, size=size)
+    else:
+        try:
+            shm = shared_memory.SharedMemory(name, track=False)
+        except TypeError:  # python < 3.13: the reader must not unlink the segment at exit
+            shm = shared_memory.SharedMemory(name)
+            from multiprocessing import resource_tracker  # pylint: disable=import-outside-toplevel
+            resource_tracker.unregister(shm._name, 'shared_memory')  # pylint: disable=protected-access
+    return shm.buf, shm.close, shm.unlink
+
+
+def _number(value):
+    """value as float, NaN if not numeric"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return NAN
+
+
+class image_writer:
+    """Publisher of the register image (one per segment).
+    devices: {device: [register names]}"""
+
+    def __init__(self, name, devices, path=None):
+        schema, self.slots, size = layout(devices)
+        self.buf, self._close, self._unlink = _open_segment(name, size, path)
+        self.buf[:size] = bytes(size)
+        HEADER.pack_into(self.buf, 0, MAGIC, len(schema))
+        self.buf[HEADER.size:HEADER.size + len(schema)] = schema
+        self.seq = dict.fromkeys(self.slots, 0)
+        self.packers = {
+            dev: struct.Struct(f'={len(names)}d') for dev, (dummy, names) in self.slots.items()
+        }
+
+    def publish(self, device, values, timestamp=None):
+        """Write the values ({register name: value}) of device;
+        registers missing in values are NaN"""
+        offset, names = self.slots[device]
+        row = [_number(values.get(name, NAN)) for name in names]
+        seq = self.seq[device] + 1
+        struct.pack_into('=Q', self.buf, offset, seq)
+        self.packers[device].pack_into(self.buf, offset + SLOT_HEADER.size, *row)
+        struct.pack_into('=d', self.buf, offset + 8,
+                         time.time() if timestamp is None else timestamp)
+        self.seq[device] = seq + 1
+        struct.pack_into('=Q', self.buf, offset, seq + 1)
+
+    def close(self, unlink=True):
+        """Detach, and remove the segment if unlink"""
+        self.buf = None
+        self._close()
+        if unlink:
+            self._unlink()
+
+
+class image_reader:
+    """Lock-free reader of the register image"""
+
+    def __init__(self, name, path=None, retries=1000):
+        self.buf, self._close, dummy_unlink = _open_segment(name, path=path)
+        if len(self.buf) < HEADER.size or bytes(self.buf[:len(MAGIC)]) != MAGIC:
+            magic = bytes(self.buf[:len(MAGIC)])
+            self.buf = None
+            self._close()
+            raise ValueError(f'Not a register image {magic!r}')
+        dummy_magic, schema_len = HEADER.unpack_from(self.buf, 0)
+        schema = json.loads(bytes(self.buf[HEADER.size:HEADER.size + schema_len]))
+        dummy, self.slots, dummy_size = layout(dict(schema['devices']))
+        self.retries = retries
+        self.views = {
+            dev: memoryview(self.buf)[offset + SLOT_HEADER.size:
+                                      offset + SLOT_HEADER.size + 8 * len(names)].cast('d')
+            for dev, (offset, names) in self.slots.items()
+        }
+
+    def devices(self):
+        """{device: [register names]}"""
+        return {dev: names for dev, (dummy, names) in self.slots.items()}
+
+    def view(self, device):
+        """Zero-copy view of the values of device (no consistency check)"""
+        return self.views[device]
+
+    def sequence(self, device):
+        """Sequence number: changes at every publish"""
+        return struct.unpack_from('=Q', self.buf, self.slots[device][0])[0]
+
+    def read_raw(self, device):
+        """(timestamp, values tuple) consistent snapshot of device"""
+        offset = self.slots[device][0]
+        view = self.views[device]
+        for dummy in range(self.retries):
+            seq, timestamp = SLOT_HEADER.unpack_from(self.buf, offset)
+            if seq & 1:
+                continue
+            values = tuple(view)
+            if struct.unpack_from('=Q', self.buf, offset)[0] == seq:
+                return timestamp, values
+        raise ETout(f'Register image of {device} busy')
+
+    def read(self, device):
+        """(timestamp, {register name: value}) of device"""
+        timestamp, values = self.read_raw(device)
+        return timestamp, dict(zip(self.slots[device][1], values))
+
+    def close(self):
+        """Detach from the segment"""
+        for view in self.views.values():
+            view.release()
+        self.views = {}
+        self.buf = None
+        self._close()
+
+
+def collect(writer, readers, period=1.0, cycles=None, on_error=None):
+    """Collector loop: every period call the read function of each device
+    and publish the values.
+    readers: {device: function() -> {register name: value}}
+    e.g. lambda: engine.read(slave) (scaling.scaling_engine)
+    A device that does not answer keeps its last values and timestamp;
+    on_error(device, exception) is called if given"""
+    cycle = 0
+    while cycles is None or cycle < cycles:
+        start = time.monotonic()
+        for device, read in readers.items():
+            try:
+                writer.publish(device, read())
+            except (EFrame, ETout, OSError) as exc:
+                if on_error is not None:
+                    on_error(device, exc)
+        cycle += 1
+        if cycles is None or cycle < cycles:
+            time.sleep(max(0, period - (time.monotonic() - start)))
+
+
+def is_stale(timestamp, max_age):
+    """True if values published at timestamp (0: never) are older than max_age seconds"""
+    return time.time() - timestamp > max_age
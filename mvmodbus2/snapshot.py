@@ -0,0 +1,176 @@
+"""Compact snapshot records of a register map.
+
+record_type(entries) generates a class with __slots__: one field for each
+register of the map (an identifier made from the description) plus
+timestamp. No dict per reading: the values are read by attribute
+(rec.frequency) or by integer index (rec[3]), the descriptions and the
+units are metadata of the class (names, units).
+to_dict() / to_json() build the description keyed dict only when asked.
+
+entries: [(name, address, count, decode)] as in mvmodbus2.stream;
+ime106.snapshot / socomec_a40.snapshot read the tables of the modules
+"""
+
+import json
+import keyword
+import re
+import time
+
+from mvmodbus2.control_loop import chat_blocking
+from mvmodbus2.profile import MAX_REGS, plan_blocks
+from mvmodbus2.stream import block_request
+
+# pylint: disable=invalid-name
+
+MAX_FIELD_LEN = 40
+RESERVED = {'timestamp', 'names', 'units', 'fields', 'entries', 'index', 'read',
+            'to_dict', 'to_json', 'from_mapping'}
+
+_table_types = {}  # record types of the register tables, see table_record_type
+
+
+def field_name(description, address=None, used=()):
+    """Identifier of a register: lowercase words of description joined by _,
+    at most MAX_FIELD_LEN characters, final + / - as pos / neg;
+    _address added if already used"""
+    description = re.sub(r'\s*\+\s*$', ' pos', description)
+    description = re.sub(r'\s+-\s*$', ' neg', description)
+    name = re.sub(r'[^0-9a-z]+', '_', description.lower()).strip('_') or 'reg'
+    if len(name) > MAX_FIELD_LEN:
+        name = name[:MAX_FIELD_LEN]
+        name = name[:name.rfind('_')] if '_' in name else name
+    if name[0].isdigit():
+        name = 'r_' + name
+    if keyword.iskeyword(name) or name in RESERVED:
+        name += '_'
+    if name in used:
+        name = f'{name}_{address}'
+    return name
+
+
+class snapshot_base:
+    """Base of the generated record types"""
+    __slots__ = ()
+    fields = ()
+    names = ()
+    units = ()
+    entries = ()
+    index = {}
+
+    def __init__(self, values=(), timestamp=None):
+        for field, value in zip(self.fields, values):
+            setattr(self, field, value)
+        for field in self.fields[len(values):]:
+            setattr(self, field, None)
+        self.timestamp = timestamp
+
+    def __getitem__(self, ndx):
+        if isinstance(ndx, str):
+            ndx = self.index[ndx]
+        return getattr(self, self.fields[ndx])
+
+    def __setitem__(self, ndx, value):
+        if isinstance(ndx, str):
+            ndx = self.index[ndx]
+        setattr(self, self.fields[ndx], value)
+
+    def __len__(self):
+        return len(self.fields)
+
+    def __iter__(self):
+        for field in self.fields:
+            yield getattr(self, field)
+
+    def __eq__(self, other):
+        return (type(self) is type(other) and self.timestamp == other.timestamp
+                and list(self) == list(other))
+
+    def __repr__(self):
+        values = ', '.join(f'{field}={getattr(self, field)!r}' for field in self.fields
+                           if getattr(self, field) is not None)
+        return f'{type(self).__name__}({values})'
+
+    def to_dict(self, key='name', skip_none=True):
+        """dict by description (key='name') or by field (key='field')"""
+        keys = self.names if key == 'name' else self.fields
+        return {
+            name: value
+            for name, value in zip(keys, self)
+            if value is not None or not skip_none
+        }
+
+    def to_json(self, key='name', **kwargs):
+        """JSON of to_dict with the timestamp"""
+        return json.dumps({'timestamp': self.timestamp, 'values': self.to_dict(key)}, **kwargs)
+
+    @classmethod
+    def from_mapping(cls, values, timestamp=None):
+        """Record of a description keyed dict (get_regs)"""
+        rec = cls(timestamp=timestamp)
+        for name, value in values.items():
+            rec[cls.index[name]] = value
+        return rec
+
+    @classmethod
+    def read(cls, slave, names=None, unit_identifier=None, function=3, max_regs=MAX_REGS,
+             max_gap=0):
+        """Read the registers (all, or the descriptions / fields in names)
+        one block at a time in a new record. Fields not read are None"""
+        if names is None:
+            indexes = range(len(cls.entries))
+        else:
+            indexes = [cls.index[name] for name in names]
+        chat = chat_blocking(slave)
+        fields = cls.fields
+        entries = cls.entries
+        rec = cls()
+        for block in plan_blocks(entries, indexes, max_regs, max_gap):
+            words = chat(block_request(block, function, unit_identifier))
+            for ndx in block[2]:
+                dummy_name, address, count, decode = entries[ndx]
+                first = address - block[0]
+                setattr(rec, fields[ndx], decode(words[first:first + count]))
+        rec.timestamp = time.time()
+        return rec
+
+
+def record_type(entries, typename='snapshot', units=None):
+    """Record class of entries. units: unit of each entry (metadata)"""
+    entries = tuple(entries)
+    fields = []
+    for name, address, dummy_count, dummy_decode in entries:
+        fields.append(field_name(name, address, fields))
+    fields = tuple(fields)
+    index = {field: ndx for ndx, field in enumerate(fields)}
+    index.update({entry[0]: ndx for ndx, entry in enumerate(entries)})
+    return type(typename, (snapshot_base,), {
+        '__slots__': fields + ('timestamp',),
+        'fields': fields,
+        'names': tuple(entry[0] for entry in entries),
+        'units': tuple(units) if units is not None else (None,) * len(entries),
+        'entries': entries,
+        'index': index,
+    })
+
+
+def table_record_type(table, entries, typename):
+    """Record class of a register table of a device module
+    [(address, type or count, description, unit, ...)], cached on the
+    content of the table. entries(table): stream entries of the table"""
+    key = (typename, tuple(tuple(reg[:4]) for reg in table))
+    record = _table_types.get(key)
+    if record is None:
+        record = _table_types[key] = record_type(
+            entries(table), typename, [reg[3] for reg in table])
+    return record
+
+
+def module_record_type(types, table, entries, typename):
+    """Record class of table, a register table of a device module (a
+    module constant: its id does not change), built at the first use and
+    kept in types (dict of the device module) by the id of the table:
+    no hashing of the rows at each snapshot"""
+    record = types.get(id(table))
+    if record is None:
+        record = types[id(table)] = table_record_type(table, entries, typename)
+    return record
@@ -3,12 +3,12 @@ https://www.socomec.co.uk/en-gb/reference/48250404
 https://www.socomec.co.uk/sites/default/files/2024-03/DIRIS-A-30---MULTI-FUNCTION-METERS_COMMUNICATION-TABLE_2018-01_CMT_EN_0.html
 """
 
-# TODO: porta tutto in unità di misura standard aziendali
-# come in ime106.py
+# Unità di misura standard aziendali come in ime106.py: vedi scaling()
 
 # pylint: disable=invalid-name
-from pprint import pprint
-from mvmodbus2 import modbus_tcp, modbusf3
+import mvmodbus2
+from mvmodbus2 import modbusf3, modbusf43, EFrame, ETout
+from mvmodbus2.decoders import U16, S16, U32, S32  # adattatori di tipo SOCOMEC
 
 def U8(val):
     """Adattatore di tipo SOCOMEC. Unsigned int."""
@@ -18,16 +18,6 @@ def STRING_16(val):
     """Adattatore di tipo SOCOMEC. Stringa in due word"""
     return STRING_NORM(val)
 
-def U16(val):
-    """Adattatore di tipo SOCOMEC. Unsigned int da word"""
-    return int(val[0])
-
-def S16(val):
-    """Adattatore di tipo SOCOMEC. Signed int da word"""
-    return int.from_bytes(
-        int.to_bytes(val[0], length=2, byteorder='big'),
-        byteorder='big', signed=True)
-
 def U16_HEX(val):
     """Adattatore di tipo SOCOMEC. Non si capisce. Str di valori hex ?"""
     return f'{val[0] // 256} {val[0] % 256}'
@@ -44,14 +34,6 @@ def value32(val, signed):
         int.to_bytes(val[1], length=2, byteorder='big'),
         byteorder='big', signed=signed)
 
-def U32(val):
-    """Adattatore di tipo SOCOMEC. Unsigned int."""
-    return value32(val, signed=False)
-
-def S32(val):
-    """Adattatore di tipo SOCOMEC. Signed int."""
-    return value32(val, signed=True)
-
 def STRING_NORM(val):
     """Adattatore di tipo SOCOMEC. Stringa"""
     return "".join(
@@ -388,6 +370,107 @@ def get_regs(slave, regs_list, REGISTRI=None):
     }
     return regs
 
+
+def stream_entries(REGISTRI=None, names=None):
+    """Voci di REGISTRI (default REGISTRI_MISURE_PRECISIONE) per mvmodbus2.stream"""
+    return [
+        (reg[2], reg[0], reg[1], reg[4])
+        for reg in (REGISTRI_MISURE_PRECISIONE if REGISTRI is None else REGISTRI)
+        if names is None or reg[2] in names
+    ]
+
+
+def iter_regs(slave, REGISTRI=None, names=None):
+    """Come get_regs, ma genera (denominazione, valore, timestamp)
+    man mano che arriva ciascun blocco di registri consecutivi"""
+    from mvmodbus2 import stream  # pylint: disable=import-outside-toplevel
+    return stream.iter_blocks(slave, stream_entries(REGISTRI, names), unit_identifier=255)
+
+
+def aiter_regs(slave, REGISTRI=None, names=None):
+    """iter_regs con un trasporto asyncio: async for name, value, ts in ..."""
+    from mvmodbus2 import stream  # pylint: disable=import-outside-toplevel
+    return stream.aiter_blocks(slave, stream_entries(REGISTRI, names), unit_identifier=255)
+
+
+_snapshot_types = {}  # id di una tabella del modulo: tipo di record, vedi snapshot_type
+
+
+def snapshot_type(REGISTRI=None):
+    """Tipo di record compatto (mvmodbus2.snapshot) di REGISTRI.
+    Per le tabelle del modulo costruito al primo uso e poi riusato"""
+    from mvmodbus2 import snapshot as mb_snapshot  # pylint: disable=import-outside-toplevel
+    REGISTRI = REGISTRI_MISURE_PRECISIONE if REGISTRI is None else REGISTRI
+    if any(REGISTRI is table for table in (
+            REGISTRI_PRODUCTID, REGISTRI_ORACORRENTE, REGISTRI_MISURE,
+            REGISTRI_MISURE_STATISTICA, REGISTRI_ENERGIE,
+            REGISTRI_METROLOGIA_BASSA_PRECISIONE, REGISTRI_MISURE_PRECISIONE)):
+        return mb_snapshot.module_record_type(
+            _snapshot_types, REGISTRI, stream_entries, 'socomec_a40_snapshot')
+    return mb_snapshot.table_record_type(REGISTRI, stream_entries, 'socomec_a40_snapshot')
+
+
+def snapshot(slave, names=None, REGISTRI=None):
+    """Come get_regs, ma in un record compatto: rec.active_energy_pos, rec.to_dict()"""
+    return snapshot_type(REGISTRI).read(slave, names, unit_identifier=255)
+
+
+def get_product_id_regs(slave):
+    """Identificazione da REGISTRI_PRODUCTID con una sola lettura
+    del blocco 50000-50065"""
+    start = REGISTRI_PRODUCTID[0][0]
+    count = REGISTRI_PRODUCTID[-1][0] + REGISTRI_PRODUCTID[-1][1] - start
+    block = slave.chat(modbusf3(start, count, unit_identifier=255))
+    return {
+        reg[2]: reg[4](block[reg[0] - start:reg[0] - start + reg[1]])
+        for reg in REGISTRI_PRODUCTID
+    }
+
+
+def get_product_id(slave, cache=None, refresh=False):
+    """Identificazione del prodotto con FC43/14 (regular),
+    oppure dai REGISTRI_PRODUCTID se lo slave non supporta FC43.
+    Il risultato e' conservato nella cache device_id, anche il mancato
+    supporto di FC43 (ILLEGAL FUNCTION): non viene richiesto di nuovo.
+    Un timeout non e' memorizzato (puo' essere transitorio): la connessione
+    viene riaperta, una risposta tardiva non si confonde con la lettura
+    dei registri"""
+    if cache is None:
+        cache = mvmodbus2.device_id.device_id_cache()
+    key = mvmodbus2.device_id.endpoint_key(slave, 255)
+    if refresh or not cache.get(key, 'NO_FC43'):
+        try:
+            return mvmodbus2.device_id.get_device_id(
+                slave, modbusf43.REGULAR, unit_identifier=255,
+                cache=cache, refresh=refresh)
+        except EFrame as exc:
+            if exc.exception_code == 1:  # ILLEGAL FUNCTION
+                cache.put(key, 'NO_FC43', True)
+        except (ETout, OSError):
+            if hasattr(slave, 'reconnect'):
+                slave.reconnect()
+    product_id = None if refresh else cache.get(key, 'REGISTRI_PRODUCTID')
+    if product_id is None:
+        product_id = get_product_id_regs(slave)
+        cache.put(key, 'REGISTRI_PRODUCTID', product_id)
+    return product_id
+
+
+def scaling(normalise=True):
+    """scaling_engine: valori nelle unita' di misura standard aziendali
+    (mV, mA, W, kWh, ...) dalla colonna Unit delle tabelle"""
+    from mvmodbus2 import profile as device_profile  # pylint: disable=import-outside-toplevel
+    from mvmodbus2 import scaling as device_scaling  # pylint: disable=import-outside-toplevel
+    return device_scaling.scaling_engine(
+        device_profile.load_profile('socomec_a40'), normalise=normalise)
+
+
+def get_misure(slave, group='REGISTRI_MISURE_PRECISIONE', names=None, engine=None):
+    """Misure di group in unita' standard aziendali, lette a blocchi"""
+    engine = engine or scaling()
+    return engine.read(slave, [group], names)
+
+
 def get_energia_consumata(slave):
     """Get energia regs from slave_addr"""
     regs = get_regs(slave, [
@@ -403,9 +486,196 @@ def get_energia_prodotta(slave):
     return regs['Active Energy -']
 
 
+def table_name(REGISTRI):
+    """Nome della tabella REGISTRI (gruppo del profilo socomec_a40)"""
+    for name, value in globals().items():
+        if value is REGISTRI and name.startswith('REGISTRI_'):
+            return name
+    raise KeyError('Tabella non del modulo socomec_a40')
+
+
+async def async_get_regs(slave, regs_list, REGISTRI=None):
+    """get_regs con un trasporto asyncio (aio.py): letture a blocchi
+    (profilo socomec_a40) inviate insieme"""
+    from mvmodbus2 import aio  # pylint: disable=import-outside-toplevel
+    from mvmodbus2 import profile as device_profile  # pylint: disable=import-outside-toplevel
+    profile = device_profile.load_profile('socomec_a40')
+    group = table_name(REGISTRI_MISURE_PRECISIONE if REGISTRI is None else REGISTRI)
+    plan = profile.read_plan([group], regs_list)
+    regs = {}
+    for block, words in zip(plan, await aio.read_blocks(slave, profile, plan, 255)):
+        regs.update(profile.decode_block(block, words))
+    return regs
+
+
+async def async_get_misure(slave, group='REGISTRI_MISURE_PRECISIONE', names=None, engine=None):
+    """get_misure con un trasporto asyncio"""
+    return await (await async_meter(slave, engine)).snapshot([group], names)
+
+
+async def async_get_energia_consumata(slave):
+    """get_energia_consumata con un trasporto asyncio"""
+    return (await async_get_regs(slave, ['Active Energy +']))['Active Energy +']
+
+
+async def async_get_energia_prodotta(slave):
+    """get_energia_prodotta con un trasporto asyncio"""
+    return (await async_get_regs(slave, ['Active Energy -']))['Active Energy -']
+
+
+def meter(slave, engine=None, normalise=True):
+    """Strumento: meter(slave).snapshot(['REGISTRI_ENERGIE'])"""
+    from mvmodbus2 import scaling as device_scaling  # pylint: disable=import-outside-toplevel
+    return device_scaling.meter(slave, engine or scaling(normalise), unit_identifier=255)
+
+
+async def async_meter(slave, engine=None, normalise=True):
+    """meter per asyncio: await (await async_meter(slave)).snapshot(['REGISTRI_ENERGIE'])"""
+    from mvmodbus2 import aio  # pylint: disable=import-outside-toplevel
+    return aio.async_meter(slave, engine or scaling(normalise), unit_identifier=255)
+
+
+def clock_values(when=None):
+    """Valori di REGISTRI_ORACORRENTE (da 57600: giorno, mese, anno,
+    ora, minuti, secondi) per when (datetime, default ora locale)"""
+    import datetime  # pylint: disable=import-outside-toplevel
+    when = when or datetime.datetime.now()
+    return [when.day, when.month, when.year, when.hour, when.minute, when.second]
+
+
+def set_clock(targets, when=None, broadcast=False):
+    """Imposta l'ora su tutti i targets (trasporto, unit), scritture in
+    parallelo. broadcast=True: un solo frame broadcast per linea seriale,
+    non confermato ed eseguito anche dagli slave non in targets.
+    Ritorna fleet.fleet_result"""
+    from mvmodbus2 import fleet  # pylint: disable=import-outside-toplevel
+    start = min(reg[0] for reg in REGISTRI_ORACORRENTE)
+    return fleet.write_registers(targets, start, clock_values(when), broadcast)
+
+# Fedelta' adattiva: REGISTRI_MISURE (32 bit) e REGISTRI_METROLOGIA_BASSA_PRECISIONE
+# (16 bit, meta' dei byte) misurano le stesse grandezze nello stesso ordine
+FIDELITY_PRECISE = 'precise'
+FIDELITY_COMPACT = 'compact'
+
+
+def fidelity_tables():
+    """{fidelity: stream entries} delle due tabelle: nomi di REGISTRI_MISURE,
+    valori gia' in unita' standard aziendali. Anche 'units': {nome: unita'}"""
+    tables = globals().get('_fidelity_tables')
+    if tables is None:
+        from mvmodbus2.scaling import company_unit  # pylint: disable=import-outside-toplevel
+        tables = {FIDELITY_PRECISE: [], FIDELITY_COMPACT: [], 'units': {}}
+        for precise, compact in zip(REGISTRI_MISURE, REGISTRI_METROLOGIA_BASSA_PRECISIONE):
+            for fidelity, reg in ((FIDELITY_PRECISE, precise), (FIDELITY_COMPACT, compact)):
+                unit, factor = company_unit(reg[3])
+                tables[fidelity].append((
+                    precise[2], reg[0], reg[1],
+                    lambda words, convert=reg[4], factor=factor: convert(words) * factor))
+            tables['units'][precise[2]] = company_unit(precise[3])[0]
+        globals()['_fidelity_tables'] = tables
+    return tables
+
+
+class fidelity_policy:
+    """Scelta della tabella in base al collegamento.
+    compact se la latenza media supera slow_latency, se c'e' un timeout
+    o se il carico del collegamento (load, es. utilizzo da
+    planner.plan_line) supera saturation.
+    Si torna a precise dopo hold letture con latenza e carico sotto
+    recover volte le soglie (isteresi)"""
+
+    def __init__(self, fidelity=FIDELITY_PRECISE, slow_latency=0.25, saturation=0.7,
+                 recover=0.5, hold=3):
+        self.fidelity = fidelity
+        self.slow_latency = slow_latency
+        self.saturation = saturation
+        self.recover = recover
+        self.hold = hold
+        self.srtt = None
+        self.load = 0.0
+        self.good = 0
+
+    def observe(self, latency, exc=None):
+        """Esito di una transazione (latency in s, exc eccezione o None)"""
+        if exc is not None:
+            if isinstance(exc, (ETout, OSError)):
+                self.srtt = max(self.srtt or 0, 2 * self.slow_latency)
+            return
+        self.srtt = latency if self.srtt is None else 0.75 * self.srtt + 0.25 * latency
+
+    def set_load(self, load):
+        """Carico del collegamento 0..1"""
+        self.load = load
+
+    def decide(self):
+        """Fedelta' della prossima lettura"""
+        srtt = self.srtt or 0
+        if self.fidelity == FIDELITY_PRECISE:
+            if srtt > self.slow_latency or self.load > self.saturation:
+                self.fidelity = FIDELITY_COMPACT
+                self.good = 0
+        elif (srtt < self.slow_latency * self.recover
+              and self.load < self.saturation * self.recover):
+            self.good += 1
+            if self.good >= self.hold:
+                self.fidelity = FIDELITY_PRECISE
+        else:
+            self.good = 0
+        return self.fidelity
+
+
+class adaptive_meter:
+    """Misure di REGISTRI_MISURE con la fedelta' scelta da policy.
+    Valori e unita' (units) uguali con entrambe le tabelle, cambia solo
+    la risoluzione. Trasporti RTU (linea seriale): si parte dalla tabella compatta"""
+
+    def __init__(self, slave, policy=None, names=None, unit_identifier=255):
+        from mvmodbus2.control_loop import chat_blocking  # pylint: disable=import-outside-toplevel
+        if policy is None:
+            policy = fidelity_policy(FIDELITY_COMPACT if getattr(slave, 'RTU', False)
+                                     else FIDELITY_PRECISE)
+        self.slave = slave
+        self.chat = chat_blocking(slave)
+        self.policy = policy
+        self.unit_identifier = unit_identifier
+        tables = fidelity_tables()
+        all_names = [entry[0] for entry in tables[FIDELITY_PRECISE]]
+        indexes = range(len(all_names)) if names is None else [
+            all_names.index(name) for name in names]
+        from mvmodbus2.profile import MAX_REGS, plan_blocks  # pylint: disable=import-outside-toplevel
+        self.plans = {
+            fidelity: (tables[fidelity], plan_blocks(tables[fidelity], indexes, MAX_REGS, 0))
+            for fidelity in (FIDELITY_PRECISE, FIDELITY_COMPACT)
+        }
+        self.units = {all_names[ndx]: tables['units'][all_names[ndx]] for ndx in indexes}
+        self.fidelity = None
+        self.timestamp = None
+
+    def read(self):
+        """{nome: valore in unita' standard aziendali}"""
+        import time  # pylint: disable=import-outside-toplevel
+        from mvmodbus2.stream import block_request, decode_entries  # pylint: disable=import-outside-toplevel
+        self.fidelity = self.policy.decide()
+        entries, blocks = self.plans[self.fidelity]
+        values = {}
+        for block in blocks:
+            start = time.monotonic()
+            try:
+                words = self.chat(block_request(block, 3, self.unit_identifier))
+            except (ETout, OSError) as exc:
+                self.policy.observe(time.monotonic() - start, exc)
+                raise
+            self.policy.observe(time.monotonic() - start)
+            values.update((name, value) for name, value, dummy_ts in decode_entries(
+                entries, block, words, None))
+        self.timestamp = time.time()
+        return values
+
+
 def studio():
     """"Funzione per prove e studio."""
-    slave = modbus_tcp("pwrmu.loc.ghiaia.net")
+    from pprint import pprint  # pylint: disable=import-outside-toplevel
+    slave = mvmodbus2.modbus_tcp("pwrmu.loc.ghiaia.net")
     misure = get_regs(slave, [reg[2] for reg in REGISTRI_MISURE], REGISTRI_MISURE)
     pprint(misure)
 
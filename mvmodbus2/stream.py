@@ -0,0 +1,74 @@
+"""Streaming reads of register maps.
+
+iter_blocks / aiter_blocks read a register map one coalesced block at a
+time and yield (name, value, timestamp) as soon as each block arrives:
+the caller processes the first values while the next blocks are read,
+and the values are never collected in a whole result.
+The async version reads the next block while the caller consumes the
+current one.
+
+entries: [(name, address, count, decode)], decode(words) -> value;
+the device modules build them from their tables
+(ime106.iter_regs, socomec_a40.iter_regs)
+"""
+
+import time
+
+from mvmodbus2.control_loop import chat_blocking
+from mvmodbus2.functions import modbusf3, modbusf4
+from mvmodbus2.profile import MAX_REGS, plan_blocks
+
+# pylint: disable=invalid-name
+
+
+def entry_blocks(entries, max_regs=MAX_REGS, max_gap=0):
+    """Read plan of the entries: [(start, count, (entry indexes))]"""
+    return plan_blocks(entries, range(len(entries)), max_regs, max_gap)
+
+
+def block_request(block, function=3, unit_identifier=None):
+    """FC3 (or FC4) request of block"""
+    mod_func = modbusf4 if function == 4 else modbusf3
+    return mod_func(block[0], block[1], unit_identifier=unit_identifier)
+
+
+def decode_entries(entries, block, words, timestamp):
+    """(name, value, timestamp) of the entries of block"""
+    for ndx in block[2]:
+        name, address, count, decode = entries[ndx]
+        first = address - block[0]
+        yield name, decode(words[first:first + count]), timestamp
+
+
+def iter_blocks(slave, entries, unit_identifier=None, function=3, max_regs=MAX_REGS,
+                max_gap=0):
+    """Generator of (name, value, timestamp), one block read at a time"""
+    chat = chat_blocking(slave)
+    for block in entry_blocks(entries, max_regs, max_gap):
+        words = chat(block_request(block, function, unit_identifier))
+        yield from decode_entries(entries, block, words, time.time())
+
+
+async def aiter_blocks(slave, entries, unit_identifier=None, function=3, max_regs=MAX_REGS,
+                       max_gap=0):
+    """Async generator of (name, value, timestamp) for the asyncio
+    transports (aio.py); the next block is read while the caller
+    consumes the current one"""
+    import asyncio  # pylint: disable=import-outside-toplevel
+    blocks = entry_blocks(entries, max_regs, max_gap)
+    if not blocks:
+        return
+    pending = asyncio.ensure_future(
+        slave.chat(block_request(blocks[0], function, unit_identifier)))
+    try:
+        for ndx, block in enumerate(blocks):
+            words = await pending
+            timestamp = time.time()
+            if ndx + 1 < len(blocks):
+                pending = asyncio.ensure_future(
+                    slave.chat(block_request(blocks[ndx + 1], function, unit_identifier)))
+            for record in decode_entries(entries, block, words, timestamp):
+                yield record
+    finally:
+        if not pending.done():
+            pending.cancel()
@@ -0,0 +1,479 @@
+"""Modbus TCP and UDP transports as per
+Modbus_Messaging_Implementation_Guide_V1_0b.pdf"""
+
+import select
+import socket
+import struct
+import threading
+
+from mvmodbus2.endpoints import DEFAULT_OPTIONS, default_resolver
+from mvmodbus2.functions import EFrame, ETout, MBAP_LEN, modbusf3, modbusf4
+
+# pylint: disable=invalid-name
+
+
+def crc16(msg):
+    """Calcola il CRC16. Algoritmo di MODBUS.org
+    per modbus su seriale"""
+    register = 0xffff
+    for c in msg:
+        register = register ^ c
+        for dummy_i in range(0, 8):
+            flag = register & 1
+            register >>= 1
+            if flag:
+                register = register ^ 0xA001
+    return struct.pack('<H', register)
+
+
+def modbus_build_TCP_message(mod_func):
+    """Get from the initialized mod_func object the message and build the MBAP header"""
+    pdu = mod_func.pdu()
+    transaction_identifier = mod_func.transaction_identifier
+    protocol_identifier = 0
+    unit_identifier = mod_func.unit_identifier
+    length = len(pdu) + 1 # 1: length of unit identifier
+
+    mbap = struct.pack(
+        '> H H H B', transaction_identifier, protocol_identifier,
+            length,
+            unit_identifier
+        )
+    return mbap + pdu
+
+
+def modbus_build_RTU_message(mod_func):
+    """Get from the initialized mod_func object the message and build the RTU frame"""
+    pdu = mod_func.pdu()
+    msg = struct.pack(
+        f'> B {len(pdu)}s',
+        mod_func.unit_identifier,
+        pdu)
+    crc = crc16(msg)
+    return msg + crc
+
+
+
+BROADCAST_ADDRESS = 0  # Modbus_over_serial_line_V1_02.pdf 2.2: all the slaves, no reply
+BROADCAST_FUNCTIONS = (5, 6, 15, 16)  # write functions only
+# 2.4.1: after a broadcast the master waits the turnaround delay
+# (100..200 ms) before the next request
+TURNAROUND_DELAY = 0.1
+
+
+def modbus_build_RTU_broadcast(mod_func):
+    """RTU frame of mod_func to the broadcast address.
+    modbus_func maps unit_identifier 0 to 1: the address is set here"""
+    if mod_func.MOD_FUNC not in BROADCAST_FUNCTIONS:
+        raise ValueError(f'function {mod_func.MOD_FUNC} cannot be broadcast')
+    pdu = mod_func.pdu()
+    msg = struct.pack(f'> B {len(pdu)}s', BROADCAST_ADDRESS, pdu)
+    return msg + crc16(msg)
+
+
+class prepared_request(object):
+    """Request encoded once and reused at every poll cycle.
+    adu: frozen ADU, MBAP header (TCP/UDP) or unit + CRC (RTU).
+    On TCP/UDP only the transaction identifier is patched at send.
+    Exposes the parsing interface of the wrapped modbus_func"""
+    __slots__ = ('mod_func', 'adu', 'rtu')
+
+    def __init__(self, mod_func, rtu=False):
+        object.__setattr__(self, 'mod_func', mod_func)
+        object.__setattr__(self, 'rtu', rtu)
+        object.__setattr__(
+            self, 'adu',
+            modbus_build_RTU_message(mod_func) if rtu else modbus_build_TCP_message(mod_func))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('prepared_request is immutable')
+
+    def frame(self, transaction_identifier=None):
+        """ADU with transaction_identifier (TCP/UDP)"""
+        if transaction_identifier is None or self.rtu:
+            return self.adu
+        return struct.pack('> H', transaction_identifier) + self.adu[2:]
+
+    @property
+    def MOD_FUNC(self):
+        """Function code"""
+        return self.mod_func.MOD_FUNC
+
+    @property
+    def ANSW_LEN(self):
+        """Max answer length"""
+        return self.mod_func.ANSW_LEN
+
+    @property
+    def unit_identifier(self):
+        """Unit identifier"""
+        return self.mod_func.unit_identifier
+
+    @property
+    def bus_err(self):
+        """Function code of the last answer of this thread"""
+        return self.mod_func.bus_err
+
+    @property
+    def bytecount(self):
+        """Byte count (or exception code) of the last answer of this thread"""
+        return self.mod_func.bytecount
+
+    def pdu(self):
+        """Request PDU"""
+        return self.mod_func.pdu()
+
+    def chkansw(self, response):
+        """see modbus_func.chkansw"""
+        return self.mod_func.chkansw(response)
+
+    def bytes_left(self, bytestring):
+        """see modbus_func.bytes_left"""
+        return self.mod_func.bytes_left(bytestring)
+
+    def answ(self, s):
+        """see modbus_func.answ"""
+        return self.mod_func.answ(s)
+
+    def result(self, value):
+        """see modbus_func.result"""
+        return self.mod_func.result(value)
+
+
+def prepare(requests, rtu=False):
+    """prepared_request of each request"""
+    return [prepared_request(mod_func, rtu) for mod_func in requests]
+
+
+def tcp_frame(transport, mod_func):
+    """ADU of mod_func for a TCP/UDP transport.
+    A prepared_request gets the next transaction identifier of transport.
+    ValueError for a prepared_request with RTU framing"""
+    if isinstance(mod_func, prepared_request):
+        if mod_func.rtu:
+            raise ValueError('prepared_request(rtu=True) on a TCP/UDP transport')
+        transport.transaction_identifier = (transport.transaction_identifier + 1) & 0xFFFF
+        return mod_func.frame(transport.transaction_identifier)
+    return modbus_build_TCP_message(mod_func)
+
+
+def init_lock(transport, threadsafe):
+    """Lock of the transactions of transport.
+    Without threadsafe the lock-free chat_unlocked takes the place of chat"""
+    transport.lock = threading.Lock()
+    if not threadsafe:
+        transport.chat = transport.chat_unlocked
+
+
+def tcp_connect(clie_addr, timeout, options=DEFAULT_OPTIONS):
+    """Socket connesso a clie_addr (host, port): prova in ordine ciascun
+    indirizzo risolto da default_resolver (IPv6 e IPv4), come
+    socket.create_connection, e applica options"""
+    error = None
+    for family, sockaddr in default_resolver.resolve(*clie_addr):
+        sock = None
+        try:
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            sock.settimeout(timeout)
+            sock.connect(sockaddr)
+            options.apply(sock)
+        except OSError as exc:
+            if sock is not None:
+                sock.close()
+            error = exc
+            continue
+        return sock
+    raise error
+
+
+class modbus_udp:
+    """UDP connection to server (slave)
+    The implementation assumes that the slave (server)
+    sends the response in a single packet.
+    This is the WAGO PLC behaviour in a LAN
+
+    threadsafe: chat can be called by many threads, a lock
+    serializes the transactions. threadsafe=False for a connection
+    used by a single thread: chat without lock
+
+    capture: capture hook (see capture.py), None: no capture
+    RTU: False, MBAP framing (True on the RTU transports)
+
+    The host name is resolved through endpoints.default_resolver
+    (cached for its ttl), not at every sendto. It is resolved again
+    after a timeout (reconnect); a name not resolved when the object is
+    built is tried again at the first send
+    """
+    capture = None
+    RTU = False
+
+    def __init__(self, clie_addr, port=502, timeout=4, threadsafe=True):
+        self.timeout = timeout
+        self.clie_addr = (clie_addr, port)
+        self.sock = None
+        self.transaction_identifier = 0
+        init_lock(self, threadsafe)
+        try:
+            self.connect()
+        except socket.gaierror:
+            pass  # nuovo tentativo al primo invio
+
+    def connect(self):
+        """Socket of the address family of clie_addr"""
+        family = default_resolver.address(*self.clie_addr, socket.SOCK_DGRAM)[0]
+        if self.sock is not None:
+            self.sock.close()
+        self.sock = socket.socket(family, socket.SOCK_DGRAM)
+        self.sock.settimeout(self.timeout)
+
+    def reconnect(self):
+        """After a timeout: the name is resolved again (DNS change) and
+        a new socket takes the place of the old one (late answers)"""
+        default_resolver.invalidate(self.clie_addr[0])
+        self.connect()
+
+    def send(self, mod_func):
+        """Chiede all'oggetto mod_func, gia inizializzato,
+        il messaggio e lo invia.
+        mod_func puo' essere un prepared_request"""
+        if self.sock is None:
+            self.connect()
+        msg = tcp_frame(self, mod_func)
+        self.sock.sendto(msg, default_resolver.address(*self.clie_addr, socket.SOCK_DGRAM)[1])
+        if self.capture is not None:
+            self.capture.tx(msg)
+
+    def recv(self, mod_func):
+        """Riceve i dati nella quantita massima prevista dall'oggetto MOD_FUNC
+        e risponde la risposta decodificata.
+
+        UDP risponde in un unico frame. Tutto o niente.
+        ANSW_LEN is the PDU: the datagram has also the MBAP header.
+        socket.timeout if no answer (after reconnect)
+        """
+        try:
+            data = self.sock.recv(mod_func.ANSW_LEN + MBAP_LEN)
+        except socket.timeout:
+            self.reconnect()
+            raise
+        if self.capture is not None:
+            self.capture.rx(data)
+        return mod_func.answ(data[7:])
+
+    def recv_adu(self):
+        """Riceve un datagramma (MBAP + PDU). socket.timeout se non arriva"""
+        if ([], [], []) == select.select([self.sock], [], [], self.timeout):
+            raise socket.timeout
+        data = self.sock.recv(MBAP_LEN + 253)
+        if self.capture is not None:
+            self.capture.rx(data)
+        return data
+
+    def chat(self, mod_func):
+        """Esegue la sequenza invio, risposta"""
+        with self.lock:
+            self.send(mod_func)
+            return self.recv(mod_func)
+
+    def chat_unlocked(self, mod_func):
+        """chat for a single thread"""
+        self.send(mod_func)
+        return self.recv(mod_func)
+
+    def transact(self, mod_func):
+        """chat returning a modbus_response"""
+        return mod_func.result(self.chat(mod_func))
+
+    def pipeline(self, requests, window=4):
+        """Send up to window requests before reading the answers.
+        The answers are matched by transaction identifier (UDP can reorder).
+        Return the answers in the order of requests; an exception
+        response takes the place of the answer as EFrame.
+        On timeout the name is resolved again (reconnect) and ETout raised"""
+        with self.lock:
+            return self.pipeline_unlocked(requests, window)
+
+    def pipeline_unlocked(self, requests, window=4):
+        """pipeline for a single thread"""
+        requests = [
+            req if isinstance(req, prepared_request) else prepared_request(req)
+            for req in requests
+        ]
+        answers = [None] * len(requests)
+        waiting = {}
+        sent = done = 0
+        while done < len(requests):
+            while sent < len(requests) and len(waiting) < window:
+                self.send(requests[sent])
+                waiting[self.transaction_identifier] = sent
+                sent += 1
+            try:
+                data = self.sock.recv(MBAP_LEN + max(
+                    requests[ndx].ANSW_LEN for ndx in waiting.values()))
+            except socket.timeout as exc:
+                self.reconnect()
+                raise ETout(f'pipeline: {len(waiting)} answers missing') from exc
+            if self.capture is not None:
+                self.capture.rx(data)
+            ndx = waiting.pop(struct.unpack('> H', data[:2])[0], None)
+            if ndx is None:
+                continue  # risposta tardiva di una richiesta precedente
+            try:
+                answers[ndx] = requests[ndx].answ(data[MBAP_LEN:])
+            except EFrame as exc:
+                answers[ndx] = exc
+            done += 1
+        return answers
+
+
+class modbus_tcp:
+    """TCP connection to slave.
+    L'implementazione prevede il caso che lo slave (server)
+    invii la risposta frazionata in più pacchetti.
+    Il metodo chat dunque non è bloccante
+
+    threadsafe, capture: see modbus_udp
+    sock: socket already connected (endpoints.connect_all)
+    options: endpoints.socket_options, DEFAULT_OPTIONS if None
+    """
+    capture = None
+    RTU = False
+
+    def __init__(self, clie_addr, port=502, timeout=4, threadsafe=True, sock=None, options=None):
+        """Assume i dati di collegamento e crea il socket TCP"""
+        self.clie_addr = (clie_addr, port)
+        self.timeout = timeout
+        self.options = options or DEFAULT_OPTIONS
+        self.sock = sock
+        if sock is None:
+            self.connect()
+        else:
+            self.sock.settimeout(timeout)
+            self.options.apply(self.sock)
+        self.transaction_identifier = 0
+        init_lock(self, threadsafe)
+
+    def connect(self):
+        """Apre la connessione a clie_addr, vedi tcp_connect"""
+        self.sock = tcp_connect(self.clie_addr, self.timeout, self.options)
+
+    def reconnect(self):
+        """Nuova connessione al posto di una con risposte ancora in arrivo
+        (timeout): le risposte tardive non si confondono con le successive"""
+        self.sock.close()
+        self.connect()
+
+    def send(self, mod_func):
+        """Chiede all'oggetto mod_func,
+        gia inizializzato, il messaggio e lo invia.
+        mod_func puo' essere un prepared_request"""
+        msg = tcp_frame(self, mod_func)
+        self.sock.send(msg)
+        if self.capture is not None:
+            self.capture.tx(msg)
+
+    def recv(self, mod_func):
+        """Riceve i dati nella quantita massima prevista dall'oggetto MOD_FUNC
+        e risponde la risposta decodificata"""
+        rcv_buf = b''
+        next_read_len = mod_func.bytes_left(rcv_buf[7:]) + 7
+        for _tentativi in range(0, 255): # tenta di soddisfare la richiesta.
+            if ([], [], []) == select.select([self.sock], [], [], self.timeout):
+                raise socket.timeout
+            data = self.sock.recv(next_read_len)
+            if self.capture is not None:
+                self.capture.rx(data)
+            rcv_buf += data
+            next_read_len = mod_func.bytes_left(rcv_buf[7:])
+            if next_read_len == 0:
+                try:
+                    return mod_func.answ(rcv_buf[7:])
+                except struct.error:
+                    pass
+        raise ETout(repr(rcv_buf)) # dopo letture (senza timeout) ancora mancano dati.
+
+    def chat(self, mod_func):
+        """Esegue la sequenza invio, risposta"""
+        with self.lock:
+            self.send(mod_func)
+            return self.recv(mod_func)
+
+    def chat_unlocked(self, mod_func):
+        """chat for a single thread"""
+        self.send(mod_func)
+        return self.recv(mod_func)
+
+    def transact(self, mod_func):
+        """chat returning a modbus_response"""
+        return mod_func.result(self.chat(mod_func))
+
+    def recv_adu(self):
+        """Riceve un frame intero (MBAP + PDU), delimitato dal campo
+        length dell'MBAP. socket.timeout se non arriva niente,
+        ETout se il frame resta incompleto (connessione da riaprire)"""
+        rcv_buf = b''
+        size = MBAP_LEN
+        while len(rcv_buf) < size:
+            if ([], [], []) == select.select([self.sock], [], [], self.timeout):
+                if rcv_buf:
+                    raise ETout(f'incomplete frame: {rcv_buf!r}')
+                raise socket.timeout
+            data = self.sock.recv(size - len(rcv_buf))
+            if not data:
+                raise ETout(f'connection closed: {rcv_buf!r}')
+            if self.capture is not None:
+                self.capture.rx(data)
+            rcv_buf += data
+            if len(rcv_buf) >= MBAP_LEN:
+                size = MBAP_LEN - 1 + struct.unpack('> H', rcv_buf[4:6])[0]
+        return rcv_buf
+
+    def pipeline(self, requests, window=4):
+        """Send up to window requests before reading the answers.
+        The answers are matched by transaction identifier.
+        Return the answers in the order of requests; an exception
+        response takes the place of the answer as EFrame.
+        On timeout the connection is opened again (reconnect) and ETout raised"""
+        with self.lock:
+            return self.pipeline_unlocked(requests, window)
+
+    def pipeline_unlocked(self, requests, window=4):
+        """pipeline for a single thread"""
+        requests = [
+            req if isinstance(req, prepared_request) else prepared_request(req)
+            for req in requests
+        ]
+        answers = [None] * len(requests)
+        waiting = {}
+        sent = done = 0
+        while done < len(requests):
+            while sent < len(requests) and len(waiting) < window:
+                self.send(requests[sent])
+                waiting[self.transaction_identifier] = sent
+                sent += 1
+            try:
+                data = self.recv_adu()
+            except (socket.timeout, ETout) as exc:
+                self.reconnect()
+                raise ETout(f'pipeline: {len(waiting)} answers missing') from exc
+            ndx = waiting.pop(struct.unpack('> H', data[:2])[0], None)
+            if ndx is None:
+                continue  # risposta di una richiesta precedente
+            try:
+                answers[ndx] = requests[ndx].answ(data[MBAP_LEN:])
+            except EFrame as exc:
+                answers[ndx] = exc
+            done += 1
+        return answers
+
+
+def prova():
+    """Prova e test di funzionamento"""
+    srv = modbus_tcp('10.36.20.25', port=26, timeout=2)
+    msg = modbusf3(3022, 4, unit_identifier=11, transaction_identifier=0)
+    recv = srv.chat(msg)
+    print(recv)
+    srv = modbus_udp('plcdev2.mrc.loc.ghiaia.net', timeout=2)
+    msg = modbusf4(0, 10, unit_identifier=11, transaction_identifier=0)
+    recv = srv.chat(msg)
+    print(recv)
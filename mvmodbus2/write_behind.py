@@ -0,0 +1,165 @@
+"""Write-behind buffer of a device.
+
+Single register and coil writes are collected and sent later:
+    contiguous registers are merged in one FC16 request
+    contiguous coils are merged in one FC15 request
+    a new value for an address with a pending write replaces it
+The pending writes are sent delay seconds after the first one, or at
+flush(). Each write returns a concurrent.futures.Future, done when its
+value (or the value that replaced it) has been written
+"""
+
+import threading
+from concurrent.futures import Future
+
+from mvmodbus2.control_loop import chat_blocking
+from mvmodbus2.functions import EFrame, ETout, modbusf15, modbusf16
+
+# pylint: disable=invalid-name
+
+# Modbus_Application_Protocol_V1_1b3.pdf: quantity of registers / outputs
+MAX_WRITE_REGS = 123
+MAX_WRITE_COILS = 1968
+
+
+def contiguous_runs(values, max_len):
+    """Runs of consecutive addresses of values ({address: value}).
+    Return [(start, [values])] of at most max_len values"""
+    runs = []
+    for address in sorted(values):
+        if runs and runs[-1][0] + len(runs[-1][1]) == address and len(runs[-1][1]) < max_len:
+            runs[-1][1].append(values[address])
+        else:
+            runs.append((address, [values[address]]))
+    return runs
+
+
+def check_registers(regs_data):
+    """regs_data as list, ValueError if a value does not fit in a register"""
+    regs_data = list(regs_data)
+    for value in regs_data:
+        if not 0 <= value <= 0xFFFF:
+            raise ValueError(f'register value {value} out of range 0..0xFFFF')
+    return regs_data
+
+
+class _pending:
+    """Pending writes of one kind (registers or coils)"""
+
+    def __init__(self):
+        self.values = {}
+        self.futures = {}  # address -> [futures]
+
+    def add(self, start, values, future):
+        """Queue values from start"""
+        for offset, value in enumerate(values):
+            self.values[start + offset] = value
+            self.futures.setdefault(start + offset, []).append(future)
+
+
+class write_behind:
+    """Write-behind buffer of the device slave.
+    delay: seconds from the first pending write to the automatic flush,
+    None: flush() only"""
+
+    def __init__(self, slave, unit_identifier=None, delay=0.05,
+                 max_regs=MAX_WRITE_REGS, max_coils=MAX_WRITE_COILS):
+        self.chat = chat_blocking(slave)
+        self.unit_identifier = unit_identifier
+        self.delay = delay
+        self.max_regs = max_regs
+        self.max_coils = max_coils
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.regs = _pending()
+        self.coils = _pending()
+        self.timer = None
+        self.transactions = 0
+
+    def _queue(self, pending, start, values):
+        """Queue the write, start the flush timer"""
+        future = Future()
+        future.set_running_or_notify_cancel()
+        future.remaining = len(values)
+        with self.lock:
+            pending.add(start, values, future)
+            if self.timer is None and self.delay is not None:
+                self.timer = threading.Timer(self.delay, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+        return future
+
+    def write_registers(self, start_reg, regs_data):
+        """Queue the write of regs_data from start_reg.
+        ValueError for a value out of the register range (0..0xFFFF)"""
+        return self._queue(self.regs, start_reg, check_registers(regs_data))
+
+    def write_register(self, reg, value):
+        """Queue the write of one register, see write_registers"""
+        return self._queue(self.regs, reg, check_registers([value]))
+
+    def write_coil(self, start_reg, bit_index, bit_value):
+        """Queue the write of one coil (numbered as in modbusf5)"""
+        return self._queue(self.coils, start_reg * 16 + bit_index, [bool(bit_value)])
+
+    def write_coils(self, start_reg, bit_index, bit_values):
+        """Queue the write of bit_values from bit_index of start_reg"""
+        return self._queue(self.coils, start_reg * 16 + bit_index,
+                           [bool(value) for value in bit_values])
+
+    def pending(self):
+        """Number of addresses waiting to be written"""
+        with self.lock:
+            return len(self.regs.values) + len(self.coils.values)
+
+    def flush(self):
+        """Send the pending writes now. Return the number of transactions"""
+        with self.flush_lock:
+            with self.lock:
+                regs, coils = self.regs, self.coils
+                self.regs, self.coils = _pending(), _pending()
+                if self.timer is not None:
+                    self.timer.cancel()
+                    self.timer = None
+            count = 0
+            for start, values in contiguous_runs(regs.values, self.max_regs):
+                count += self._send(regs, start, values, modbusf16(
+                    start, values, unit_identifier=self.unit_identifier))
+            for start, values in contiguous_runs(coils.values, self.max_coils):
+                count += self._send(coils, start, values, modbusf15(
+                    start // 16, start % 16, values, unit_identifier=self.unit_identifier))
+            self.transactions += count
+            return count
+
+    def _send(self, pending, start, values, mod_func):
+        """Send one merged request, complete the futures of its addresses.
+        Any error goes to the futures: the pending sets are already
+        swapped out, nobody else would see it (timer thread)"""
+        try:
+            self.chat(mod_func)
+            error = None
+        except (EFrame, ETout, OSError) as exc:
+            error = exc
+        except Exception as exc:  # pylint: disable=broad-except
+            error = exc  # struct.error di un valore non valido ...
+        for address in range(start, start + len(values)):
+            for future in pending.futures.pop(address):
+                if future.done():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.remaining -= 1
+                    if future.remaining == 0:
+                        future.set_result(None)
+        return 1
+
+    def close(self):
+        """Flush and stop the timer"""
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,248 @@
+# coding=utf-8
+
+"""Slave modbus simulato in memoria per i test senza rete"""
+
+import socketserver
+import struct
+import threading
+import time
+
+from mvmodbus2 import ETout
+
+
+class FakeSlave:
+    """Risponde alle func modbus come uno slave con registri in memoria.
+    Espone chat(mod_func) come i trasporti di mvmodbus2"""
+
+    def __init__(self, registers=None, rejected=(), objects=None, objects_per_answ=2,
+                 silent=()):
+        self.registers = dict(registers or {})
+        self.coils = {}
+        self.objects = dict(objects or {})  # oggetti di identificazione FC43
+        self.objects_per_answ = objects_per_answ
+        self.rejected = set(rejected)  # func code a cui risponde ILLEGAL FUNCTION
+        self.silent = set(silent)  # func code a cui non risponde (timeout)
+        self.requests = []
+
+    def read(self, start, count):
+        """Registri start..start+count, 0 se non impostati"""
+        return [self.registers.get(addr, 0) for addr in range(start, start + count)]
+
+    def write(self, start, values):
+        """Scrive values da start"""
+        for offset, value in enumerate(values):
+            self.registers[start + offset] = value
+
+    def response(self, pdu):
+        """Risposta PDU alla richiesta PDU, None: nessuna risposta"""
+        func_code = pdu[0]
+        self.requests.append(func_code)
+        if func_code in self.silent:
+            return None
+        if func_code in self.rejected:
+            return struct.pack('> B B', func_code | 0x80, 1)
+        if func_code in (3, 4):
+            start, count = struct.unpack('> H H', pdu[1:5])
+            return struct.pack(
+                f'> B B {count}H', func_code, count * 2, *self.read(start, count))
+        if func_code == 5:
+            coil, value = struct.unpack('> H H', pdu[1:5])
+            self.coils[coil] = value == 0xFF00
+            return pdu[:5]
+        if func_code == 15:
+            coil, count = struct.unpack('> H H', pdu[1:5])
+            for ndx in range(count):
+                self.coils[coil + ndx] = bool(pdu[6 + ndx // 8] >> (ndx % 8) & 1)
+            return pdu[:5]
+        if func_code == 16:
+            start, count, _bc = struct.unpack('> H H B', pdu[1:6])
+            self.write(start, struct.unpack(f'> {count}H', pdu[6:6 + count * 2]))
+            return pdu[:5]
+        if func_code == 23:
+            rstart, rcount, wstart, wcount, _bc = struct.unpack('> H H H H B', pdu[1:10])
+            self.write(wstart, struct.unpack(f'> {wcount}H', pdu[10:10 + wcount * 2]))
+            return struct.pack(
+                f'> B B {rcount}H', func_code, rcount * 2, *self.read(rstart, rcount))
+        if func_code == 43:
+            return self.device_identification(pdu)
+        return struct.pack('> B B', func_code | 0x80, 1)
+
+    def device_identification(self, pdu):
+        """Risposta FC43/14 con al piu objects_per_answ oggetti (more follows)"""
+        _fc, mei_type, code, object_id = struct.unpack('> B B B B', pdu[:4])
+        ids = [oid for oid in sorted(self.objects) if oid >= object_id]
+        part, rest = ids[:self.objects_per_answ], ids[self.objects_per_answ:]
+        answ = struct.pack(
+            '> B B B B B B B', 43, mei_type, code, 0x81,
+            0xFF if rest else 0, rest[0] if rest else 0, len(part))
+        for oid in part:
+            answ += struct.pack('> B B', oid, len(self.objects[oid])) + self.objects[oid]
+        return answ
+
+    def chat(self, mod_func):
+        """Esegue la sequenza invio, risposta"""
+        mod_func.mkmsg()
+        answ = self.response(mod_func.msg)
+        if answ is None:
+            raise ETout()
+        return mod_func.answ(answ)
+
+
+def ime_slave(kta, ktv_tenths):
+    """IME con potenza 3-fase 123456, segno negativo, energia 1000"""
+    return FakeSlave({
+        0x1014: 1, 0x1015: 57920, 0x101a: 1,
+        0x101c: 0, 0x101d: 1000,
+        0x1026: 500,
+        0x1200: kta, 0x1201: ktv_tenths,
+    })
+
+
+class FakeServer:
+    """Server Modbus TCP o UDP su localhost che risponde con FakeSlave.
+    delay: attesa prima di ogni risposta
+    units: unit identifier che rispondono (gateway), None: tutti"""
+
+    def __init__(self, slave=None, udp=False, delay=0, units=None):
+        self.slave = slave or FakeSlave()
+        self.delay = delay
+        self.units = units
+        self.lock = threading.Lock()
+        fake = self
+
+        class TCPHandler(socketserver.BaseRequestHandler):
+            """Una connessione TCP"""
+            def handle(self):
+                while True:
+                    header = self.recv_exactly(7)
+                    if header is None:
+                        return
+                    length = struct.unpack('> H', header[4:6])[0]
+                    pdu = self.recv_exactly(length - 1)
+                    if pdu is None:
+                        return
+                    if fake.units is not None and header[6] not in fake.units:
+                        continue
+                    answ = fake.answer(header, pdu)
+                    if answ is None:
+                        continue
+                    try:
+                        self.request.sendall(answ)
+                    except OSError:  # il client ha chiuso la connessione
+                        return
+
+            def recv_exactly(self, size):
+                """size byte o None a connessione chiusa"""
+                data = b''
+                while len(data) < size:
+                    part = self.request.recv(size - len(data))
+                    if not part:
+                        return None
+                    data += part
+                return data
+
+        class UDPHandler(socketserver.BaseRequestHandler):
+            """Un datagramma"""
+            def handle(self):
+                data, sock = self.request
+                if fake.units is not None and data[6] not in fake.units:
+                    return
+                answ = fake.answer(data[:7], data[7:])
+                if answ is not None:
+                    sock.sendto(answ, self.client_address)
+
+        if udp:
+            self.server = socketserver.ThreadingUDPServer(('127.0.0.1', 0), UDPHandler)
+        else:
+            socketserver.ThreadingTCPServer.allow_reuse_address = True
+            self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), TCPHandler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, args=(0.05,), daemon=True)
+        self.thread.start()
+
+    def answer(self, header, pdu):
+        """Risposta ADU con MBAP della richiesta, None: nessuna risposta"""
+        if self.delay:
+            time.sleep(self.delay)
+        with self.lock:
+            answ = self.slave.response(pdu)
+        if answ is None:
+            return None
+        return struct.pack('> H H H B', struct.unpack('> H', header[:2])[0], 0,
+                           len(answ) + 1, header[6]) + answ
+
+    def close(self):
+        """Ferma il server"""
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def rtu_request_len(frame):
+    """Lunghezza della richiesta RTU in frame (unit, PDU, CRC), None se incompleta"""
+    if len(frame) < 2:
+        return None
+    if frame[1] in (15, 16, 23):
+        bytecount = 10 if frame[1] == 23 else 6
+        if len(frame) <= bytecount:
+            return None
+        return bytecount + 1 + frame[bytecount] + 2
+    if frame[1] == 43:
+        return 1 + 4 + 2
+    return 1 + 5 + 2
+
+
+class FakeRTUServer:
+    """Device server RTU su TCP (localhost) che risponde con FakeSlave.
+    corrupt: numero d'ordine delle risposte inviate con CRC errato"""
+
+    def __init__(self, slave=None, corrupt=()):
+        from mvmodbus2.transports import crc16  # pylint: disable=import-outside-toplevel
+        self.slave = slave or FakeSlave()
+        self.corrupt = set(corrupt)
+        self.count = 0
+        self.lock = threading.Lock()
+        fake = self
+
+        class RTUHandler(socketserver.BaseRequestHandler):
+            """Una connessione TCP con frame RTU"""
+            def handle(self):
+                data = b''
+                while True:
+                    size = rtu_request_len(data)
+                    while size is None or len(data) < size:
+                        part = self.request.recv(256)
+                        if not part:
+                            return
+                        data += part
+                        size = rtu_request_len(data)
+                    frame, data = data[:size], data[size:]
+                    if frame[0] == 0:  # broadcast: eseguito, nessuna risposta
+                        with fake.lock:
+                            fake.slave.response(frame[1:-2])
+                        continue
+                    with fake.lock:
+                        answ = fake.slave.response(frame[1:-2])
+                        if answ is None:
+                            continue
+                        answ = frame[:1] + answ
+                        fake.count += 1
+                        crc = b'\x00\x00' if fake.count in fake.corrupt else crc16(answ)
+                    try:
+                        self.request.sendall(answ + crc)
+                    except OSError:  # il client ha chiuso la connessione
+                        return
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), RTUHandler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, args=(0.05,), daemon=True)
+        self.thread.start()
+
+    def close(self):
+        """Ferma il server"""
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,80 @@
+# coding=utf-8
+
+"""unittest script: API asyncio degli strumenti"""
+
+import asyncio
+import unittest
+import mvmodbus2
+from mvmodbus2 import aio, ime106, socomec_a40
+from fakeslave import FakeServer, ime_slave
+
+
+class AsyncTCPTest(unittest.TestCase):
+    """Trasporto TCP asyncio"""
+
+    def test_inflight(self):
+        """Richieste concorrenti con transaction identifier"""
+        server = FakeServer(ime_slave(5, 10))
+        server.slave.rejected.add(4)
+
+        async def run():
+            slave = await aio.async_tcp('127.0.0.1', port=server.port, max_inflight=4).connect()
+            answers = await asyncio.gather(*(
+                slave.chat(mvmodbus2.modbusf3(0x1200 + ndx, 1, unit_identifier=255))
+                for ndx in range(2)))
+            response = await slave.transact(mvmodbus2.modbusf3(0x1026, 1))
+            with self.assertRaises(mvmodbus2.EFrame):
+                await slave.chat(mvmodbus2.modbusf4(0, 1))
+            await slave.close()
+            return answers, response
+
+        answers, response = asyncio.run(run())
+        server.close()
+        self.assertEqual(answers, [(5,), (10,)])
+        self.assertEqual(response.value, (500,))
+
+
+class AsyncMeterTest(unittest.TestCase):
+    """snapshot degli strumenti"""
+
+    def test_ime106(self):
+        """Come la versione sincrona"""
+        server = FakeServer(ime_slave(5, 10))
+
+        async def run():
+            slave = await aio.async_tcp('127.0.0.1', port=server.port, max_inflight=2).connect()
+            meter = await ime106.async_meter(slave)
+            values = await meter.snapshot(['misure'])
+            tvta = await ime106.async_get_k(slave)
+            await slave.close()
+            return values, tvta
+
+        values, tvta = asyncio.run(run())
+        server.close()
+        expected = ime106.scaling(ime_slave(5, 10)).read(ime_slave(5, 10), ['misure'])
+        self.assertEqual(values, expected)
+        self.assertAlmostEqual(values['3-phase :active power'], -1234.56)
+        self.assertEqual(tvta['k'], 5)
+
+    def test_socomec(self):
+        """Energie e misure"""
+        server = FakeServer(ime_slave(0, 0))
+        server.slave.registers.update({777: 23000, 857: 42, 863: 7})
+
+        async def run():
+            slave = await aio.async_tcp('127.0.0.1', port=server.port).connect()
+            answers = (
+                await socomec_a40.async_get_energia_consumata(slave),
+                await socomec_a40.async_get_energia_prodotta(slave),
+                await socomec_a40.async_get_misure(slave, names=['Phase to Phase Voltage: U12']))
+            await slave.close()
+            return answers
+
+        consumata, prodotta, misure = asyncio.run(run())
+        server.close()
+        self.assertEqual((consumata, prodotta), (42, 7))
+        self.assertEqual(misure, {'Phase to Phase Voltage: U12': 230000.0})
+
+
+if __name__ == '__main__':
+    unittest.main()
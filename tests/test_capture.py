@@ -0,0 +1,131 @@
+# coding=utf-8
+
+"""unittest script: cattura dei frame e replay"""
+
+import os
+import tempfile
+import unittest
+import mvmodbus2
+from mvmodbus2 import capture
+from mvmodbus2.rtu_tcp import modbus_rtu_tcp
+from fakeslave import FakeSlave, FakeServer, FakeRTUServer
+
+
+class CaptureTest(unittest.TestCase):
+    """Cattura su TCP e RTU su TCP, replay"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'traffic.pcap')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_capture_replay(self):
+        """I frame catturati ridanno le stesse risposte"""
+        device = FakeSlave({addr: addr * 3 for addr in range(50)}, rejected={4})
+        tcp_server = FakeServer(device)
+        rtu_server = FakeRTUServer(device)
+        tcp = mvmodbus2.modbus_tcp('127.0.0.1', port=tcp_server.port)
+        rtu = modbus_rtu_tcp('127.0.0.1', port=rtu_server.port)
+        writer = capture.capture_writer(self.path)
+        tcp_channel = capture.attach(tcp, writer)
+        capture.attach(rtu, writer)
+        requests = [mvmodbus2.modbusf3(addr, 5) for addr in range(0, 40, 5)]
+        expected = [tcp.chat(req) for req in requests] + [rtu.chat(req) for req in requests]
+        with self.assertRaises(mvmodbus2.EFrame):
+            tcp.chat(mvmodbus2.modbusf4(0, 1))
+        writer.close()
+        tcp.sock.close()
+        rtu.close()
+        tcp_server.close()
+        rtu_server.close()
+
+        records = list(capture.read_capture(self.path))
+        self.assertEqual(records[0][2:4], (capture.TX, capture.MBAP))
+        self.assertEqual(records[0][4], mvmodbus2.modbus_build_TCP_message(requests[0]))
+        self.assertEqual([record[0] for record in records],
+                         sorted(record[0] for record in records))
+
+        replayed = sorted(capture.replay(self.path), key=lambda transaction: transaction[0])
+        self.assertEqual([value for dummy_ts, dummy_req, value, dummy_lat in replayed[:-1]],
+                         expected)
+        self.assertIsInstance(replayed[-1][2], mvmodbus2.EFrame)
+        self.assertTrue(all(latency > 0 for dummy_ts, dummy_req, dummy_v, latency in replayed))
+
+        slave = capture.replay_transport(self.path, channel=tcp_channel.channel)
+        self.assertEqual([slave.chat(req) for req in requests], expected[:8])
+        count, seconds = capture.benchmark(self.path, repeat=10)
+        self.assertEqual(count, 170)
+        self.assertGreater(seconds, 0)
+
+    def test_wrapped_transport(self):
+        """Trasporto RTU dietro rate_limited: framing RTU, hook sul trasporto"""
+        from mvmodbus2.ratelimit import rate_limited  # pylint: disable=import-outside-toplevel
+        server = FakeRTUServer(FakeSlave({0: 9}))
+        rtu = modbus_rtu_tcp('127.0.0.1', port=server.port)
+        slave = rate_limited(rtu)
+        writer = capture.capture_writer(self.path)
+        channel = capture.attach(slave, writer)
+        self.assertIs(rtu.capture, channel)
+        self.assertEqual(slave.chat(mvmodbus2.modbusf3(0, 1)), (9,))
+        writer.close()
+        rtu.close()
+        server.close()
+        records = list(capture.read_capture(self.path))
+        self.assertEqual(records[0][2], capture.TX)
+        self.assertEqual({record[3] for record in records}, {capture.RTU})
+
+    def test_pipeline(self):
+        """Richieste in pipeline: risposte accoppiate per TID (MBAP)
+        o in ordine dopo la divisione dei frame (RTU)"""
+        device = FakeSlave({addr: addr * 3 for addr in range(50)})
+        tcp_server = FakeServer(device)
+        udp_server = FakeServer(device, udp=True)
+        rtu_server = FakeRTUServer(device)
+        transports = [
+            mvmodbus2.modbus_tcp('127.0.0.1', port=tcp_server.port),
+            mvmodbus2.modbus_udp('127.0.0.1', port=udp_server.port),
+            modbus_rtu_tcp('127.0.0.1', port=rtu_server.port)]
+        writer = capture.capture_writer(self.path)
+        channels = [capture.attach(transport, writer).channel for transport in transports]
+        requests = [mvmodbus2.modbusf3(addr, 3) for addr in range(0, 30, 3)]
+        expected = transports[0].pipeline(requests)
+        self.assertEqual(transports[1].pipeline(requests), expected)
+        self.assertEqual(transports[2].pipeline(requests), expected)
+        writer.close()
+        for transport in transports:
+            transport.sock.close()
+        for server in (tcp_server, udp_server, rtu_server):
+            server.close()
+        for channel in channels:
+            replayed = sorted(capture.replay(self.path, channel))
+            self.assertEqual([value for dummy_ts, dummy_req, value, dummy_lat in replayed],
+                             expected)
+
+    def test_truncated_record(self):
+        """Ultimo record troncato: i record completi, senza errori"""
+        server = FakeServer(FakeSlave({0: 9}))
+        tcp = mvmodbus2.modbus_tcp('127.0.0.1', port=server.port)
+        writer = capture.capture_writer(self.path)
+        capture.attach(tcp, writer)
+        tcp.chat(mvmodbus2.modbusf3(0, 1))
+        writer.close()
+        tcp.sock.close()
+        server.close()
+        records = list(capture.read_capture(self.path))
+        with open(self.path, 'r+b') as truncated:
+            truncated.truncate(os.path.getsize(self.path) - 3)
+        self.assertEqual(list(capture.read_capture(self.path)), records[:-1])
+
+    def test_not_a_capture(self):
+        """File che non e' una cattura: ValueError"""
+        for content in (b'', b'not a pcap file at all, really'):
+            with open(self.path, 'wb') as other:
+                other.write(content)
+            with self.assertRaises(ValueError):
+                list(capture.read_capture(self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
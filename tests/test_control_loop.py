@@ -0,0 +1,39 @@
+# coding=utf-8
+
+"""unittest script: control loop FC23"""
+
+import unittest
+import mvmodbus2
+from mvmodbus2 import control_loop
+from fakeslave import FakeSlave
+
+
+class ControlLoopTest(unittest.TestCase):
+    """Scrittura setpoint e lettura retroazione"""
+
+    def test_func23_answ_words(self):
+        """La func 23 restituisce word come la func 3"""
+        msg = mvmodbus2.modbusf23(0, 2, 0, [0])
+        self.assertEqual(msg.answ(b'\x17\x04\xa1\xa1\x1a\x1a'), (0xA1A1, 0x1A1A))
+
+    def test_exchange_fc23(self):
+        """Una sola transazione FC23"""
+        slave = FakeSlave({300: 7, 301: 8})
+        loop = control_loop.control_loop(slave)
+        self.assertEqual(loop.exchange(280, [1, 2], 300, 2), (7, 8))
+        self.assertEqual(slave.requests, [23])
+        self.assertEqual(slave.read(280, 2), [1, 2])
+
+    def test_exchange_fallback(self):
+        """Slave senza FC23: FC16 + FC3, ricordato per i cicli seguenti"""
+        slave = FakeSlave({300: 7}, rejected=[23])
+        loop = control_loop.control_loop(slave)
+        self.assertEqual(loop.exchange(280, [1], 300, 1), (7,))
+        self.assertFalse(loop.use_fc23)
+        self.assertEqual(
+            control_loop.run_cycle([loop], [(280, [3], 280, 1)]), [(3,)])
+        self.assertEqual(slave.requests, [23, 16, 3, 16, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+# coding=utf-8
+
+"""unittest script: Read Device Identification FC43/14"""
+
+import os
+import tempfile
+import unittest
+import mvmodbus2
+from mvmodbus2 import device_id, socomec_a40
+from mvmodbus2.transports import modbus_tcp
+from fakeslave import FakeServer, FakeSlave
+
+
+class DeviceIdTest(unittest.TestCase):
+    """Lettura identificazione e cache"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache = device_id.device_id_cache(
+            os.path.join(self.tmpdir.name, 'device_id.json'))
+        self.slave = FakeSlave(objects={0: b'SOCOMEC', 1: b'A40', 2: b'1.00'})
+        self.slave.clie_addr = ('pwrmu', 502)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_func43_bytes_left(self):
+        """Test della func43 bytes left"""
+        msg = mvmodbus2.modbusf43()
+        answ = b'\x2b\x0e\x01\x81\x00\x00\x01\x00\x03ABC'
+        self.assertEqual(msg.bytes_left(answ), 0)
+        self.assertEqual(msg.bytes_left(answ[:7]), 2)
+        self.assertEqual(msg.bytes_left(answ[:9]), 3)
+        self.assertEqual(msg.answ(answ), (0x81, False, 0, {0: b'ABC'}))
+        with self.assertRaises(mvmodbus2.EFrame):
+            msg.bytes_left(b'\xab\x01')
+
+    def test_more_follows(self):
+        """Gli oggetti arrivano in due risposte"""
+        conformity, objects = device_id.read_device_identification(self.slave)
+        self.assertEqual(conformity, 0x81)
+        self.assertEqual(objects, {
+            'VendorName': 'SOCOMEC', 'ProductCode': 'A40', 'MajorMinorRevision': '1.00'})
+        self.assertEqual(self.slave.requests, [43, 43])
+
+    def test_cache(self):
+        """La seconda lettura viene dalla cache, anche dopo il riavvio"""
+        device_id.get_device_id(self.slave, cache=self.cache)
+        cache = device_id.device_id_cache(self.cache.path)
+        objects = device_id.get_device_id(self.slave, cache=cache)
+        self.assertEqual(objects['VendorName'], 'SOCOMEC')
+        self.assertEqual(self.slave.requests, [43, 43])
+        cache.invalidate(device_id.endpoint_key(self.slave, None))
+        device_id.get_device_id(self.slave, cache=cache)
+        self.assertEqual(len(self.slave.requests), 4)
+
+    def test_cache_expired(self):
+        """Voce scaduta: nuova lettura"""
+        self.cache.max_age = -1
+        device_id.get_device_id(self.slave, cache=self.cache)
+        device_id.get_device_id(self.slave, cache=self.cache)
+        self.assertEqual(len(self.slave.requests), 4)
+
+    def test_product_id_fallback(self):
+        """Senza FC43 (ILLEGAL FUNCTION) identificazione dai registri,
+        FC43 non viene richiesto di nuovo"""
+        slave = FakeSlave(rejected=(43,))
+        slave.clie_addr = ('pwrmu', 502)
+        slave.write(50000, [0x534f, 0x434f])
+        socomec_a40.get_product_id(slave, cache=self.cache)
+        socomec_a40.get_product_id(slave, cache=self.cache)
+        self.assertEqual(slave.requests, [43, 3])
+        socomec_a40.get_product_id(slave, cache=self.cache, refresh=True)
+        self.assertEqual(slave.requests, [43, 3, 43, 3])
+
+    def test_product_id_timeout(self):
+        """FC43 senza risposta: identificazione dai registri,
+        il timeout non disabilita FC43"""
+        slave = FakeSlave(silent=(43,))
+        slave.clie_addr = ('pwrmu', 502)
+        slave.write(50000, [0x534f, 0x434f])
+        product_id = socomec_a40.get_product_id(slave, cache=self.cache)
+        self.assertEqual(product_id['"SOCO"'], 'SOCO')
+        socomec_a40.get_product_id(slave, cache=self.cache)
+        self.assertEqual(slave.requests, [43, 3, 43])
+
+    def test_product_id_tcp(self):
+        """FC43 ignorato da un server TCP (socket.timeout)"""
+        server = FakeServer(FakeSlave(silent=(43,)))
+        slave = modbus_tcp('127.0.0.1', server.port, timeout=0.2)
+        try:
+            server.slave.write(50000, [0x534f, 0x434f])
+            product_id = socomec_a40.get_product_id(slave, cache=self.cache)
+            self.assertEqual(product_id['"SOCO"'], 'SOCO')
+            self.assertEqual(server.slave.requests, [43, 3])
+        finally:
+            slave.sock.close()
+            server.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+# coding=utf-8
+
+"""unittest script: cache DNS e connessioni in parallelo"""
+
+import socket
+import unittest
+from unittest import mock
+import mvmodbus2
+from mvmodbus2 import endpoints
+from fakeslave import FakeSlave, FakeServer
+
+
+class ResolverTest(unittest.TestCase):
+    """getaddrinfo una volta per ttl"""
+
+    def test_cache(self):
+        """Risultati e errori in cache"""
+        cache = endpoints.resolver(ttl=60, negative_ttl=60)
+        real = socket.getaddrinfo
+        with mock.patch('socket.getaddrinfo', side_effect=real) as getaddrinfo:
+            first = cache.address('127.0.0.1', 502)
+            self.assertEqual(cache.address('127.0.0.1', 502), first)
+            self.assertEqual(getaddrinfo.call_count, 1)
+            cache.invalidate('127.0.0.1')
+            cache.address('127.0.0.1', 502)
+            self.assertEqual(getaddrinfo.call_count, 2)
+        self.assertEqual(first, (socket.AF_INET, ('127.0.0.1', 502)))
+        with mock.patch('socket.getaddrinfo', side_effect=socket.gaierror('down')) as getaddrinfo:
+            for dummy in range(2):
+                with self.assertRaises(socket.gaierror):
+                    cache.address('meter.invalid', 502)
+            self.assertEqual(getaddrinfo.call_count, 1)
+
+
+class UDPResolveTest(unittest.TestCase):
+    """modbus_udp risolve di nuovo il nome"""
+
+    def test_resolve_again(self):
+        """Nome non risolto alla creazione, indirizzo cambiato dopo un timeout"""
+        server = FakeServer(FakeSlave({0: 7}), udp=True)
+        dead = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        dead.bind(('127.0.0.1', 0))  # nessuna risposta
+        addresses = {'port': None}
+
+        def getaddrinfo(host, port, *dummy_args):
+            if addresses['port'] is None:
+                raise socket.gaierror('down')
+            return [(socket.AF_INET, socket.SOCK_DGRAM, 17, '',
+                     ('127.0.0.1', addresses['port']))]
+
+        try:
+            with mock.patch('socket.getaddrinfo', side_effect=getaddrinfo):
+                slave = mvmodbus2.modbus_udp('udp.invalid', port=502, timeout=0.1)
+                self.assertIsNone(slave.sock)
+                endpoints.default_resolver.invalidate('udp.invalid')
+                addresses['port'] = dead.getsockname()[1]
+                slave.send(mvmodbus2.modbusf3(0, 1))  # nome risolto al primo invio
+                addresses['port'] = server.port  # cambio DNS: in cache il vecchio
+                with self.assertRaises(socket.timeout):
+                    slave.recv(mvmodbus2.modbusf3(0, 1))
+                self.assertEqual(slave.chat(mvmodbus2.modbusf3(0, 1)), (7,))
+            slave.sock.close()
+        finally:
+            endpoints.default_resolver.invalidate('udp.invalid')
+            dead.close()
+            server.close()
+
+
+class ConnectAllTest(unittest.TestCase):
+    """Connessioni non bloccanti in parallelo"""
+
+    def test_connect_all(self):
+        """Endpoint attivi, porta chiusa, nome non risolto"""
+        servers = [FakeServer(FakeSlave({0: num})) for num in range(3)]
+        closed = socket.socket()
+        closed.bind(('127.0.0.1', 0))
+        closed_port = closed.getsockname()[1]
+        closed.close()
+        cache = endpoints.resolver()
+        cache.cache[('meter.invalid', 502, socket.SOCK_STREAM)] = (
+            float('inf'), socket.gaierror('down'))
+        keepalive = endpoints.socket_options(nodelay=False, keepalive=True, keepidle=30)
+        targets = [('127.0.0.1', server.port) for server in servers]
+        targets[2] = ('127.0.0.1', servers[2].port, keepalive)
+        results = endpoints.connect_all(
+            targets + [('127.0.0.1', closed_port), 'meter.invalid'], timeout=1, cache=cache)
+        for num, target in enumerate(targets):
+            slave = results[target]
+            self.assertEqual(slave.chat(mvmodbus2.modbusf3(0, 1)), (num,))
+        sock = results[targets[0]].sock
+        self.assertTrue(sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY))
+        sock = results[targets[2]].sock
+        self.assertFalse(sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY))
+        self.assertTrue(sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE))
+        self.assertIsInstance(results[('127.0.0.1', closed_port)], OSError)
+        self.assertIsInstance(results['meter.invalid'], socket.gaierror)
+        for target in targets:
+            results[target].sock.close()
+        for server in servers:
+            server.close()
+
+    def test_address_fallback(self):
+        """Primo indirizzo risolto irraggiungibile: si prova il successivo"""
+        server = FakeServer(FakeSlave({0: 7}))
+        closed = socket.socket()
+        closed.bind(('127.0.0.1', 0))
+        closed_port = closed.getsockname()[1]
+        closed.close()
+        addresses = [(socket.AF_INET, ('127.0.0.1', closed_port)),
+                     (socket.AF_INET, ('127.0.0.1', server.port))]
+        key = ('dual.invalid', server.port, socket.SOCK_STREAM)
+        cache = endpoints.resolver()
+        cache.cache[key] = (float('inf'), addresses)
+        results = endpoints.connect_all([('dual.invalid', server.port)], timeout=1, cache=cache)
+        slave = results[('dual.invalid', server.port)]
+        self.assertEqual(slave.chat(mvmodbus2.modbusf3(0, 1)), (7,))
+        slave.sock.close()
+        endpoints.default_resolver.cache[key] = (float('inf'), addresses)
+        try:
+            slave = mvmodbus2.modbus_tcp('dual.invalid', port=server.port, timeout=1)
+        finally:
+            endpoints.default_resolver.invalidate('dual.invalid')
+        self.assertEqual(slave.chat(mvmodbus2.modbusf3(0, 1)), (7,))
+        slave.sock.close()
+        server.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
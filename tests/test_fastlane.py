@@ -0,0 +1,90 @@
+# coding=utf-8
+
+"""unittest script: fast lane dei registri di stato"""
+
+import threading
+import time
+import unittest
+import mvmodbus2
+from mvmodbus2 import fastlane
+from fakeslave import FakeServer, FakeSlave
+
+
+class FastLaneTest(unittest.TestCase):
+    """Fronti dei bit e priorita' sul bus"""
+
+    def test_edges(self):
+        """Callback solo sui bit cambiati"""
+        slave = FakeSlave({872: 0x0001, 873: 0x8000})
+        lane = fastlane.socomec_alarms(slave)
+        self.assertEqual(len(lane.blocks), 1)  # 872-879 con buco di 2 registri
+        events = []
+        lane.on_edge(lambda *event: events.append(event[:3]), 'alarm_in_progress')
+        lane.on_edge(lambda *event: events.append(event[:3]), 'status_inputs_outputs', 16,
+                     fastlane.RISING)
+        self.assertEqual(lane.poll_once(), 0)
+        self.assertEqual(lane.word('alarm_in_progress'), 0x18000)
+        slave.registers.update({872: 0, 873: 0x8001, 878: 1, 876: 0xffff})
+        self.assertEqual(lane.poll_once(), 3)
+        self.assertEqual(sorted(events), [
+            ('alarm_in_progress', 0, 1), ('alarm_in_progress', 16, 0),
+            ('status_inputs_outputs', 16, 1)])
+        slave.registers[878] = 0
+        self.assertEqual(lane.poll_once(), 0)  # fronte di discesa non richiesto
+        self.assertEqual(lane.values()['alarm_detected'], 0)
+
+    def test_priority_lock(self):
+        """I waiter ad alta priorita' passano prima"""
+        lock = fastlane.priority_lock()
+        order = []
+        lock.acquire()
+
+        def waiter(high):
+            lock.acquire(high)
+            order.append(high)
+            lock.release()
+
+        threads = [threading.Thread(target=waiter, args=(False,))]
+        threads[0].start()
+        time.sleep(0.05)
+        threads.append(threading.Thread(target=waiter, args=(True,)))
+        threads[1].start()
+        time.sleep(0.05)
+        lock.release()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(order, [True, False])
+
+    def test_under_load(self):
+        """Scadenze rispettate con il polling massivo sullo stesso trasporto"""
+        server = FakeServer(FakeSlave({0x106f: 0}), delay=0.003)
+        slave = mvmodbus2.modbus_tcp('127.0.0.1', port=server.port, timeout=2)
+        bus = fastlane.shared_bus(slave)
+        lane = fastlane.ime106_relays(bus, period=0.03)
+        edges = []
+        lane.on_edge(lambda *event: edges.append(event[1:3]))
+        stop = threading.Event()
+
+        def bulk():
+            while not stop.is_set():
+                bus.chat(mvmodbus2.modbusf3(0x1000, 60, unit_identifier=255))
+
+        thread = threading.Thread(target=bulk)
+        with lane:
+            thread.start()
+            time.sleep(0.2)
+            server.slave.registers[0x106f] = 4
+            time.sleep(0.3)
+            stop.set()
+            thread.join()
+        slave.sock.close()
+        server.close()
+        self.assertGreater(bus.bulk_transactions, 10)
+        self.assertGreaterEqual(lane.cycles, 10)
+        # il bus arriva alla fast lane al piu' dopo una transazione massiva (~3 ms)
+        self.assertLess(lane.max_lateness, 0.015)
+        self.assertEqual(edges, [(2, 1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+# coding=utf-8
+
+"""unittest script: fedelta' adattiva delle misure SOCOMEC"""
+
+import unittest
+import mvmodbus2
+from mvmodbus2 import socomec_a40
+from fakeslave import FakeSlave
+
+
+class TimeoutSlave(FakeSlave):
+    """FakeSlave che non risponde quando timeout e' vero"""
+    timeout = False
+
+    def chat(self, mod_func):
+        if self.timeout:
+            raise mvmodbus2.ETout('timeout')
+        return super().chat(mod_func)
+
+
+class FidelityTest(unittest.TestCase):
+    """Tabella precisa o compatta, stessi valori e unita'"""
+
+    def slave(self):
+        """U12 e U Sys in entrambe le tabelle"""
+        return TimeoutSlave({
+            50514: 0, 50515: 23012, 50570: 0, 50571: 23012,
+            51281: 23012, 51309: 2301,
+        })
+
+    def test_same_units(self):
+        """I valori delle due tabelle sono nelle stesse unita'"""
+        names = ['Phase to Phase Voltage: U12', 'System value U Sys : (U12 + U23 + U31 ) / 3']
+        meter = socomec_a40.adaptive_meter(self.slave(), names=names)
+        precise = meter.read()
+        self.assertEqual(meter.fidelity, socomec_a40.FIDELITY_PRECISE)
+        meter.policy.set_load(0.9)
+        compact = meter.read()
+        self.assertEqual(meter.fidelity, socomec_a40.FIDELITY_COMPACT)
+        self.assertEqual(precise, {names[0]: 230120.0, names[1]: 230120.0})
+        self.assertEqual(compact, {names[0]: 230120.0, names[1]: 230100.0})
+        self.assertEqual(meter.units, {names[0]: 'mV', names[1]: 'mV'})
+
+    def test_rtu_transport(self):
+        """Trasporto RTU, anche dietro un wrapper: si parte dalla tabella compatta"""
+        from mvmodbus2.ratelimit import rate_limited  # pylint: disable=import-outside-toplevel
+        from mvmodbus2.serial_line import modbus_serial  # pylint: disable=import-outside-toplevel
+        meter = socomec_a40.adaptive_meter(rate_limited(modbus_serial()))
+        self.assertEqual(meter.policy.fidelity, socomec_a40.FIDELITY_COMPACT)
+        meter = socomec_a40.adaptive_meter(rate_limited(self.slave()))
+        self.assertEqual(meter.policy.fidelity, socomec_a40.FIDELITY_PRECISE)
+
+    def test_hysteresis(self):
+        """Timeout: compatta; si torna precisa dopo hold letture buone"""
+        slave = self.slave()
+        meter = socomec_a40.adaptive_meter(slave, names=['Frequency : F'])
+        slave.timeout = True
+        with self.assertRaises(mvmodbus2.ETout):
+            meter.read()
+        slave.timeout = False
+        fidelities = []
+        for dummy in range(12):
+            meter.read()
+            fidelities.append(meter.fidelity)
+        switch = fidelities.index('precise')
+        self.assertGreaterEqual(switch, meter.policy.hold)
+        self.assertEqual(fidelities, ['compact'] * switch + ['precise'] * (12 - switch))
+
+    def test_tables(self):
+        """Tabelle allineate, compatta di meta' registri"""
+        tables = socomec_a40.fidelity_tables()
+        precise, compact = tables['precise'], tables['compact']
+        self.assertEqual([entry[0] for entry in precise], [entry[0] for entry in compact])
+        self.assertEqual(sum(entry[2] for entry in precise),
+                         2 * sum(entry[2] for entry in compact))
+
+
+if __name__ == '__main__':
+    unittest.main()
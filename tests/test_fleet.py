@@ -0,0 +1,74 @@
+# coding=utf-8
+
+"""unittest script: scritture broadcast e fan-out su una flotta"""
+
+import datetime
+import unittest
+import mvmodbus2
+from mvmodbus2 import fleet, socomec_a40
+from mvmodbus2.rtu_tcp import modbus_rtu_tcp
+from mvmodbus2.serial_line import modbus_serial
+from mvmodbus2.transports import modbus_build_RTU_broadcast
+from fakeslave import FakeRTUServer, FakeServer
+
+
+class FleetTest(unittest.TestCase):
+    """Un frame per linea seriale, scritture parallele su TCP"""
+
+    def test_broadcast_frame(self):
+        """Indirizzo 0 e solo funzioni di scrittura"""
+        frame = modbus_build_RTU_broadcast(mvmodbus2.modbusf16(100, [1, 2]))
+        self.assertEqual(frame[:2], b'\x00\x10')
+        with self.assertRaises(ValueError):
+            modbus_build_RTU_broadcast(mvmodbus2.modbusf3(100, 2))
+
+    def test_set_clock(self):
+        """Ora su due unita' RTU (broadcast) e due TCP"""
+        when = datetime.datetime(2026, 3, 4, 5, 6, 7)
+        rtu_server = FakeRTUServer()
+        tcp_server = FakeServer()
+        tcp_server.slave.rejected.add(16)
+        rtu = modbus_rtu_tcp('127.0.0.1', port=rtu_server.port)
+        tcp = mvmodbus2.modbus_tcp('127.0.0.1', port=tcp_server.port)
+        targets = [(rtu, 1), (rtu, 2), (tcp, 1), (tcp, 2)]
+        results = socomec_a40.set_clock(targets, when, broadcast=True)
+        answer = rtu.chat(mvmodbus2.modbusf3(57600, 6, unit_identifier=1))
+        rtu.close()
+        tcp.sock.close()
+        rtu_server.close()
+        tcp_server.close()
+        self.assertEqual(results.sent, 3)
+        self.assertEqual(rtu_server.slave.requests, [16, 3])
+        self.assertEqual(answer, (4, 3, 2026, 5, 6, 7))
+        self.assertEqual(results.ok(), {(rtu, 1): fleet.BROADCAST, (rtu, 2): fleet.BROADCAST})
+        self.assertEqual(set(results.failed()), {(tcp, 1), (tcp, 2)})
+        self.assertIsInstance(results[(tcp, 1)], mvmodbus2.EFrame)
+
+    def test_serial_line(self):
+        """modbus_serial: broadcast senza risposta, poi transazione normale"""
+        server = FakeRTUServer()
+        line = modbus_serial()
+        line.tcp_start_serial(('127.0.0.1', server.port))
+        line.broadcast(mvmodbus2.modbusf16(10, [7]), turnaround_delay=0.01)
+        results = fleet.fan_out([(line, 3), (line, 4)],
+                                lambda unit: mvmodbus2.modbusf3(10, 1, unit_identifier=unit))
+        line.serial.close()
+        server.close()
+        self.assertEqual(results, {(line, 3): (7,), (line, 4): (7,)})
+        self.assertEqual(results.sent, 2)
+
+    def test_serial_unicast_write(self):
+        """Senza broadcast: una FC16 confermata per unita' anche su seriale"""
+        server = FakeRTUServer()
+        line = modbus_serial()
+        line.tcp_start_serial(('127.0.0.1', server.port))
+        results = socomec_a40.set_clock([(line, 3), (line, 4)])
+        line.serial.close()
+        server.close()
+        self.assertEqual(results.failed(), {})
+        self.assertEqual(results.sent, 2)
+        self.assertEqual(server.slave.requests, [16, 16])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+# coding=utf-8
+
+"""unittest script: storico su ring buffer compresso"""
+
+import math
+import os
+import random
+import tempfile
+import unittest
+from mvmodbus2 import history
+
+
+class HistoryTest(unittest.TestCase):
+    """Append, query per tempo, ring buffer"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'meter.hist')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_roundtrip(self):
+        """Valori interi e float decodificati uguali"""
+        rnd = random.Random(1)
+        store = history.history_store(
+            self.path, {'energy': history.INT, 'voltage': history.FLOAT, 'pf': history.FLOAT},
+            size=1024 * 1024, block_size=4096)
+        samples = []
+        energy = 1000000
+        for ndx in range(3000):
+            energy += rnd.choice((3, 3, 3, 4))
+            row = {'energy': energy, 'voltage': 230 + rnd.random(),
+                   'pf': -0.95 if ndx % 7 else float('nan')}
+            samples.append((1700000000 + ndx, row))
+            store.append(row, timestamp=1700000000 + ndx)
+        timestamps, columns = store.query()
+        self.assertEqual(timestamps, [sample[0] for sample in samples])
+        self.assertEqual(columns['energy'], [sample[1]['energy'] for sample in samples])
+        self.assertEqual(columns['voltage'], [sample[1]['voltage'] for sample in samples])
+        self.assertTrue(math.isnan(columns['pf'][0]))
+        self.assertEqual(columns['pf'][1], -0.95)
+        timestamps, columns = store.query(1700000100, 1700000199.5, names=['energy'])
+        self.assertEqual(len(timestamps), 100)
+        self.assertEqual(list(columns), ['energy'])
+        store.close()
+        store = history.history_store(self.path)
+        store.append({'energy': energy + 3}, timestamp=1700003000)
+        timestamps, columns = store.query(1700002999)
+        self.assertEqual(columns['energy'], [energy, energy + 3])
+        store.close()
+
+    def test_compression_and_ring(self):
+        """Contatore a passo costante: ~1 bit per campione; i blocchi vecchi sono sovrascritti"""
+        store = history.history_store(self.path, {'energy': history.INT},
+                                      size=4 * 4096, block_size=4096)
+        for ndx in range(10000):
+            store.append({'energy': 5 * ndx}, timestamp=ndx)
+        self.assertLess(store.bytes_used(), 10000 * 2 // 8 + 8 * 64)
+        for ndx in range(10000, 100000):
+            store.append({'energy': 5 * ndx}, timestamp=ndx)
+        timestamps, columns = store.query()
+        self.assertEqual(timestamps[-1], 99999)
+        self.assertGreater(timestamps[0], 0)
+        self.assertEqual(columns['energy'][0], 5 * timestamps[0])
+        self.assertEqual(timestamps, list(range(int(timestamps[0]), 100000)))
+        store.close()
+
+    def test_bad_file(self):
+        """File non history o parametri errati: ValueError"""
+        with self.assertRaises(ValueError):
+            history.history_store(self.path)
+        with open(self.path, 'wb') as other:
+            other.write(b'not a history file')
+        with self.assertRaises(ValueError):
+            history.history_store(self.path)
+        with self.assertRaises(ValueError):
+            history.history_store(self.path + '2', ['a', 'b'], block_size=64)
+
+
+if __name__ == '__main__':
+    unittest.main()
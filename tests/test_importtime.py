@@ -0,0 +1,81 @@
+# coding=utf-8
+
+"""unittest script: tempo di import del package (python -X importtime)"""
+
+import subprocess
+import sys
+import unittest
+
+# moduli pesanti che import mvmodbus2 non deve caricare
+HEAVY_MODULES = ('asyncio', 'concurrent.futures', 'json', 'mmap', 'selectors', 'threading')
+
+
+def importtime(code):
+    """Moduli importati eseguendo code: {modulo: cumulativo us}"""
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        capture_output=True, text=True, check=True)
+    modules = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        fields = line[len('import time:'):].split('|')
+        try:
+            modules[fields[2].strip()] = int(fields[1])
+        except ValueError:
+            pass  # intestazione
+    return modules
+
+
+def loaded_modules(code):
+    """sys.modules dopo code, in un interprete nuovo"""
+    proc = subprocess.run(
+        [sys.executable, '-c', code + '\nimport sys\nprint("\\n".join(sys.modules))'],
+        capture_output=True, text=True, check=True)
+    return set(proc.stdout.split())
+
+
+class ImportTimeTest(unittest.TestCase):
+    """Import pigro dei sottomoduli"""
+
+    def test_import_package(self):
+        """import mvmodbus2 non carica trasporti e seriale"""
+        modules = importtime('import mvmodbus2')
+        for name in ('termios', 'socket', 'select',
+                     'mvmodbus2.transports', 'mvmodbus2.serial_line'):
+            self.assertNotIn(name, modules)
+        loaded = loaded_modules('import mvmodbus2')
+        self.assertEqual({name for name in loaded if name.startswith('mvmodbus2.')}, set())
+        for name in HEAVY_MODULES:
+            self.assertNotIn(name, loaded)
+
+    def test_functions_only(self):
+        """Le func modbus non richiedono socket"""
+        modules = importtime('import mvmodbus2; mvmodbus2.modbusf3(0, 1)')
+        self.assertIn('mvmodbus2.functions', modules)
+        self.assertNotIn('socket', modules)
+        self.assertNotIn('termios', modules)
+
+    def test_serial_on_demand(self):
+        """termios solo con modbus_serial"""
+        modules = importtime('import mvmodbus2; mvmodbus2.modbus_tcp')
+        self.assertNotIn('termios', modules)
+        modules = importtime('import mvmodbus2; mvmodbus2.modbus_serial')
+        self.assertIn('mvmodbus2.serial_line', modules)
+
+    def test_device_module(self):
+        """Il modulo ime106 non costruisce la mappa all'import"""
+        modules = importtime(
+            'import mvmodbus2.ime106 as m; assert "REGISTRI_MISURE106_map" not in vars(m)')
+        self.assertNotIn('socket', modules)
+
+    def test_profile_module(self):
+        """profile (e fastlane, planner) non carica i moduli degli strumenti"""
+        loaded = loaded_modules('import mvmodbus2.profile, mvmodbus2.planner')
+        self.assertIn('mvmodbus2.decoders', loaded)
+        self.assertNotIn('mvmodbus2.ime106', loaded)
+        self.assertNotIn('mvmodbus2.socomec_a40', loaded)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+# coding=utf-8
+
+"""unittest script: python -m mvmodbus2"""
+
+import contextlib
+import io
+import json
+import unittest
+from mvmodbus2 import __main__ as cli
+from fakeslave import FakeServer, ime_slave
+
+
+class MainTest(unittest.TestCase):
+    """Poll da linea di comando"""
+
+    def run_cli(self, *argv):
+        """(status, stdout, stderr)"""
+        out, err = io.StringIO(), io.StringIO()
+        with contextlib.redirect_stderr(err):
+            status = cli.main(list(argv), out=out)
+        return status, out.getvalue(), err.getvalue()
+
+    def test_poll_json(self):
+        """Due cicli in JSON con report di latenza e profilo"""
+        server = FakeServer(ime_slave(5, 10))
+        status, out, err = self.run_cli(
+            '127.0.0.1', '--port', str(server.port), '--rate', '0', '--count', '2',
+            '--format', 'json', '-n', 'Current transformer ratio (KTA)', '-n', 'frequency',
+            '--latency-report', '--profile', '--tracemalloc', '3')
+        server.close()
+        self.assertEqual(status, 0)
+        records = [json.loads(line) for line in out.splitlines()]
+        self.assertEqual(len(records), 4)
+        self.assertEqual(records[0]['name'], 'Frequency')
+        self.assertEqual(records[1]['value'], 5)
+        self.assertIn('p99', err)
+        self.assertIn('request', err)
+        self.assertIn('tracemalloc top 3', err)
+
+    def test_list_and_errors(self):
+        """Elenco dei registri, mappa sconosciuta"""
+        status, out, dummy_err = self.run_cli('-', '--map', 'socomec_a40:REGISTRI_ENERGIE',
+                                              '--list')
+        self.assertEqual(status, 0)
+        self.assertIn('Partial Positive Active Energy', out)
+        status, dummy_out, err = self.run_cli('-', '--map', 'nemo')
+        self.assertEqual(status, 2)
+        self.assertIn('unknown register map', err)
+        with self.assertRaises(SystemExit) as exit_status:
+            self.run_cli('/dev/ttyUSB0', '--transport', 'serial', '--baud', '12345')
+        self.assertEqual(exit_status.exception.code, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
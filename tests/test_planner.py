@@ -0,0 +1,77 @@
+# coding=utf-8
+
+"""unittest script: pianificazione della linea seriale"""
+
+import time
+import unittest
+import mvmodbus2
+from mvmodbus2 import ime106, planner
+from mvmodbus2.serial_line import modbus_serial
+from fakeslave import FakeRTUServer, FakeSlave
+
+
+class SlowSlave(FakeSlave):
+    """Slave con 30 ms di turnaround"""
+
+    def response(self, pdu):
+        time.sleep(0.03)
+        return super().response(pdu)
+
+
+class PlannerTest(unittest.TestCase):
+    """Tempi sul filo, utilizzo e raccomandazioni"""
+
+    def test_wire_time(self):
+        """FC3 di 2 registri a 9600 baud"""
+        self.assertAlmostEqual(planner.t35(9600), 3.5 * 11 / 9600)
+        self.assertEqual(planner.t35(115200), 0.00175)
+        self.assertEqual(planner.frame_bytes(3, 2), (8, 9))
+        self.assertAlmostEqual(planner.transaction_time(3, 2, 9600, 0.005),
+                               17 * 11 / 9600 + 7 * 11 / 9600 + 0.005)
+
+    def test_plan(self):
+        """Utilizzo, baud minimo e suddivisione"""
+        meter = planner.device('ime', ime106.stream_entries(), interval=1.0)
+        self.assertLess(len(meter.blocks), len(ime106.REGISTRI_MISURE106))
+        report = planner.plan_line(9600, [meter])
+        self.assertTrue(report.feasible)
+        self.assertLess(report.recommended['ime'], 1.0)
+        self.assertAlmostEqual(report.utilisation, meter.cycle_time(9600))
+
+        meters = [planner.device(f'm{ndx}', [(0x1000, 60)], 1.0, turnaround=0.02)
+                  for ndx in range(6)]
+        report = planner.plan_line(9600, meters)
+        self.assertFalse(report.feasible)
+        self.assertEqual(report.min_baud, 19200)
+        self.assertIsNone(report.split)
+        self.assertIn('raise the line to 19200 baud', str(report))
+        self.assertGreater(report.recommended['m0'], 1.0)
+        self.assertAlmostEqual(sum(
+            meter.cycle_time(9600) / report.recommended[meter.name] for meter in meters),
+            planner.MAX_UTILISATION)
+
+        meters = [planner.device(f'm{ndx}', [(0, 125)], 0.2, turnaround=0.01)
+                  for ndx in range(8)]
+        report = planner.plan_line(9600, meters)
+        self.assertIsNone(report.min_baud)
+        self.assertEqual(len(report.split), planner.lines_needed(meters, 115200))
+        self.assertEqual(len(report.split), 3)
+        self.assertIn('split in', str(report))
+
+    def test_measure_turnaround(self):
+        """modbus_serial: il flush_in prima dell'invio non e' misurato"""
+        server = FakeRTUServer(SlowSlave())
+        line = modbus_serial()
+        line.tcp_start_serial(('127.0.0.1', server.port))
+        try:
+            turnaround = planner.measure_turnaround(
+                line, mvmodbus2.modbusf3(0, 10, unit_identifier=1), 115200, 10, repeat=3)
+        finally:
+            line.serial.close()
+            server.close()
+        self.assertGreater(turnaround, 0.02)
+        self.assertLess(turnaround, 0.06)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+# coding=utf-8
+
+"""unittest script: richieste pre-codificate"""
+
+import unittest
+import mvmodbus2
+from fakeslave import FakeSlave, FakeServer
+
+
+class PreparedRequestTest(unittest.TestCase):
+    """ADU codificato una volta"""
+
+    def test_tcp_frame(self):
+        """Solo il transaction identifier cambia"""
+        req = mvmodbus2.prepared_request(mvmodbus2.modbusf3(0x1000, 2, unit_identifier=255))
+        self.assertEqual(req.adu, b'\x00\x00\x00\x00\x00\x06\xff\x03\x10\x00\x00\x02')
+        self.assertEqual(req.frame(0x1234), b'\x12\x34' + req.adu[2:])
+        with self.assertRaises(AttributeError):
+            req.adu = b''
+
+    def test_rtu_frame(self):
+        """Frame RTU con CRC"""
+        req = mvmodbus2.prepared_request(mvmodbus2.modbusf3(0, 1, unit_identifier=1), rtu=True)
+        self.assertEqual(req.adu, b'\x01\x03\x00\x00\x00\x01\x84\x0a')
+        self.assertEqual(req.frame(7), req.adu)
+
+    def test_framing_mismatch(self):
+        """ValueError se la codifica non e' quella del trasporto"""
+        from mvmodbus2.rtu_tcp import rtu_frame  # pylint: disable=import-outside-toplevel
+        from mvmodbus2.serial_line import modbus_serial  # pylint: disable=import-outside-toplevel
+        tcp_req = mvmodbus2.prepared_request(mvmodbus2.modbusf3(0, 1, unit_identifier=1))
+        rtu_req = mvmodbus2.prepared_request(tcp_req.mod_func, rtu=True)
+        self.assertEqual(rtu_frame(rtu_req), rtu_req.adu)
+        with self.assertRaises(ValueError):
+            rtu_frame(tcp_req)
+        udp = mvmodbus2.modbus_udp('127.0.0.1')
+        with self.assertRaises(ValueError):
+            udp.send(rtu_req)
+        udp.sock.close()
+        line = modbus_serial()
+        with self.assertRaises(ValueError):
+            line.sendmsg(tcp_req)
+
+    def test_poll_cycle(self):
+        """Stesse richieste a ogni ciclo su TCP"""
+        server = FakeServer(FakeSlave({addr: addr * 2 for addr in range(0, 20)}))
+        slave = mvmodbus2.modbus_tcp('127.0.0.1', port=server.port)
+        requests = mvmodbus2.prepare([mvmodbus2.modbusf3(addr, 2) for addr in range(0, 20, 2)])
+        for dummy_cycle in range(3):
+            self.assertEqual(
+                [slave.chat(req) for req in requests],
+                [(addr * 2, addr * 2 + 2) for addr in range(0, 20, 2)])
+        self.assertEqual(slave.transaction_identifier, 30)
+        slave.sock.close()
+        server.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
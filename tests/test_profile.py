@@ -0,0 +1,62 @@
+# coding=utf-8
+
+"""unittest script: profili dispositivo dichiarativi"""
+
+import os
+import tempfile
+import unittest
+from mvmodbus2 import profile, ime106, socomec_a40
+from fakeslave import FakeSlave
+
+
+class ProfileTest(unittest.TestCase):
+    """Compilazione, cache e lettura dei profili"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.registers = {addr: (addr * 7) % 65536 for addr in range(0x1000, 0x1210)}
+        for addr in (0x101a, 0x101b, 0x1032, 0x1033, 0x1034, 0x103b, 0x103c, 0x103d):
+            self.registers[addr] = addr % 2  # segno
+        self.registers.update({addr: addr % 300 for addr in range(700, 1000)})
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_read_plan(self):
+        """I registri contigui diventano un'unica lettura"""
+        ime = profile.load_profile('ime106', cache_dir=self.tmpdir.name)
+        self.assertEqual([block[:2] for block in ime.read_plan(['misure'])], [(0x1000, 124)])
+        soco = profile.load_profile('socomec_a40', cache_dir=self.tmpdir.name)
+        self.assertEqual([block[:2] for block in soco.read_plan(['REGISTRI_MISURE_PRECISIONE'])],
+                         [(768, 124), (892, 40)])
+
+    def test_same_values_as_get_regs(self):
+        """Il profilo decodifica come le tabelle dei moduli"""
+        ime = profile.load_profile('ime106', cache_dir=self.tmpdir.name)
+        slave = FakeSlave(self.registers)
+        names = [reg[2] for reg in ime106.REGISTRI_MISURE106]
+        params = {'nota3': ime106.CONST_SCALA_NOTA3, 'nota4': ime106.CONST_SCALA_NOTA4}
+        self.assertEqual(ime.read(slave, params=params), ime106.get_regs(slave, names))
+        soco = profile.load_profile('socomec_a40', cache_dir=self.tmpdir.name)
+        names = [reg[2] for reg in socomec_a40.REGISTRI_MISURE_PRECISIONE]
+        self.assertEqual(soco.read(slave, ['REGISTRI_MISURE_PRECISIONE']),
+                         socomec_a40.get_regs(slave, names))
+
+    def test_compiled_cache(self):
+        """Il profilo compilato viene scritto e riletto dalla cache"""
+        path = os.path.join(self.tmpdir.name, 'plc.csv')
+        with open(path, 'w', encoding='utf-8') as source:
+            source.write('group,address,count,name,unit,type,scale\n'
+                         'aree,0x200,1,Uscite,,U16,\n'
+                         'aree,0x201,2,Contatore,,U32,0.5\n')
+        compiled = profile.compile_profile(path, self.tmpdir.name)
+        cached = [name for name in os.listdir(self.tmpdir.name) if name.endswith('.marshal')]
+        self.assertEqual(len(cached), 1)
+        self.assertEqual(profile.compile_profile(path, self.tmpdir.name), compiled)
+        plc = profile.device_profile(compiled)
+        slave = FakeSlave({0x200: 5, 0x201: 1, 0x202: 0})
+        self.assertEqual(plc.read(slave), {'Uscite': 5, 'Contatore': 32768.0})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+# coding=utf-8
+
+"""unittest script: proxy Modbus TCP con accorpamento delle letture"""
+
+import struct
+import threading
+import unittest
+import mvmodbus2
+from mvmodbus2.proxy import coalescer, merge_ranges, proxy_server
+from fakeslave import FakeSlave, FakeServer
+
+
+class MergeRangesTest(unittest.TestCase):
+    """Intervalli sovrapposti o adiacenti"""
+
+    def test_merge(self):
+        """Fino a max_regs registri"""
+        self.assertEqual(merge_ranges([(10, 5), (0, 4), (4, 2), (12, 10)]),
+                         [(0, 6), (10, 12)])
+        self.assertEqual(merge_ranges([(0, 100), (90, 50)]), [(0, 100), (90, 50)])
+
+
+class ProxyTest(unittest.TestCase):
+    """Piu' client SCADA, un solo device"""
+
+    def setUp(self):
+        self.device = FakeSlave({addr: addr + 1000 for addr in range(200)}, rejected={4})
+        self.server = FakeServer(self.device)
+        self.proxy = proxy_server(
+            {1: lambda: mvmodbus2.modbus_tcp('127.0.0.1', port=self.server.port)},
+            host='127.0.0.1', port=0, window=0.05, cache_ttl=0.5).start()
+
+    def tearDown(self):
+        self.proxy.close()
+        self.server.close()
+
+    def client(self):
+        """Connessione al proxy"""
+        return mvmodbus2.modbus_tcp('127.0.0.1', port=self.proxy.port)
+
+    def test_coalescing(self):
+        """Letture concorrenti accorpate in una sola lettura a valle"""
+        answers = {}
+
+        def scada(start):
+            slave = self.client()
+            answers[start] = slave.chat(mvmodbus2.modbusf3(start, 10))
+            slave.sock.close()
+
+        threads = [threading.Thread(target=scada, args=(start,)) for start in (0, 5, 10, 15)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for start, words in answers.items():
+            self.assertEqual(words, tuple(range(start + 1000, start + 1010)))
+        self.assertEqual(self.device.requests, [3])
+        self.assertEqual(self.proxy.devices[1].downstream_reads, 1)
+
+    def test_cache_and_write(self):
+        """Lettura dalla cache, la scrittura la invalida"""
+        slave = self.client()
+        self.assertEqual(slave.chat(mvmodbus2.modbusf3(0, 2)), (1000, 1001))
+        self.assertEqual(slave.chat(mvmodbus2.modbusf3(1, 1)), (1001,))
+        self.assertEqual(self.device.requests, [3])
+        slave.chat(mvmodbus2.modbusf16(1, (7,)))
+        self.assertEqual(slave.chat(mvmodbus2.modbusf3(1, 1)), (7,))
+        self.assertEqual(self.device.requests, [3, 16, 3])
+        slave.sock.close()
+
+    def test_exceptions(self):
+        """Eccezioni del device e unit senza percorso"""
+        slave = self.client()
+        with self.assertRaises(mvmodbus2.EFrame) as ctx:
+            slave.chat(mvmodbus2.modbusf4(0, 1))
+        self.assertEqual(ctx.exception.exception_code, 1)
+        with self.assertRaises(mvmodbus2.EFrame) as ctx:
+            slave.chat(mvmodbus2.modbusf3(0, 1, unit_identifier=9))
+        self.assertEqual(ctx.exception.exception_code, 0x0A)
+        slave.sock.close()
+
+    def test_device_down(self):
+        """Device che non risponde: GATEWAY TARGET FAILED"""
+        device = coalescer(lambda: mvmodbus2.modbus_tcp('127.0.0.1', port=1), window=0)
+        self.assertEqual(device.request(1, b'\x03\x00\x00\x00\x01'), b'\x83\x0b')
+
+
+
+class LimitedSlave(FakeSlave):
+    """Letture a cavallo del registro 100: ILLEGAL DATA ADDRESS"""
+
+    def response(self, pdu):
+        if pdu[0] == 3:
+            start, count = struct.unpack('> H H', pdu[1:5])
+            if start < 100 < start + count:
+                self.requests.append(3)
+                return struct.pack('> B B', 0x83, 2)
+        return super().response(pdu)
+
+
+class ShortSlave(FakeSlave):
+    """Le prime short letture rispondono con un registro in meno"""
+    short = 0
+
+    def response(self, pdu):
+        answ = super().response(pdu)
+        if pdu[0] == 3 and self.short:
+            self.short -= 1
+            return struct.pack('> B B', 3, answ[1] - 2) + answ[2:-2]
+        return answ
+
+
+class CoalescerErrorTest(unittest.TestCase):
+    """L'errore di un client non ricade sugli altri"""
+
+    def test_span_errors(self):
+        """Span accorpato rifiutato: riletto il range del singolo client"""
+        device = coalescer(LimitedSlave({addr: addr for addr in range(200)}), window=0.05)
+        answers = {}
+
+        def client(start, count):
+            try:
+                answers[start] = device.read(3, 1, start, count)
+            except mvmodbus2.EFrame as exc:
+                answers[start] = exc
+
+        threads = [threading.Thread(target=client, args=args)
+                   for args in ((90, 5), (95, 10), (120, 5))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(answers[120], (120, 121, 122, 123, 124))  # span dopo l'errore
+        self.assertEqual(answers[90], (90, 91, 92, 93, 94))
+        self.assertEqual(answers[95].exception_code, 2)
+
+    def test_short_answer(self):
+        """Risposta corta senza errori: il range viene riletto"""
+        slave = ShortSlave({addr: addr for addr in range(20)})
+        slave.short = 1
+        device = coalescer(slave, window=0)
+        self.assertEqual(device.read(3, 1, 0, 4), (0, 1, 2, 3))
+        slave.short = 2
+        self.assertEqual(device.request(1, b'\x03\x00\x0a\x00\x02'), b'\x83\x0b')
+
+    def test_malformed_pdu(self):
+        """PDU troncata: ILLEGAL DATA VALUE"""
+        device = coalescer(FakeSlave())
+        self.assertEqual(device.request(1, b'\x03\x00'), b'\x83\x03')
+        self.assertEqual(device.request(1, b'\x10\x00\x00\x00\x02\x04\x00'), b'\x90\x03')
+
+
+if __name__ == '__main__':
+    unittest.main()
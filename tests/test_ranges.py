@@ -0,0 +1,86 @@
+# coding=utf-8
+
+"""unittest script: letture di intervalli oltre 125 registri"""
+
+import asyncio
+import time
+import unittest
+from array import array
+import mvmodbus2
+from mvmodbus2 import aio, ranges
+from mvmodbus2.rtu_tcp import modbus_rtu_tcp
+from fakeslave import FakeSlave, FakeServer, FakeRTUServer
+
+
+def plc_image():
+    """Immagine di 2000 registri"""
+    return FakeSlave({addr: (addr * 7) & 0xFFFF for addr in range(2000)})
+
+
+EXPECTED = array('H', [(addr * 7) & 0xFFFF for addr in range(2000)])
+
+
+class RangesTest(unittest.TestCase):
+    """Suddivisione e riassemblaggio"""
+
+    def test_split(self):
+        """Blocchi di al piu' 125 registri"""
+        self.assertEqual(ranges.split_range(768, 163), [(768, 125), (893, 38)])
+        self.assertEqual(ranges.split_range(0, 250), [(0, 125), (125, 125)])
+
+    def test_transports(self):
+        """TCP, UDP, RTU su TCP e senza pipeline"""
+        tcp_server = FakeServer(plc_image())
+        udp_server = FakeServer(plc_image(), udp=True)
+        rtu_server = FakeRTUServer(plc_image())
+        tcp = mvmodbus2.modbus_tcp('127.0.0.1', port=tcp_server.port)
+        udp = mvmodbus2.modbus_udp('127.0.0.1', port=udp_server.port)
+        rtu = modbus_rtu_tcp('127.0.0.1', port=rtu_server.port)
+        for slave in (tcp, udp, rtu, plc_image()):
+            self.assertEqual(ranges.read_range(slave, 0, 2000), EXPECTED)
+        self.assertEqual(udp.chat(mvmodbus2.modbusf3(0, 125)), tuple(EXPECTED[:125]))
+        self.assertEqual(ranges.read_range(tcp, 768, 163), EXPECTED[768:931])
+        tcp_server.slave.rejected.add(4)
+        with self.assertRaises(mvmodbus2.EFrame):
+            ranges.read_range(tcp, 0, 300, function=4)
+        self.assertEqual(ranges.read_range(tcp, 5, 3), EXPECTED[5:8])
+        tcp.sock.close()
+        udp.sock.close()
+        rtu.close()
+        for server in (tcp_server, udp_server, rtu_server):
+            server.close()
+
+    def test_pipeline_timeout(self):
+        """Timeout: ETout, le risposte tardive non vanno alle richieste successive"""
+        for udp in (False, True):
+            server = FakeServer(plc_image(), udp=udp, delay=0.3)
+            transport = mvmodbus2.modbus_udp if udp else mvmodbus2.modbus_tcp
+            slave = transport('127.0.0.1', port=server.port, timeout=0.1)
+            sock = slave.sock
+            with self.assertRaises(mvmodbus2.ETout):
+                slave.pipeline([mvmodbus2.modbusf3(0, 2), mvmodbus2.modbusf3(2, 2)])
+            if not udp:
+                self.assertIsNot(slave.sock, sock)  # nuova connessione
+            server.delay = 0
+            time.sleep(0.4)  # UDP: arrivano le risposte tardive
+            answers = slave.pipeline([mvmodbus2.modbusf3(10, 2), mvmodbus2.modbusf3(20, 2)])
+            self.assertEqual(answers, [tuple(EXPECTED[10:12]), tuple(EXPECTED[20:22])])
+            slave.sock.close()
+            server.close()
+
+    def test_async(self):
+        """Blocchi concorrenti su async_tcp"""
+        server = FakeServer(plc_image())
+
+        async def run():
+            slave = await aio.async_tcp('127.0.0.1', port=server.port, max_inflight=4).connect()
+            words = await aio.async_read_range(slave, 100, 1000)
+            await slave.close()
+            return words
+
+        self.assertEqual(asyncio.run(run()), EXPECTED[100:1100])
+        server.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
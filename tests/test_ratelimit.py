@@ -0,0 +1,76 @@
+# coding=utf-8
+
+"""unittest script: limitatore per strumento (token bucket e AIMD)"""
+
+import unittest
+import mvmodbus2
+from mvmodbus2 import ratelimit
+from mvmodbus2.functions import exception_response
+from fakeslave import FakeSlave
+
+
+class BusySlave(FakeSlave):
+    """Risponde SLAVE DEVICE BUSY alle richieste numero busy"""
+
+    def __init__(self, busy, **kwargs):
+        super().__init__(**kwargs)
+        self.busy = set(busy)
+        self.count = 0
+
+    def chat(self, mod_func):
+        self.count += 1
+        if self.count in self.busy:
+            raise exception_response(mod_func.MOD_FUNC | 0x80, ratelimit.SLAVE_DEVICE_BUSY)
+        if self.count == 10:
+            raise mvmodbus2.ETout('timeout')
+        return super().chat(mod_func)
+
+
+class LimiterTest(unittest.TestCase):
+    """Aumento additivo, riduzione moltiplicativa"""
+
+    def test_token_bucket(self):
+        """Oltre il burst si attende"""
+        limiter = ratelimit.device_limiter(rate=10, burst=2, limit=8)
+        self.assertEqual(limiter.try_acquire(), 0)
+        self.assertEqual(limiter.try_acquire(), 0)
+        self.assertGreater(limiter.try_acquire(), 0.05)
+
+    def test_aimd(self):
+        """Crescita con le risposte, taglio con busy e timeout"""
+        limiter = ratelimit.device_limiter(rate=100, burst=100, limit=1, max_limit=4,
+                                           latency_target=1)
+        for dummy in range(20):
+            self.assertEqual(limiter.try_acquire(), 0)
+            limiter.outcome(None, 0.001)
+        self.assertEqual(limiter.limit, 4)
+        self.assertGreater(limiter.rate, 100)
+        rate = limiter.rate
+        limiter.try_acquire()
+        limiter.outcome(exception_response(0x83, ratelimit.SLAVE_DEVICE_BUSY), 0.001)
+        self.assertEqual((limiter.limit, limiter.rate), (2, rate / 2))
+        limiter.try_acquire()
+        limiter.outcome(exception_response(0x83, 2), 0.001)
+        self.assertEqual(limiter.limit, 2)
+        self.assertEqual(limiter.inflight, 0)
+
+    def test_wrapper(self):
+        """Il trasporto limitato rilancia le eccezioni e regola il limite"""
+        slave = ratelimit.rate_limited(
+            BusySlave({3}, registers={0: 42}),
+            ratelimit.device_limiter(rate=1000, burst=10, limit=4, max_limit=8))
+        answers = []
+        for dummy in range(10):
+            try:
+                answers.append(slave.chat(mvmodbus2.modbusf3(0, 1)))
+            except (mvmodbus2.EFrame, mvmodbus2.ETout) as exc:
+                answers.append(type(exc))
+        self.assertEqual(answers[:4], [(42,), (42,), mvmodbus2.EFrame, (42,)])
+        self.assertEqual(answers[-1], mvmodbus2.ETout)
+        self.assertLess(slave.limiter.limit, 4)
+        self.assertEqual(slave.registers, {0: 42})
+        self.assertIs(ratelimit.limiter_for(('meter', 502)), ratelimit.limiter_for(('meter', 502)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+# coding=utf-8
+
+"""unittest script: RTU su TCP, pipelining e gateway multipli asyncio"""
+
+import asyncio
+import socket
+import time
+import unittest
+import mvmodbus2
+from mvmodbus2 import endpoints
+from mvmodbus2.aio import async_rtu_tcp, poll_gateways
+from mvmodbus2.rtu_tcp import modbus_rtu_tcp
+from fakeslave import FakeSlave, FakeRTUServer
+
+
+class RTUTCPTest(unittest.TestCase):
+    """Frame RTU delimitati dalla lunghezza attesa"""
+
+    def setUp(self):
+        self.server = FakeRTUServer(FakeSlave({addr: addr + 100 for addr in range(64)}, rejected={4}))
+        self.slave = modbus_rtu_tcp('127.0.0.1', port=self.server.port)
+
+    def tearDown(self):
+        self.slave.close()
+        self.server.close()
+
+    def test_chat(self):
+        """Lettura e scrittura"""
+        self.assertEqual(self.slave.chat(mvmodbus2.modbusf3(0, 3)), (100, 101, 102))
+        self.slave.chat(mvmodbus2.modbusf16(10, (7, 8)))
+        self.assertEqual(self.slave.transact(mvmodbus2.modbusf3(10, 2)).value, (7, 8))
+        req = mvmodbus2.prepared_request(mvmodbus2.modbusf3(5, 1), rtu=True)
+        self.assertEqual(self.slave.chat(req), (105,))
+
+    def test_exception_response(self):
+        """La risposta di eccezione e' un EFrame con il codice"""
+        with self.assertRaises(mvmodbus2.EFrame) as ctx:
+            self.slave.chat(mvmodbus2.modbusf4(0, 1))
+        self.assertEqual(ctx.exception.exception_code, 1)
+        self.assertEqual(self.slave.chat(mvmodbus2.modbusf3(1, 1)), (101,))
+
+    def test_pipeline(self):
+        """Risposte nell'ordine delle richieste, errori al loro posto"""
+        self.server.corrupt = {3}
+        requests = [mvmodbus2.modbusf3(addr, 4) for addr in range(0, 40, 4)]
+        requests[5] = mvmodbus2.modbusf4(0, 1)
+        answers = self.slave.pipeline(requests, window=3)
+        self.assertEqual(len(answers), 10)
+        self.assertIsInstance(answers[2], mvmodbus2.EFrame)
+        self.assertIsInstance(answers[5], mvmodbus2.EFrame)
+        self.assertEqual(answers[9], (136, 137, 138, 139))
+        self.assertEqual(answers[0], (100, 101, 102, 103))
+
+    def test_connect(self):
+        """Connessione come modbus_tcp: opzioni del socket e indirizzi in ordine"""
+        self.assertTrue(self.slave.sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY))
+        closed = socket.socket()
+        closed.bind(('127.0.0.1', 0))
+        closed_port = closed.getsockname()[1]
+        closed.close()
+        key = ('dual.invalid', self.server.port, socket.SOCK_STREAM)
+        endpoints.default_resolver.cache[key] = (float('inf'), [
+            (socket.AF_INET, ('127.0.0.1', closed_port)),
+            (socket.AF_INET, ('127.0.0.1', self.server.port))])
+        try:
+            slave = modbus_rtu_tcp('dual.invalid', port=self.server.port, timeout=1)
+        finally:
+            endpoints.default_resolver.invalidate('dual.invalid')
+        self.assertEqual(slave.chat(mvmodbus2.modbusf3(0, 1)), (100,))
+        slave.close()
+
+
+class DelaySlave(FakeSlave):
+    """Risponde dopo delay secondi"""
+    delay = 0
+
+    def response(self, pdu):
+        time.sleep(self.delay)
+        return super().response(pdu)
+
+
+class RTUTimeoutTest(unittest.TestCase):
+    """Timeout su modbus_rtu_tcp"""
+
+    def test_pipeline_timeout(self):
+        """ETout, le risposte tardive non vanno alle richieste successive"""
+        slave = DelaySlave({addr: addr + 100 for addr in range(8)})
+        slave.delay = 0.15
+        server = FakeRTUServer(slave)
+        rtu = modbus_rtu_tcp('127.0.0.1', port=server.port, timeout=0.1)
+        try:
+            with self.assertRaises(mvmodbus2.ETout):
+                rtu.pipeline([mvmodbus2.modbusf3(addr, 1) for addr in range(4)], window=4)
+            slave.delay = 0
+            time.sleep(0.7)
+            self.assertEqual(rtu.pipeline([mvmodbus2.modbusf3(6, 1), mvmodbus2.modbusf3(7, 1)]),
+                             [(106,), (107,)])
+            self.assertEqual(rtu.chat(mvmodbus2.modbusf3(5, 1)), (105,))
+        finally:
+            rtu.close()
+            server.close()
+
+
+class AsyncRTUTest(unittest.TestCase):
+    """Timeout su async_rtu_tcp"""
+
+    def test_timeout(self):
+        """ETout, la risposta tardiva non va alla richiesta successiva"""
+        slave = DelaySlave({0: 5, 1: 6})
+        slave.delay = 0.3
+        server = FakeRTUServer(slave)
+
+        async def run():
+            gateway = await async_rtu_tcp('127.0.0.1', port=server.port, timeout=0.1).connect()
+            with self.assertRaises(mvmodbus2.ETout):
+                await gateway.chat(mvmodbus2.modbusf3(0, 1))
+            slave.delay = 0
+            await asyncio.sleep(0.4)
+            answ = await gateway.chat(mvmodbus2.modbusf3(1, 1))
+            await gateway.close()
+            return answ
+
+        answ = asyncio.run(run())
+        server.close()
+        self.assertEqual(answ, (6,))
+
+
+class PollGatewaysTest(unittest.TestCase):
+    """Piu' gateway da un solo event loop"""
+
+    def test_gateways(self):
+        """Ogni gateway con le sue richieste, gateway non raggiungibile"""
+        servers = [FakeRTUServer(FakeSlave({0: num})) for num in range(3)]
+        gateways = {('127.0.0.1', server.port): [mvmodbus2.modbusf3(0, 1)] * 2
+                    for server in servers}
+        closed = servers.pop()
+        closed.close()
+        answers = asyncio.run(poll_gateways(gateways, timeout=1))
+        self.assertEqual(answers[('127.0.0.1', servers[0].port)], [(0,), (0,)])
+        self.assertEqual(answers[('127.0.0.1', servers[1].port)], [(1,), (1,)])
+        self.assertIsInstance(answers[('127.0.0.1', closed.port)], OSError)
+        for server in servers:
+            server.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
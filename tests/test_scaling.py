@@ -0,0 +1,66 @@
+# coding=utf-8
+
+"""unittest script: scalatura per strumento"""
+
+import unittest
+from mvmodbus2 import ime106, scaling, socomec_a40
+from fakeslave import FakeSlave, ime_slave
+
+
+class ScalingTest(unittest.TestCase):
+    """Costanti per strumento e unita' standard"""
+
+    def test_company_unit(self):
+        """Unita' SOCOMEC in unita' aziendali"""
+        self.assertEqual(scaling.company_unit('V / 100'), ('mV', 10.0))
+        self.assertEqual(scaling.company_unit('Wh / 0.001'), ('kWh', 1.0))
+        self.assertEqual(scaling.company_unit('W / 0.1'), ('W', 10.0))
+        self.assertEqual(scaling.company_unit('1/100 signed'), ('1/100 signed', 1))
+
+    def test_two_meters(self):
+        """Due strumenti con rapporti diversi nello stesso processo"""
+        small = ime106.scaling(ime_slave(5, 10))      # k = 5
+        large = ime106.scaling(ime_slave(2000, 100))  # k = 20000
+        names = ['3-phase :active power', '3-phase : positive active energy', 'Frequency']
+        small_values = small.read(ime_slave(5, 10), names=names + ['3-phase : sign of active power'])
+        large_values = large.read(ime_slave(2000, 100), names=names)
+        self.assertAlmostEqual(small_values['3-phase :active power'], -1234.56)
+        self.assertAlmostEqual(small_values['3-phase : positive active energy'], 10.0)
+        self.assertAlmostEqual(small_values['Frequency'], 50.0)
+        self.assertEqual(large_values['3-phase :active power'], 123456)
+        self.assertEqual(large_values['3-phase : positive active energy'], 100000)
+
+    def test_same_as_get_regs(self):
+        """Senza normalizzazione e segni come get_regs"""
+        slave = ime_slave(1, 10)
+        ime106.set_scala_nota3_4(slave)
+        engine = ime106.scaling(slave, normalise=False, signed=False)
+        names = [reg[2] for reg in ime106.REGISTRI_MISURE106]
+        expected = ime106.get_regs(slave, names)
+        values = engine.read(slave)
+        for name in names:
+            self.assertAlmostEqual(values[name], expected[name])
+
+    def test_socomec_units(self):
+        """Tensione in mV, corrente in mA, energia in kWh"""
+        slave = FakeSlave({777: 23000, 769: 1500, 857: 42})
+        values = socomec_a40.get_misure(slave, names=[
+            'Phase to Phase Voltage: U12', 'Phase 1 Current', 'Active Energy +'])
+        self.assertEqual(values, {
+            'Phase to Phase Voltage: U12': 230000.0,
+            'Phase 1 Current': 1500.0,
+            'Active Energy +': 42.0})
+
+    def test_meter(self):
+        """Stesso punto d'ingresso sincrono per i due strumenti"""
+        slave = ime_slave(5, 10)
+        values = ime106.meter(slave).snapshot(['misure'])
+        self.assertEqual(values, ime106.scaling(slave).read(slave, ['misure']))
+        slave = FakeSlave({857: 42})
+        meter = socomec_a40.meter(slave)
+        self.assertIsInstance(meter, scaling.meter)
+        self.assertEqual(meter.snapshot(names=['Active Energy +']), {'Active Energy +': 42.0})
+
+
+if __name__ == '__main__':
+    unittest.main()
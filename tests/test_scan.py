@@ -0,0 +1,126 @@
+# coding=utf-8
+
+"""unittest script: scansione rete e unit identifier"""
+
+import socket
+import struct
+import time
+import unittest
+import mvmodbus2
+from mvmodbus2 import scan
+from fakeslave import FakeServer, FakeSlave
+
+
+class GatewaySlave(FakeSlave):
+    """Gateway con slave solo su alcuni unit identifier"""
+    def __init__(self, units, registers=None):
+        super().__init__(registers)
+        self.units = units
+
+    def chat(self, mod_func):
+        if mod_func.unit_identifier not in self.units:
+            raise socket.timeout
+        return super().chat(mod_func)
+
+
+class LateServer(FakeServer):
+    """Unit 4 risponde dopo il timeout delle probe"""
+
+    def answer(self, header, pdu):
+        if header[6] == 4:
+            time.sleep(0.3)
+        return super().answer(header, pdu)
+
+
+class ScanTest(unittest.TestCase):
+    """Scansione"""
+
+    def test_expand_hosts(self):
+        """Rete /30 e singolo indirizzo"""
+        self.assertEqual(
+            scan.expand_hosts(['10.0.0.0/30', '10.0.0.9', 'plc.loc']),
+            ['10.0.0.1', '10.0.0.2', '10.0.0.9', 'plc.loc'])
+
+    def test_adaptive_timeout(self):
+        """Il timeout segue il tempo di risposta"""
+        timer = scan.adaptive_timeout(initial=0.5, min_timeout=0.01)
+        for dummy_i in range(20):
+            timer.update(0.01)
+        self.assertLess(timer.timeout, 0.05)
+
+    def test_scan_units(self):
+        """Trova le unita' e riconosce SOCOMEC e IME"""
+        soco = struct.unpack('> 2H', b'SOCO')
+        slave = GatewaySlave(
+            {3, 11, 255},
+            {50000: soco[0], 50001: soco[1], 0x1204: 0x10})
+        found = scan.scan_units(lambda timeout: slave, units=[1, 3, 11])
+        self.assertEqual([(unit, device) for unit, device, dummy_rtt in found],
+                         [(3, 'socomec_a40'), (11, 'socomec_a40')])
+        slave = GatewaySlave({255}, {0x1204: 0x10})
+        found = scan.scan_units(lambda timeout: slave, units=[254, 255])
+        self.assertEqual([(unit, device) for unit, device, dummy_rtt in found],
+                         [(255, 'ime106')])
+
+    def test_pipelined_units(self):
+        """TCP e UDP: probe in pipeline su una sola connessione, riusata dopo i timeout"""
+        for udp in (False, True):
+            server = FakeServer(units={3, 11, 30}, udp=udp)
+            transport = mvmodbus2.modbus_udp if udp else mvmodbus2.modbus_tcp
+            opened = []
+
+            def open_slave(timeout, transport=transport, server=server, opened=opened):
+                opened.append(transport('127.0.0.1', port=server.port, timeout=timeout))
+                return opened[-1]
+
+            started = time.monotonic()
+            found = scan.scan_units(open_slave, units=range(1, 41),
+                                    timer=scan.adaptive_timeout(initial=0.2), identify=False)
+            elapsed = time.monotonic() - started
+            server.close()
+            self.assertEqual([unit for unit, dummy_device, dummy_rtt in found], [3, 11, 30])
+            self.assertEqual(len(opened), 2)  # riaperto una volta, dopo le probe
+            self.assertLess(elapsed, 2)  # in sequenza: 37 timeout
+
+    def test_late_probe_answer(self):
+        """La risposta tardiva di una probe non va al fingerprint"""
+        soco = struct.unpack('> 2H', b'SOCO')
+        server = LateServer(FakeSlave({50000: soco[0], 50001: soco[1]}), units={3, 4})
+        try:
+            found = scan.scan_units(
+                lambda timeout: mvmodbus2.modbus_tcp('127.0.0.1', port=server.port,
+                                                     timeout=timeout),
+                units=range(1, 6), timer=scan.adaptive_timeout(initial=0.1, max_timeout=0.1))
+        finally:
+            server.close()
+        self.assertEqual([(unit, device) for unit, device, dummy_rtt in found],
+                         [(3, 'socomec_a40')])
+
+    def test_discover_tcp(self):
+        """Connessione TCP su localhost"""
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(('127.0.0.1', 0))
+        server.listen(4)
+        try:
+            found = scan.discover_tcp(['127.0.0.1'], port=server.getsockname()[1])
+        finally:
+            server.close()
+        self.assertEqual([host for host, dummy_rtt in found], ['127.0.0.1'])
+
+    def test_discover_tcp_ipv6(self):
+        """Indirizzi IPv6"""
+        try:
+            server = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
+            server.bind(('::1', 0))
+        except OSError:
+            self.skipTest('IPv6 non disponibile')
+        server.listen(4)
+        try:
+            found = scan.discover_tcp(['::1/128'], port=server.getsockname()[1])
+        finally:
+            server.close()
+        self.assertEqual([host for host, dummy_rtt in found], ['::1'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+# coding=utf-8
+
+"""unittest script: immagine dei registri in memoria condivisa"""
+
+import math
+import multiprocessing
+import os
+import tempfile
+import unittest
+from mvmodbus2 import shm_image
+from mvmodbus2.ime106 import REGISTRI_MISURE106
+
+
+def reader_process(name, queue):
+    """Legge l'immagine da un altro processo"""
+    reader = shm_image.image_reader(name)
+    queue.put(reader.read('meter')[1])
+    reader.close()
+
+
+class ShmImageTest(unittest.TestCase):
+    """Un collector, piu' lettori"""
+
+    def test_shared_memory(self):
+        """Valori pubblicati letti da un altro processo"""
+        name = f'mvmodbus2-test-{os.getpid()}'
+        writer = shm_image.image_writer(name, {'meter': ['V', 'A', 'Name'], 'plc': ['run']})
+        writer.publish('meter', {'V': 230000, 'A': 1.5, 'Name': 'SOCO'}, timestamp=10.0)
+        queue = multiprocessing.Queue()
+        proc = multiprocessing.Process(target=reader_process, args=(name, queue))
+        proc.start()
+        values = queue.get(timeout=10)
+        proc.join()
+        self.assertEqual(values['V'], 230000.0)
+        self.assertEqual(values['A'], 1.5)
+        self.assertTrue(math.isnan(values['Name']))
+        reader = shm_image.image_reader(name)
+        self.assertEqual(reader.devices(), {'meter': ['V', 'A', 'Name'], 'plc': ['run']})
+        self.assertEqual(reader.read('meter')[0], 10.0)
+        self.assertTrue(shm_image.is_stale(reader.read('plc')[0], 60))
+        seq = reader.sequence('plc')
+        writer.publish('plc', {'run': 1})
+        self.assertEqual(reader.sequence('plc'), seq + 2)
+        self.assertEqual(list(reader.view('plc')), [1.0])
+        reader.close()
+        writer.close()
+
+    def test_mmap_file(self):
+        """Segmento su file, schema da una mappa di registri"""
+        names = shm_image.schema_from_map(REGISTRI_MISURE106)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'image')
+            writer = shm_image.image_writer(None, {'ime': names}, path=path)
+            shm_image.collect(writer, {'ime': lambda: {names[0]: 1, names[-1]: 2}},
+                              period=0, cycles=2)
+            reader = shm_image.image_reader(None, path=path)
+            values = reader.read('ime')[1]
+            self.assertEqual((values[names[0]], values[names[-1]]), (1.0, 2.0))
+            self.assertEqual(reader.sequence('ime'), 4)
+            reader.close()
+            writer.close()
+            self.assertFalse(os.path.exists(path))
+
+    def test_not_an_image(self):
+        """File che non e' un'immagine dei registri: ValueError"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'image')
+            with open(path, 'wb') as other:
+                other.write(bytes(64))
+            with self.assertRaises(ValueError):
+                shm_image.image_reader(None, path=path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+# coding=utf-8
+
+"""unittest script: record compatti degli strumenti"""
+
+import json
+import unittest
+from unittest import mock
+from mvmodbus2 import ime106, snapshot, socomec_a40
+from fakeslave import ime_slave
+
+
+class SnapshotTest(unittest.TestCase):
+    """Record con __slots__ al posto dei dict per descrizione"""
+
+    def test_field_names(self):
+        """Identificatori brevi e unici"""
+        record = socomec_a40.snapshot_type()
+        self.assertEqual(len(set(record.fields)), len(record.fields))
+        self.assertTrue(all(len(field) <= snapshot.MAX_FIELD_LEN + 1 for field in record.fields))
+        self.assertEqual(record.fields[record.index['Active Energy -']], 'active_energy_neg')
+        self.assertIs(socomec_a40.snapshot_type(), record)
+
+    def test_table_key(self):
+        """Cache sul contenuto della tabella, non sull'id della lista"""
+        table = list(socomec_a40.REGISTRI_ENERGIE)
+        record = socomec_a40.snapshot_type(table)
+        self.assertIs(socomec_a40.snapshot_type(list(table)), record)
+        del table[0]
+        self.assertEqual(socomec_a40.snapshot_type(table).names, record.names[1:])
+        for dummy in range(10):  # liste temporanee: id riusati
+            table = [socomec_a40.REGISTRI_ENERGIE[dummy]]
+            self.assertEqual(socomec_a40.snapshot_type(table).names, (table[0][2],))
+
+    def test_module_tables(self):
+        """Tabelle del modulo: tipo costruito una volta, senza chiave sulle righe"""
+        self.assertIs(socomec_a40.snapshot_type(socomec_a40.REGISTRI_ENERGIE),
+                      socomec_a40.snapshot_type(socomec_a40.REGISTRI_ENERGIE))
+        record = ime106.snapshot_type()
+        with mock.patch.object(snapshot, 'table_record_type') as table_record_type:
+            for dummy in range(3):
+                socomec_a40.snapshot_type(socomec_a40.REGISTRI_ENERGIE)
+                self.assertIs(ime106.snapshot_type(), record)
+        table_record_type.assert_not_called()
+
+    def test_ime106(self):
+        """Stessi valori di get_regs, senza dict per lettura"""
+        names = ['3-phase :active power', 'Frequency', 'Current transformer ratio (KTA)']
+        rec = ime106.snapshot(ime_slave(5, 10), names)
+        self.assertFalse(hasattr(rec, '__dict__'))
+        self.assertEqual(rec.to_dict(), ime106.get_regs(ime_slave(5, 10), names))
+        self.assertEqual(rec.current_transformer_ratio_kta, 5)
+        self.assertEqual(rec[rec.index['Frequency']], rec.frequency)
+        self.assertIsNone(rec.phase_1_current)
+        data = json.loads(rec.to_json(key='field'))
+        self.assertEqual(data['values']['current_transformer_ratio_kta'], 5)
+        self.assertIsNotNone(data['timestamp'])
+        self.assertEqual(type(rec).from_mapping(rec.to_dict(), rec.timestamp), rec)
+
+    def test_socomec(self):
+        """Tabella scelta e nomi di campo"""
+        slave = ime_slave(0, 0)
+        slave.registers.update({857: 42, 863: 7})
+        rec = socomec_a40.snapshot(slave, ['active_energy_pos', 'Active Energy -'])
+        self.assertEqual((rec.active_energy_pos, rec.active_energy_neg), (42, 7))
+        self.assertEqual(len(slave.requests), 2)  # 856 e 862 non contigui
+
+
+if __name__ == '__main__':
+    unittest.main()
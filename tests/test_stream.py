@@ -0,0 +1,49 @@
+# coding=utf-8
+
+"""unittest script: letture in streaming (iter_regs)"""
+
+import asyncio
+import unittest
+from mvmodbus2 import aio, ime106, socomec_a40, stream
+from fakeslave import FakeServer, ime_slave
+
+
+class IterRegsTest(unittest.TestCase):
+    """Valori generati blocco per blocco"""
+
+    def test_ime106(self):
+        """Stessi valori di get_regs, una richiesta per blocco"""
+        names = ['3-phase :active power', '3-phase : sign of active power', 'Frequency',
+                 'Current transformer ratio (KTA)', 'Voltage transformer ratio (KTV)']
+        expected = ime106.get_regs(ime_slave(5, 10), names)
+        slave = ime_slave(5, 10)
+        records = ime106.iter_regs(slave, names=names)
+        first = next(records)
+        self.assertEqual(len(slave.requests), 1)
+        records = [first] + list(records)
+        self.assertEqual({name: value for name, value, dummy_ts in records}, expected)
+        blocks = stream.entry_blocks(ime106.stream_entries(names=names))
+        self.assertEqual(len(slave.requests), len(blocks))
+        self.assertLess(len(blocks), len(names))
+
+    def test_async(self):
+        """Il blocco successivo e' letto mentre si consuma il precedente"""
+        server = FakeServer(ime_slave(0, 0))
+        server.slave.registers.update({777: 23000, 857: 42, 863: 7})
+
+        async def run():
+            slave = await aio.async_tcp('127.0.0.1', port=server.port, max_inflight=2).connect()
+            records = [record async for record in socomec_a40.aiter_regs(
+                slave, names=['Active Energy +', 'Active Energy -'])]
+            await slave.close()
+            return records
+
+        records = asyncio.run(run())
+        server.close()
+        self.assertEqual([(name, value) for name, value, dummy_ts in records],
+                         [('Active Energy +', 42), ('Active Energy -', 7)])
+        self.assertLessEqual(records[0][2], records[1][2])
+
+
+if __name__ == '__main__':
+    unittest.main()
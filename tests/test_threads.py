@@ -0,0 +1,98 @@
+# coding=utf-8
+
+"""unittest script: trasporti e richieste condivisi tra thread"""
+
+import concurrent.futures
+import unittest
+import mvmodbus2
+from mvmodbus2.serial_line import modbus_serial
+from fakeslave import FakeRTUServer, FakeSlave, FakeServer
+
+
+class ThreadSafeTest(unittest.TestCase):
+    """Connessione e richieste condivise da un pool di thread"""
+
+    def setUp(self):
+        self.server = FakeServer(FakeSlave({addr: addr for addr in range(0, 200)}))
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_shared_connection(self):
+        """Ogni thread riceve la risposta alla propria richiesta"""
+        slave = mvmodbus2.modbus_tcp('127.0.0.1', port=self.server.port)
+        requests = [mvmodbus2.modbusf3(addr, 3) for addr in range(0, 40)]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as pool:
+            answers = list(pool.map(slave.chat, requests * 5))
+        self.assertEqual(answers, [(addr, addr + 1, addr + 2) for addr in range(0, 40)] * 5)
+        slave.sock.close()
+
+    def test_per_thread_state(self):
+        """bus_err e bytecount sono del thread che ha letto"""
+        msg = mvmodbus2.modbusf3(0, 2)
+        msg.answ(b'\x03\x04\x00\x01\x00\x02')
+        def other_thread():
+            with self.assertRaises(mvmodbus2.EFrame) as err:
+                msg.answ(b'\x83\x02')
+            return msg.bus_err, msg.bytecount, err.exception.exception_code
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as pool:
+            self.assertEqual(pool.submit(other_thread).result(), (0x83, 2, 2))
+        self.assertEqual((msg.bus_err, msg.bytecount), (0, 4))
+
+    def test_transact_unlocked(self):
+        """Percorso senza lock e risultato separato"""
+        server = FakeServer(self.server.slave, udp=True)
+        slave = mvmodbus2.modbus_udp('127.0.0.1', port=server.port, threadsafe=False)
+        response = slave.transact(mvmodbus2.modbusf4(10, 2))
+        self.assertEqual((response.function_code, response.value), (4, (10, 11)))
+        slave.sock.close()
+        server.close()
+
+
+    def test_request_fields(self):
+        """Un campo cambiato dopo l'invio ricostruisce la PDU"""
+        msg = mvmodbus2.modbusf16(10, [1, 2])
+        self.assertEqual(msg.pdu(), b'\x10\x00\x0a\x00\x02\x04\x00\x01\x00\x02')
+        self.assertIsInstance(msg.regs_data, tuple)
+        msg.regs_data = [3]
+        msg.start_reg = 11
+        self.assertEqual(msg.pdu(), b'\x10\x00\x0b\x00\x01\x02\x00\x03')
+
+    def test_abandoned_transaction(self):
+        """Il thread che smette di chiamare chat non blocca la linea"""
+        server = FakeRTUServer(FakeSlave({5: 55}))
+        line = modbus_serial()
+        line.abandon_timeout = 0.2
+        line.tcp_start_serial(('127.0.0.1', server.port))
+
+        def give_up():
+            line.take_line()  # come un chat che ha avuto EAgain e non viene piu' chiamato
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as pool:
+            pool.submit(give_up).result()
+        self.assertIsNotNone(line.owner)
+        answer = line.chat_blocking(mvmodbus2.modbusf3(5, 1))
+        line.serial.close()
+        server.close()
+        self.assertEqual(answer, (55,))
+
+
+    def test_serial_frames_without_byte_count(self):
+        """FC16 e FC43 sulla linea seriale: risposte delimitate da bytes_left"""
+        fake = FakeSlave(objects={0: b'SOCOMEC', 1: b'A40', 2: b'1.00'})
+        server = FakeRTUServer(fake)
+        line = modbus_serial()
+        line.tcp_start_serial(('127.0.0.1', server.port))
+        chat = line.chat_blocking
+        try:
+            chat(mvmodbus2.modbusf16(10, [1, 2], unit_identifier=3))
+            self.assertEqual(chat(mvmodbus2.modbusf3(10, 2, unit_identifier=3)), (1, 2))
+            answ = chat(mvmodbus2.modbusf43(unit_identifier=3))
+            self.assertEqual(answ, (0x81, True, 2, {0: b'SOCOMEC', 1: b'A40'}))
+        finally:
+            line.serial.close()
+            server.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+# coding=utf-8
+
+"""unittest script: scritture accorpate (write-behind)"""
+
+import struct
+import unittest
+import mvmodbus2
+from mvmodbus2.write_behind import contiguous_runs, write_behind
+from fakeslave import FakeSlave
+
+
+class WriteBehindTest(unittest.TestCase):
+    """Scritture di registri e coil accorpate"""
+
+    def test_runs(self):
+        """Indirizzi consecutivi, al piu' max_len"""
+        self.assertEqual(contiguous_runs({3: 'c', 1: 'a', 2: 'b', 7: 'd'}, 2),
+                         [(1, ['a', 'b']), (3, ['c']), (7, ['d'])])
+
+    def test_merge_and_supersede(self):
+        """Ricetta di 200 registri e 20 coil in poche transazioni"""
+        slave = FakeSlave()
+        buffer = write_behind(slave, delay=None)
+        futures = [buffer.write_register(addr, addr) for addr in range(200)]
+        old = buffer.write_register(10, 999)
+        new = buffer.write_registers(10, [1000, 1001])
+        coils = [buffer.write_coil(1, bit, bit % 2) for bit in range(20)]
+        self.assertEqual(buffer.pending(), 220)
+        self.assertEqual(buffer.flush(), 3)
+        self.assertEqual(slave.requests, [16, 16, 15])
+        self.assertEqual(slave.read(9, 4), [9, 1000, 1001, 12])
+        self.assertEqual(slave.read(199, 1), [199])
+        self.assertEqual([slave.coils[16 + bit] for bit in range(4)], [False, True, False, True])
+        for future in futures + coils + [old, new]:
+            self.assertIsNone(future.result(timeout=0))
+        self.assertEqual(buffer.flush(), 0)
+
+    def test_deadline_and_error(self):
+        """Flush automatico dopo delay, eccezione nel future"""
+        slave = FakeSlave(rejected={15})
+        buffer = write_behind(slave, delay=0.01)
+        reg = buffer.write_register(5, 55)
+        coil = buffer.write_coil(0, 3, True)
+        self.assertIsNone(reg.result(timeout=2))
+        with self.assertRaises(mvmodbus2.EFrame):
+            coil.result(timeout=2)
+        self.assertEqual(slave.read(5, 1), [55])
+        buffer.close()
+
+    def test_bad_value(self):
+        """Valore fuori range: ValueError subito, errori imprevisti nei future"""
+        slave = FakeSlave()
+        buffer = write_behind(slave, delay=None)
+        with self.assertRaises(ValueError):
+            buffer.write_register(0, 0x10000)
+        with self.assertRaises(ValueError):
+            buffer.write_registers(0, [1, -1])
+        self.assertEqual(buffer.pending(), 0)
+        broken = buffer.write_register(0, 1.5)  # struct.error al momento dell'invio
+        good = buffer.write_register(10, 7)
+        self.assertEqual(buffer.flush(), 2)
+        with self.assertRaises(struct.error):
+            broken.result(timeout=0)
+        self.assertIsNone(good.result(timeout=0))
+        self.assertEqual(slave.read(10, 1), [7])
+
+
+if __name__ == '__main__':
+    unittest.main()